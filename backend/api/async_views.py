@@ -0,0 +1,141 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import AsyncIterator, Callable, Iterable, List
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections, connections
+from django.urls import URLPattern, URLResolver
+
+from api.db_pool import check_connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_READ_THREADS,
+            thread_name_prefix='api-read')
+    return _executor
+
+
+def run_view(view: Callable, request, *args, **kwargs):
+    """Выполняет синхронную вьюху в потоке пула чтения. Соединения
+    с БД в этих потоках живут отдельно от потоков запросов,
+    поэтому их возраст и исправность проверяются здесь, а не
+    по сигналам начала и конца запроса. Потоковый ответ не собирается
+    здесь целиком: его читает StreamingASGIHandler."""
+    close_old_connections()
+    check_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_read_view(view: Callable) -> Callable:
+    """Асинхронная обертка вьюхи для работы под ASGI.
+
+    В Django 3.2 нет асинхронного ORM, поэтому чтения выполняются
+    в пуле из ASYNC_READ_THREADS потоков: пул ограничивает число
+    одновременных запросов к БД, а цикл событий тем временем
+    обслуживает остальные соединения. Изменяющие запросы идут
+    обычным путем Django для синхронного кода.
+    """
+    offloaded = sync_to_async(run_view, thread_sensitive=False,
+                              executor=get_executor())
+    in_request_thread = sync_to_async(view)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await offloaded(view, request, *args, **kwargs)
+        return await in_request_thread(request, *args, **kwargs)
+
+    return wrapper
+
+
+def async_read_patterns(patterns: List) -> List:
+    """Заменяет вьюхи в маршрутах на асинхронные обертки, если
+    включен пул чтения (ASYNC_READ_THREADS > 0)."""
+    if settings.ASYNC_READ_THREADS <= 0:
+        return patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            async_read_patterns(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            pattern.callback = async_read_view(pattern.callback)
+    return patterns
+
+
+def finish_stream(iterator) -> None:
+    close = getattr(iterator, 'close', None)
+    if close is not None:
+        close()
+    connections.close_all()
+
+
+async def iterate_in_thread(iterable: Iterable) -> AsyncIterator:
+    """Асинхронный итератор по синхронному. Части читаются
+    в отдельном потоке, чтобы запросы к БД в генераторе не блокировали
+    цикл событий. Поток у потока данных один: курсор и соединение
+    с БД не переходят между потоками."""
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1,
+                                  thread_name_prefix='api-stream')
+    iterator = iter(iterable)
+    finished = object()
+    try:
+        while True:
+            part = await loop.run_in_executor(executor, next, iterator,
+                                              finished)
+            if part is finished:
+                break
+            yield part
+    finally:
+        await loop.run_in_executor(executor, finish_stream, iterator)
+        executor.shutdown(wait=False)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """Обработчик ASGI, который отдает потоковые ответы частями
+    по мере чтения. ASGIHandler в Django 3.2 перебирает потоковый
+    ответ прямо в цикле событий, где запросы к БД запрещены, здесь
+    же части читаются через iterate_in_thread."""
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        content = iterate_in_thread(response.streaming_content)
+        response.streaming_content = ()
+
+        async def send_with_content(message):
+            if (message['type'] == 'http.response.body'
+                    and not message.get('more_body')):
+                try:
+                    async for part in content:
+                        for chunk, _ in self.chunk_bytes(part):
+                            await send({'type': 'http.response.body',
+                                        'body': chunk, 'more_body': True})
+                finally:
+                    await content.aclose()
+            await send(message)
+
+        await super().send_response(response, send_with_content)
+
+
+def get_asgi_application() -> StreamingASGIHandler:
+    """Аналог django.core.asgi.get_asgi_application
+    с StreamingASGIHandler."""
+    django.setup(set_prefix=False)
+    return StreamingASGIHandler()
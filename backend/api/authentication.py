@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from api.cache import token_cache
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, которая берет пользователя из кэша
+    токенов вместо запроса Token + User к БД.
+
+    В кэш попадают только действующие токены активных
+    пользователей. Сбрасывают кэш обработчики сигналов: удаление
+    токена (выход, удаление через QuerySet.delete()), сохранение
+    пользователя с изменением пароля, роли или полей снимка
+    и UserQuerySet.update() тех же полей. Изменения в обход ORM
+    (сырой SQL, правка БД вручную) сигналов не вызывают: такой
+    токен принимается со старым снимком не дольше
+    AUTH_TOKEN_CACHE_TIMEOUT секунд, поэтому срок держится коротким.
+    Без общего кэша (settings.SHARED_CACHE) сброс в одном воркере
+    не виден другим, поэтому кэш не используется и токен
+    проверяется по БД в каждом запросе.
+    """
+
+    def authenticate_credentials(self, key):
+        if not settings.SHARED_CACHE:
+            return super().authenticate_credentials(key)
+        snapshot = token_cache.get(key)
+        if snapshot is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user)
+            return user, token
+        # from_db ждет значения в порядке полей модели.
+        user_model = get_user_model()
+        names = [field.attname for field in user_model._meta.concrete_fields
+                 if field.attname in snapshot]
+        user = user_model.from_db(DEFAULT_DB_ALIAS, names,
+                                  [snapshot[name] for name in names])
+        return user, Token(key=key, user=user)
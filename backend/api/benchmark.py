@@ -0,0 +1,323 @@
+import random
+import time
+import tracemalloc
+from contextlib import nullcontext
+from typing import (Callable, ContextManager, Dict, List, NamedTuple,
+                    Optional, Union)
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.stats import percentile
+from foodgram.counters import reconcile_counters
+from foodgram.feed import rebuild_feeds
+from foodgram.leaderboard import rebuild_leaderboard
+from foodgram.models import (FavoriteRecipe, Follow, Ingredient, Recipe,
+                             RecipeIngredient, ShoppingCart, Tag)
+from users.models import User
+
+# Размеры синтетического набора данных. Значения follows, favorites
+# и carts задаются на одного пользователя.
+SCALES = {
+    'small': {'users': 20, 'recipes': 100, 'ingredients': 200,
+              'ingredients_per_recipe': 5, 'follows': 5, 'favorites': 10,
+              'carts': 5},
+    'medium': {'users': 200, 'recipes': 2000, 'ingredients': 2000,
+               'ingredients_per_recipe': 8, 'follows': 20, 'favorites': 30,
+               'carts': 10},
+    'large': {'users': 2000, 'recipes': 20000, 'ingredients': 5000,
+              'ingredients_per_recipe': 10, 'follows': 50, 'favorites': 50,
+              'carts': 15},
+}
+
+# Число рецептов в пакетных запросах к избранному и корзине.
+BULK_SIZE = 20
+BENCHMARK_PASSWORD = 'Benchmark-password-1'
+BENCHMARK_IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgM'
+                   'AAABieywaAAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOx'
+                   'AGVKw4bAAAACklEQVQImWNoAAAAggCByxOyYQAAAABJRU5ErkJggg==')
+
+
+def seed_dataset(scale: str, seed: int = 0) -> dict:
+    """Заполняет БД синтетическими данными заданного размера
+    и возвращает контекст для адресов эндпоинтов.
+
+    Читатель (reader) подписан на часть авторов, у него есть избранное
+    и корзина. Отдельно оставлены рецепт и автор, с которыми
+    у читателя нет связей, для проверки добавления и удаления.
+    Строки создаются через bulk_create без сигналов, поэтому
+    счетчики и рейтинг пересчитываются в конце.
+    """
+    sizes = SCALES[scale]
+    rng = random.Random(seed)
+    User.objects.bulk_create(
+        User(username=f'bench_user_{number}',
+             email=f'bench_user_{number}@ya.ru',
+             first_name='Имя', last_name='Фамилия', password='!')
+        for number in range(sizes['users']))
+    reader = User.objects.create_user(
+        username='bench_reader', email='bench_reader@ya.ru',
+        first_name='Имя', last_name='Фамилия', password=BENCHMARK_PASSWORD)
+    authors = list(User.objects.exclude(id=reader.id).values_list(
+        'id', flat=True))
+
+    tags = Tag.objects.bulk_create(
+        Tag(name=f'Тэг {number}', color=f'#00000{number}',
+            slug=f'tag-{number}') for number in range(3))
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+        for number in range(sizes['ingredients']))
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+
+    Recipe.objects.bulk_create(
+        Recipe(author_id=rng.choice(authors), name=f'Рецепт {number}',
+               text='Описание', cooking_time=rng.randint(1, 120),
+               image='recipes/images/benchmark.png')
+        for number in range(sizes['recipes']))
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe_id, tag_id=rng.choice(tag_ids))
+        for recipe_id in recipe_ids)
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                         amount=rng.randint(1, 500))
+        for recipe_id in recipe_ids
+        for ingredient_id in rng.sample(ingredient_ids,
+                                        sizes['ingredients_per_recipe']))
+
+    free_author = authors[-1]
+    free_recipe = Recipe.objects.create(
+        author_id=free_author, name='Свободный рецепт', text='Описание',
+        cooking_time=5, image='recipes/images/benchmark.png')
+    followers = [reader.id] + authors
+    Follow.objects.bulk_create(
+        Follow(user_id=user_id, following_id=following_id)
+        for user_id in followers
+        for following_id in rng.sample(authors[:-1], sizes['follows'])
+        if following_id != user_id)
+    for model, size in ((FavoriteRecipe, sizes['favorites']),
+                        (ShoppingCart, sizes['carts'])):
+        model.objects.bulk_create(
+            model(user_id=user_id, recipe_id=recipe_id)
+            for user_id in followers
+            for recipe_id in rng.sample(recipe_ids, size))
+    related = set(FavoriteRecipe.objects.filter(user=reader).values_list(
+        'recipe_id', flat=True)).union(ShoppingCart.objects.filter(
+            user=reader).values_list('recipe_id', flat=True))
+    bulk_recipes = [recipe_id for recipe_id in recipe_ids
+                    if recipe_id not in related][:BULK_SIZE]
+    reconcile_counters()
+    rebuild_leaderboard(full=True)
+    rebuild_feeds()
+
+    return {
+        'reader': reader,
+        'recipe': recipe_ids[0],
+        'free_recipe': free_recipe.id,
+        'bulk_recipes': bulk_recipes,
+        'author': authors[0],
+        'free_author': free_author,
+        'tag': tags[0].slug,
+        'tag_id': tag_ids[0],
+        'ingredient': ingredient_ids[0],
+        'ingredient_ids': ingredient_ids[:sizes['ingredients_per_recipe']],
+        'ingredient_list': ','.join(
+            map(str, ingredient_ids[:sizes['ingredients_per_recipe']])),
+        'password': BENCHMARK_PASSWORD,
+    }
+
+
+class Endpoint(NamedTuple):
+    """Запрос к API с бюджетом на число SQL-запросов.
+
+    В path и data подставляются значения из контекста набора данных,
+    data также может быть функцией от контекста.
+    Если задан save_as, id из ответа сохраняется в контекст под этим
+    именем для следующих эндпоинтов.
+    """
+    name: str
+    method: str
+    path: str
+    budget: int
+    data: Union[dict, Callable[[dict], dict], None] = None
+    status: int = 200
+    anonymous: bool = False
+    save_as: Optional[str] = None
+
+
+def recipe_payload(context: dict) -> dict:
+    return {
+        'tags': [context['tag_id']],
+        'ingredients': [{'id': ingredient_id, 'amount': 10}
+                        for ingredient_id in context['ingredient_ids']],
+        'name': 'Рецепт для замера',
+        'image': BENCHMARK_IMAGE,
+        'text': 'Описание',
+        'cooking_time': 5,
+    }
+
+
+# Эндпоинты выполняются по порядку, поэтому парные запросы
+# (создание и удаление) оставляют данные в исходном состоянии.
+ENDPOINTS = [
+    Endpoint('ingredients list', 'get', '/api/ingredients/', 3),
+    Endpoint('ingredients search', 'get', '/api/ingredients/?name=ингр', 3),
+    Endpoint('ingredient detail', 'get', '/api/ingredients/{ingredient}/', 4),
+    Endpoint('tags list', 'get', '/api/tags/', 3),
+    Endpoint('tag detail', 'get', '/api/tags/{tag_id}/', 4),
+    Endpoint('recipes list', 'get', '/api/recipes/', 8),
+    Endpoint('recipes list, anonymous', 'get', '/api/recipes/', 6,
+             anonymous=True),
+    Endpoint('recipes list, filtered', 'get',
+             '/api/recipes/?tags={tag}&is_favorited=1', 8),
+    Endpoint('recipes list, search', 'get',
+             '/api/recipes/?search=рецепт', 8),
+    Endpoint('recipes cookable', 'get',
+             '/api/recipes/cookable/?ingredients={ingredient_list}', 7),
+    Endpoint('recipes list, popular', 'get', '/api/recipes/?ordering=popular',
+             8),
+    Endpoint('recipes list, cursor', 'get', '/api/recipes/?cursor=', 7),
+    Endpoint('recipe detail', 'get', '/api/recipes/{recipe}/', 7),
+    Endpoint('recipe create', 'post', '/api/recipes/', 21, data=recipe_payload,
+             status=201, save_as='created_recipe'),
+    Endpoint('recipe update', 'patch', '/api/recipes/{created_recipe}/', 16,
+             data={'name': 'Новое название'}),
+    Endpoint('recipe delete', 'delete', '/api/recipes/{created_recipe}/', 17,
+             status=204),
+    Endpoint('favorite add', 'post', '/api/recipes/{free_recipe}/favorite/',
+             6, status=201),
+    Endpoint('favorite remove', 'delete',
+             '/api/recipes/{free_recipe}/favorite/', 3, status=204),
+    Endpoint('favorites bulk add', 'post', '/api/recipes/favorite/', 7,
+             data=lambda context: {'add': context['bulk_recipes']}),
+    Endpoint('favorites bulk remove', 'post', '/api/recipes/favorite/', 6,
+             data=lambda context: {'remove': context['bulk_recipes']}),
+    Endpoint('shopping cart bulk add', 'post',
+             '/api/recipes/shopping_cart/', 9,
+             data=lambda context: {'add': context['bulk_recipes']}),
+    Endpoint('shopping cart bulk remove', 'post',
+             '/api/recipes/shopping_cart/', 7,
+             data=lambda context: {'remove': context['bulk_recipes']}),
+    Endpoint('shopping cart add', 'post',
+             '/api/recipes/{free_recipe}/shopping_cart/', 9, status=201),
+    Endpoint('shopping cart remove', 'delete',
+             '/api/recipes/{free_recipe}/shopping_cart/', 6, status=204),
+    Endpoint('shopping cart summary', 'get', '/api/recipes/shopping_cart/',
+             3),
+    Endpoint('download shopping cart', 'get', '/api/download_shopping_cart/',
+             4),
+    Endpoint('download shopping cart, recipes', 'get',
+             '/api/recipes/download_shopping_cart/', 4),
+    Endpoint('subscriptions', 'get', '/api/users/subscriptions/', 5),
+    Endpoint('subscriptions feed', 'get', '/api/recipes/feed/', 7),
+    Endpoint('subscribe', 'post', '/api/users/{free_author}/subscribe/', 12,
+             status=201),
+    Endpoint('unsubscribe', 'delete', '/api/users/{free_author}/subscribe/',
+             4, status=204),
+    Endpoint('users list', 'get', '/api/users/', 4),
+    Endpoint('user detail', 'get', '/api/users/{author}/', 4),
+    Endpoint('current user', 'get', '/api/users/me/', 3),
+    Endpoint('user create', 'post', '/api/users/', 5,
+             data={'username': 'bench_new_{repeat}',
+                   'email': 'bench_new_{repeat}@ya.ru',
+                   'first_name': 'Имя', 'last_name': 'Фамилия',
+                   'password': '{password}'},
+             status=201, anonymous=True),
+    Endpoint('set password', 'post', '/api/users/set_password/', 3,
+             data={'current_password': '{password}',
+                   'new_password': '{password}'},
+             status=204),
+    Endpoint('token login', 'post', '/api/auth/token/login/', 7,
+             data={'email': 'bench_reader@ya.ru', 'password': '{password}'},
+             anonymous=True),
+    Endpoint('token logout', 'post', '/api/auth/token/logout/', 3,
+             status=204),
+]
+
+
+def fill(value, context: dict):
+    if isinstance(value, str):
+        return value.format(**context)
+    if isinstance(value, dict):
+        return {key: fill(item, context) for key, item in value.items()}
+    return value
+
+
+def call(client, anonymous_client, endpoint: Endpoint, context: dict):
+    data = (endpoint.data(context) if callable(endpoint.data)
+            else fill(endpoint.data, context))
+    http_client = anonymous_client if endpoint.anonymous else client
+    response = getattr(http_client, endpoint.method)(
+        fill(endpoint.path, context), data, format='json')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    if response.status_code != endpoint.status:
+        raise AssertionError(
+            f'{endpoint.name}: ответ {response.status_code}, '
+            f'ожидался {endpoint.status}')
+    if endpoint.save_as:
+        context[endpoint.save_as] = response.data['id']
+    return response
+
+
+def run_benchmark(client, anonymous_client, context: dict,
+                  endpoints: List[Endpoint] = ENDPOINTS,
+                  repeats: int = 5,
+                  request_context: Callable[[], ContextManager] = nullcontext
+                  ) -> List[dict]:
+    """Выполняет эндпоинты repeats раз и возвращает для каждого
+    число SQL-запросов, p50/p95 времени ответа в миллисекундах
+    и пиковое потребление памяти в килобайтах.
+
+    Первый проход прогревочный: в нем под tracemalloc замеряется
+    только память, чтобы трассировка не искажала время ответа.
+    Каждый запрос выполняется внутри request_context(): в тестах
+    это captureOnCommitCallbacks(execute=True), чтобы в замер
+    попадали и обработчики on_commit, которые иначе не выполняются
+    в транзакции теста.
+    """
+    timings: Dict[str, List[float]] = {item.name: [] for item in endpoints}
+    queries: Dict[str, int] = {item.name: 0 for item in endpoints}
+    memory: Dict[str, int] = {}
+    tracemalloc.start()
+    try:
+        for endpoint in endpoints:
+            context['repeat'] = 'warmup'
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            with request_context():
+                call(client, anonymous_client, endpoint, context)
+            memory[endpoint.name] = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    for repeat in range(repeats):
+        context['repeat'] = repeat
+        for endpoint in endpoints:
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                with request_context():
+                    call(client, anonymous_client, endpoint, context)
+                elapsed = time.perf_counter() - started
+            timings[endpoint.name].append(elapsed * 1000)
+            queries[endpoint.name] = max(queries[endpoint.name],
+                                         len(captured.captured_queries))
+    return [{
+        'name': endpoint.name,
+        'queries': queries[endpoint.name],
+        'budget': endpoint.budget,
+        'p50': percentile(timings[endpoint.name], 50),
+        'p95': percentile(timings[endpoint.name], 95),
+        'memory': memory[endpoint.name] / 1024,
+    } for endpoint in endpoints]
+
+
+def format_report(results: List[dict]) -> str:
+    lines = [f'{"endpoint":<34}{"queries":>9}{"budget":>8}'
+             f'{"p50, ms":>10}{"p95, ms":>10}{"peak, KiB":>11}']
+    for result in results:
+        lines.append(
+            f'{result["name"]:<34}{result["queries"]:>9}'
+            f'{result["budget"]:>8}{result["p50"]:>10.1f}'
+            f'{result["p95"]:>10.1f}{result["memory"]:>11.0f}')
+    return '\n'.join(lines)
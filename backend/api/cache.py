@@ -0,0 +1,201 @@
+import hashlib
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.views.decorators.http import condition
+from rest_framework.response import Response
+
+from backend.constants import (AUTH_TOKEN_CACHE_TIMEOUT,
+                               AUTH_TOKEN_USER_FIELDS, LOCAL_CACHE_TIMEOUT,
+                               RECIPE_CACHE_TIMEOUT, REFERENCE_CACHE_TIMEOUT)
+
+
+def cache_timeout(timeout: Optional[float]) -> Optional[float]:
+    """Срок записи в кэше Django. Если кэш не общий для процессов
+    (settings.SHARED_CACHE), сброс в одном воркере не виден другим,
+    поэтому запись живет не дольше LOCAL_CACHE_TIMEOUT секунд."""
+    if settings.SHARED_CACHE:
+        return timeout
+    if timeout is None:
+        return LOCAL_CACHE_TIMEOUT
+    return min(timeout, LOCAL_CACHE_TIMEOUT)
+
+
+class ReferenceCache:
+    """Версионный кэш справочных данных (тэги, ингредиенты).
+
+    Текущая версия справочника хранится в кэше Django. С общим
+    кэшем (settings.SHARED_CACHE) ее смена видна всем процессам,
+    с кэшем в памяти процесса версия и значения живут
+    LOCAL_CACHE_TIMEOUT секунд. Значения кэшируются под ключом
+    с версией: после изменения справочника старые ключи просто
+    перестают читаться. Поверх кэша Django работает словарь
+    в памяти процесса, который избавляет от повторной
+    десериализации больших списков; его записи тоже живут
+    не дольше LOCAL_CACHE_TIMEOUT секунд.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.version_key = f'reference:{name}:version'
+        self._local = {}
+
+    def new_version(self) -> dict:
+        return {'token': uuid.uuid4().hex, 'modified': time.time()}
+
+    def get_version(self) -> dict:
+        version = cache.get(self.version_key)
+        if version is None:
+            version = self.new_version()
+            if not cache.add(self.version_key, version,
+                             cache_timeout(None)):
+                version = cache.get(self.version_key) or version
+        return version
+
+    def invalidate(self) -> None:
+        self._local.clear()
+        cache.set(self.version_key, self.new_version(), cache_timeout(None))
+
+    def get_or_set(self, suffix: str, default: Callable[[], Any]) -> Any:
+        token = self.get_version()['token']
+        local = self._local.get(suffix)
+        if (local is not None and local[0] == token
+                and local[2] > time.monotonic()):
+            return local[1]
+        value = cache.get_or_set(f'reference:{self.name}:{token}:{suffix}',
+                                 default,
+                                 cache_timeout(REFERENCE_CACHE_TIMEOUT))
+        self._local[suffix] = (token, value,
+                               time.monotonic() + LOCAL_CACHE_TIMEOUT)
+        return value
+
+    def etag(self, request, *args, **kwargs) -> str:
+        return f'"{self.name}-{self.get_version()["token"]}"'
+
+    def last_modified(self, request, *args, **kwargs) -> datetime:
+        return datetime.fromtimestamp(self.get_version()['modified'],
+                                      tz=timezone.utc)
+
+
+tags_cache = ReferenceCache('tags')
+ingredients_cache = ReferenceCache('ingredients')
+
+
+class ReferenceCacheMixin:
+    """Миксин вьюсета справочника: список берется из кэша,
+    ответы снабжаются заголовками ETag и Last-Modified,
+    повторный запрос с совпадающим ETag получает ответ 304."""
+    reference_cache: ReferenceCache = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        return condition(
+            etag_func=self.reference_cache.etag,
+            last_modified_func=self.reference_cache.last_modified,
+        )(super().dispatch)(request, *args, **kwargs)
+
+    def get_cached_list(self):
+        return self.reference_cache.get_or_set('list', lambda: list(
+            self.get_serializer(self.get_queryset(), many=True).data))
+
+    def list(self, request, *args, **kwargs):
+        return Response(self.get_cached_list())
+
+
+class RecipeCache:
+    """Кэш представления рецепта без флагов текущего пользователя.
+
+    У каждого рецепта своя версия в кэше Django. Представление
+    хранится под ключом с версией, поэтому для сброса достаточно
+    удалить ключ версии. Без общего кэша (settings.SHARED_CACHE)
+    сброс виден только своему процессу, поэтому версия
+    и представление живут LOCAL_CACHE_TIMEOUT секунд. Флаги
+    избранного, корзины и подписки на автора подставляются в копию
+    представления для каждого запроса. Ссылка на изображение
+    абсолютная, поэтому в ключ входит адрес сайта из запроса.
+    """
+    user_flags = ('is_favorited', 'is_in_shopping_cart')
+
+    def version_key(self, recipe_id: int) -> str:
+        return f'recipe:{recipe_id}:version'
+
+    def get_version(self, recipe_id: int) -> str:
+        key = self.version_key(recipe_id)
+        version = cache.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version,
+                             cache_timeout(RECIPE_CACHE_TIMEOUT)):
+                version = cache.get(key) or version
+        return version
+
+    def invalidate(self, recipe_ids: Iterable[int]) -> None:
+        cache.delete_many([self.version_key(recipe_id)
+                           for recipe_id in recipe_ids])
+
+    def etag(self, recipe_id: int, version: str,
+             flags: Tuple[bool, bool, bool]) -> str:
+        bits = ''.join('1' if flag else '0' for flag in flags)
+        return f'"recipe-{recipe_id}-{version}-{bits}"'
+
+    def get_or_set(self, recipe_id: int, version: str, request,
+                   default: Callable[[], Dict]) -> Dict:
+        key = (f'recipe:{recipe_id}:{version}:'
+               f'{request.scheme}://{request.get_host()}')
+        data = cache.get(key)
+        if data is None:
+            data = dict(default())
+            for flag in self.user_flags:
+                data[flag] = False
+            data['author'] = {**data['author'], 'is_subscribed': False}
+            cache.set(key, data,
+                      cache_timeout(RECIPE_CACHE_TIMEOUT))
+        return data
+
+    def with_flags(self, data: Dict,
+                   flags: Tuple[bool, bool, bool]) -> Dict:
+        favorited, in_shopping_cart, subscribed = flags
+        return {**data,
+                'author': {**data['author'], 'is_subscribed': subscribed},
+                'is_favorited': favorited,
+                'is_in_shopping_cart': in_shopping_cart}
+
+
+recipe_cache = RecipeCache()
+
+
+class TokenCache:
+    """Кэш «токен → снимок пользователя» для аутентификации.
+
+    Снимок хранит поля, которые нужны проверкам прав и ответу
+    /users/me/, остальные поля пользователя подгружаются при
+    обращении. Записи живут AUTH_TOKEN_CACHE_TIMEOUT секунд в кэше
+    Django. Сброс при выходе или смене пароля и роли виден всем
+    процессам только в общем кэше, поэтому без него
+    CachingTokenAuthentication кэш не использует. В ключ входит
+    хэш токена, а не сам токен.
+    """
+    fields = AUTH_TOKEN_USER_FIELDS
+
+    def key(self, token_key: str) -> str:
+        digest = hashlib.sha256(token_key.encode()).hexdigest()[:40]
+        return f'auth:token:{digest}'
+
+    def get(self, token_key: str) -> Optional[Dict]:
+        return cache.get(self.key(token_key))
+
+    def set(self, token_key: str, user) -> None:
+        cache.set(self.key(token_key),
+                  {field: getattr(user, field) for field in self.fields},
+                  AUTH_TOKEN_CACHE_TIMEOUT)
+
+    def invalidate(self, token_keys: Iterable[str]) -> None:
+        cache.delete_many([self.key(token_key) for token_key in token_keys])
+
+
+token_cache = TokenCache()
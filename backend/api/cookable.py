@@ -0,0 +1,198 @@
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple
+
+from backend.constants import COOKABLE_INDEX_TTL
+from foodgram.models import RecipeIngredient
+
+
+class CookableRecipe(NamedTuple):
+    recipe_id: int
+    missing_count: int
+    coverage: float
+
+
+def to_bitset(slots: Iterable[int]) -> int:
+    slots = list(slots)
+    if not slots:
+        return 0
+    bits = bytearray(max(slots) // 8 + 1)
+    for slot in slots:
+        bits[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def iter_bits_descending(bitset: int):
+    """Номера установленных битов от старшего к младшему."""
+    digits = bin(bitset)[2:]
+    top = len(digits) - 1
+    position = digits.find('1')
+    while position != -1:
+        yield top - position
+        position = digits.find('1', position + 1)
+
+
+class CookableIndex:
+    """Битовый индекс «ингредиент → рецепты» в памяти процесса.
+
+    Каждому рецепту выделяется номер бита в порядке возрастания id.
+    Для каждого ингредиента хранится целое число, биты которого
+    отмечают рецепты с этим ингредиентом, и отдельно — множества
+    рецептов с одинаковым числом ингредиентов. Число совпадений
+    с набором имеющихся ингредиентов считается побитовым сложением
+    в двоичных разрядах (bit-plane), поэтому стоимость запроса
+    зависит от числа ингредиентов в запросе, а не от числа
+    рецептов, где они встречаются.
+
+    Изменившиеся рецепты переиндексируются по одному, весь индекс
+    перестраивается раз в COOKABLE_INDEX_TTL секунд, чтобы
+    подхватить изменения из других процессов.
+    """
+
+    def __init__(self, ttl: int = COOKABLE_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._bitsets = None
+        self._built_at = 0.0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._bitsets = None
+
+    def is_stale(self) -> bool:
+        return (self._bitsets is None
+                or time.monotonic() - self._built_at > self.ttl)
+
+    def load(self, recipe_ids=None) -> Dict[int, set]:
+        rows = RecipeIngredient.objects.values_list('recipe_id',
+                                                    'ingredient_id')
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        recipes = defaultdict(set)
+        for recipe_id, ingredient_id in rows.iterator():
+            recipes[recipe_id].add(ingredient_id)
+        return recipes
+
+    def build(self) -> None:
+        recipes = self.load()
+        self._slot_ids = sorted(recipes)
+        self._slots = {recipe_id: slot
+                       for slot, recipe_id in enumerate(self._slot_ids)}
+        self._recipes = {}
+        postings = defaultdict(list)
+        sizes = defaultdict(list)
+        for slot, recipe_id in enumerate(self._slot_ids):
+            ingredient_ids = frozenset(recipes[recipe_id])
+            self._recipes[slot] = ingredient_ids
+            sizes[len(ingredient_ids)].append(slot)
+            for ingredient_id in ingredient_ids:
+                postings[ingredient_id].append(slot)
+        self._bitsets = {ingredient_id: to_bitset(slots)
+                         for ingredient_id, slots in postings.items()}
+        self._sizes = {size: to_bitset(slots)
+                       for size, slots in sizes.items()}
+        self._built_at = time.monotonic()
+
+    def set_bit(self, table: dict, key: int, slot: int, value: bool) -> None:
+        bitset = table.get(key, 0)
+        bitset = bitset | (1 << slot) if value else bitset & ~(1 << slot)
+        if bitset:
+            table[key] = bitset
+        else:
+            table.pop(key, None)
+
+    def update(self, recipe_ids: Iterable[int]) -> None:
+        """Переиндексирует рецепты после изменения. Если индекс
+        еще не построен, он будет построен при первом запросе."""
+        recipe_ids = list(recipe_ids)
+        with self._lock:
+            if self._bitsets is None:
+                return
+            recipes = self.load(recipe_ids)
+            for recipe_id in recipe_ids:
+                slot = self._slots.get(recipe_id)
+                if slot is None:
+                    if recipe_id not in recipes:
+                        continue
+                    slot = len(self._slot_ids)
+                    self._slot_ids.append(recipe_id)
+                    self._slots[recipe_id] = slot
+                old = self._recipes.pop(slot, frozenset())
+                new = frozenset(recipes.get(recipe_id, ()))
+                if old:
+                    self.set_bit(self._sizes, len(old), slot, False)
+                if new:
+                    self._recipes[slot] = new
+                    self.set_bit(self._sizes, len(new), slot, True)
+                for ingredient_id in old - new:
+                    self.set_bit(self._bitsets, ingredient_id, slot, False)
+                for ingredient_id in new - old:
+                    self.set_bit(self._bitsets, ingredient_id, slot, True)
+
+    def count_matches(self, ingredient_ids: Iterable[int]) -> List[int]:
+        """Двоичные разряды числа совпадений для каждого рецепта."""
+        planes = []
+        for ingredient_id in set(ingredient_ids):
+            carry = self._bitsets.get(ingredient_id, 0)
+            for index, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[index], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+        return planes
+
+    def search(self, ingredient_ids: Iterable[int], limit: int,
+               max_missing: int = None) -> List[CookableRecipe]:
+        """Рецепты хотя бы с одним из имеющихся ингредиентов:
+        сначала те, где недостает меньше ингредиентов, затем
+        с большей долей имеющихся, затем более новые."""
+        with self._lock:
+            if self.is_stale():
+                self.build()
+            planes = self.count_matches(ingredient_ids)
+            matched = 0
+            for plane in planes:
+                matched |= plane
+            max_matches = 2 ** len(planes) - 1
+            equal = {}
+
+            def matches_equal(matches: int) -> int:
+                if matches not in equal:
+                    mask = matched
+                    for index, plane in enumerate(planes):
+                        mask &= plane if matches >> index & 1 else ~plane
+                    equal[matches] = mask
+                return equal[matches]
+
+            sizes = sorted(self._sizes, reverse=True)
+            largest = sizes[0] if sizes else 0
+            if max_missing is None or max_missing > largest:
+                max_missing = largest
+            results = []
+            for missing in range(max_missing + 1):
+                # При одинаковом числе недостающих доля имеющихся
+                # больше у рецептов с большим числом ингредиентов.
+                # Без недостающих доля у всех равна 1, и рецепты
+                # разных размеров идут вместе по новизне.
+                groups = [[size] for size in sizes]
+                if missing == 0:
+                    groups = [sizes]
+                for group in groups:
+                    mask = 0
+                    for size in group:
+                        matches = size - missing
+                        if 1 <= matches <= max_matches:
+                            mask |= self._sizes[size] & matches_equal(matches)
+                    for slot in iter_bits_descending(mask):
+                        size = len(self._recipes[slot])
+                        results.append(CookableRecipe(
+                            self._slot_ids[slot], missing,
+                            (size - missing) / size))
+                        if len(results) >= limit:
+                            return results
+            return results
+
+
+cookable_index = CookableIndex()
@@ -1,14 +1,21 @@
-import django_filters
+from django.db.models import F
 from django_filters import FilterSet, filters, widgets
 
-from foodgram.models import Recipe, Tag, User
+from api.cache import tags_cache
+from api.recipe_search import search_recipes
+from foodgram.models import Recipe, Tag
+
+
+def get_tag_choices():
+    """Варианты фильтра по тэгам из кэша справочника."""
+    return tags_cache.get_or_set(
+        'choices', lambda: list(Tag.objects.values_list('slug', 'name')))
 
 
 class RecipeFilter(FilterSet):
-    tags = django_filters.ModelMultipleChoiceFilter(
+    tags = filters.MultipleChoiceFilter(
         field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+        choices=get_tag_choices,
     )
     is_favorited = filters.BooleanFilter(
         widget=widgets.BooleanWidget(),
@@ -16,12 +23,17 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         widget=widgets.BooleanWidget(),
         method='filter_is_in_shopping_cart')
-    author = filters.ModelChoiceFilter(queryset=User.objects.all())
+    author = filters.NumberFilter(field_name='author_id')
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'Популярные'),
+                 ('trending', 'Набирают популярность')),
+        method='filter_ordering')
 
     class Meta:
         model = Recipe
         fields = ['tags__slug', 'is_favorited', 'is_in_shopping_cart',
-                  'author']
+                  'author', 'search', 'ordering']
 
     def filter_is_favorited(self, queryset, name, value):
         if value:
@@ -32,3 +44,18 @@ class RecipeFilter(FilterSet):
         if value:
             return queryset.filter(recipe_cart__user=self.request.user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, ингредиентам и описанию
+        с сортировкой по релевантности."""
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        """Сортировка по таблице рейтинга, которую пересчитывает
+        команда rebuild_leaderboard. Рецепты без рейтинга идут
+        в конце по дате публикации."""
+        score = F(f'score__{value}_score')
+        return queryset.order_by(score.desc(nulls_last=True), '-pub_date',
+                                 '-id')
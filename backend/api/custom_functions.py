@@ -1,21 +1,250 @@
-from typing import List
+import base64
+import binascii
+import hashlib
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Type
 
-from rest_framework.generics import get_object_or_404
-from foodgram.models import RecipeIngredient, Ingredient, Recipe
+from django.conf import settings
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile,
+                                            UploadedFile)
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import (Model, OuterRef, Prefetch, QuerySet,
+                              Subquery)
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.request import Request
 
+from backend.constants import BASE64_CHUNK_SIZE, IMAGE_MAX_SIZE
+from foodgram.counters import change_counters
+from foodgram.images import variant_name
 
-def add_ingredients(new_ingredients: List[Ingredient],
+from foodgram.models import RecipeIngredient, Recipe, Tag
+
+
+def add_ingredients(new_ingredients: List[dict],
                     instance: Recipe) -> None:
     """Используется в сериализаторе создания рецепта.
-    Добавляет ингредиенты в рецепт."""
-    new_recipe_ingredients = []
-    for ingredient_data in new_ingredients:
-        ingredient = get_object_or_404(Ingredient,
-                                       id=ingredient_data.get('id'))
-        recipe_ingredient = RecipeIngredient(
-            recipe=instance,
-            ingredient=ingredient,
-            amount=ingredient_data['amount']
-        )
-        new_recipe_ingredients.append(recipe_ingredient)
-    RecipeIngredient.objects.bulk_create(new_recipe_ingredients)
+    Добавляет ингредиенты в рецепт одним запросом. Объекты
+    ингредиентов подставляются при валидации сериализатора."""
+    if not new_ingredients:
+        return
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=instance,
+                         ingredient=ingredient_data['ingredient'],
+                         amount=ingredient_data['amount'])
+        for ingredient_data in new_ingredients)
+
+
+def update_ingredients(new_ingredients: List[dict],
+                       instance: Recipe) -> None:
+    """Используется в сериализаторе обновления рецепта.
+    Сравнивает новые ингредиенты с текущими и записывает только
+    разницу: новые строки, измененные количества и удаленные строки."""
+    current = {recipe_ingredient.ingredient_id: recipe_ingredient
+               for recipe_ingredient in instance.recipe_ingredients.all()}
+    new_amounts = {ingredient_data['id']: ingredient_data['amount']
+                   for ingredient_data in new_ingredients}
+    add_ingredients([ingredient_data for ingredient_data in new_ingredients
+                     if ingredient_data['id'] not in current], instance)
+    changed = []
+    for ingredient_id, recipe_ingredient in current.items():
+        amount = new_amounts.get(ingredient_id)
+        if amount is not None and amount != recipe_ingredient.amount:
+            recipe_ingredient.amount = amount
+            changed.append(recipe_ingredient)
+    if changed:
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+    removed = [recipe_ingredient.id
+               for ingredient_id, recipe_ingredient in current.items()
+               if ingredient_id not in new_amounts]
+    if removed:
+        RecipeIngredient.objects.filter(id__in=removed).delete()
+
+
+def update_tags(new_tags: List[Tag], instance: Recipe) -> None:
+    """Используется в сериализаторе обновления рецепта.
+    Добавляет и удаляет только изменившиеся тэги."""
+    current = {tag.id for tag in instance.tags.all()}
+    new = {tag.id for tag in new_tags}
+    if current - new:
+        instance.tags.remove(*(current - new))
+    if new - current:
+        instance.tags.add(*(new - current))
+
+
+def get_recipes_limit(request: Request) -> Optional[int]:
+    """Возвращает параметр recipes_limit из запроса,
+    если он задан положительным целым числом."""
+    recipes_limit = request.query_params.get('recipes_limit')
+    if recipes_limit is None or not recipes_limit.isdigit():
+        return None
+    return int(recipes_limit) or None
+
+
+def limited_recipes_queryset(recipes_limit: Optional[int]) -> QuerySet:
+    """Рецепты для карточки автора. Ограничение recipes_limit
+    применяется в БД отдельно для каждого автора."""
+    queryset = Recipe.objects.only('id', 'name', 'image', 'image_variants',
+                                   'cooking_time', 'author_id')
+    if recipes_limit:
+        latest_recipes = Recipe.objects.filter(
+            author=OuterRef('author')).values('id')[:recipes_limit]
+        queryset = queryset.filter(id__in=Subquery(latest_recipes))
+    return queryset
+
+
+def annotate_authors(queryset: QuerySet, request: Request) -> QuerySet:
+    """Используется для выдачи авторов с рецептами.
+    Добавляет к авторам флаг подписки и ограниченный набор
+    рецептов за фиксированное число запросов. Число рецептов
+    хранится в счетчике User.recipes_count."""
+    recipes = limited_recipes_queryset(get_recipes_limit(request))
+    return (queryset.with_subscription(request.user)
+            .prefetch_related(Prefetch('recipes', queryset=recipes,
+                                       to_attr='limited_recipes')))
+
+
+def decode_base64_image(data: str) -> UploadedFile:
+    """Декодирует изображение из data URL частями, не создавая
+    вторую полную копию в памяти. Большие файлы пишутся
+    во временный файл на диске. Попутно считается SHA-256
+    содержимого для хранилища с адресацией по хэшу."""
+    header, encoded = data.split(';base64,', 1)
+    extension = header.split('/')[-1].lower()
+    # Переносы строк и пробелы допустимы в base64, но сдвигают
+    # границы частей, поэтому убираются до декодирования.
+    encoded = ''.join(encoded.split())
+    size = len(encoded) // 4 * 3
+    if size > IMAGE_MAX_SIZE:
+        raise serializers.ValidationError(
+            f'Размер изображения больше {IMAGE_MAX_SIZE} байт')
+    name = f'image.{extension}'
+    content_type = f'image/{extension}'
+    if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        upload = TemporaryUploadedFile(name, content_type, size, None)
+    else:
+        upload = InMemoryUploadedFile(BytesIO(), None, name, content_type,
+                                      size, None)
+    digest = hashlib.sha256()
+    try:
+        for start in range(0, len(encoded), BASE64_CHUNK_SIZE):
+            chunk = base64.b64decode(
+                encoded[start:start + BASE64_CHUNK_SIZE], validate=True)
+            digest.update(chunk)
+            upload.file.write(chunk)
+    except (binascii.Error, ValueError):
+        upload.close()
+        raise serializers.ValidationError('Некорректные данные base64')
+    upload.size = upload.file.tell()
+    upload.file.seek(0)
+    upload.content_hash = digest.hexdigest()
+    return upload
+
+
+def image_url(request: Optional[Request], image: FieldFile,
+              variant: Optional[str] = None,
+              extension: str = 'jpg') -> Optional[str]:
+    """Ссылка на уменьшенную копию изображения. Пока копии
+    не созданы (флаг image_variants рецепта), возвращается ссылка
+    на оригинал. Хранилище при этом не опрашивается."""
+    if not image:
+        return None
+    name = image.name
+    if variant is not None and getattr(image.instance, 'image_variants',
+                                       False):
+        name = variant_name(name, variant, extension)
+    url = image.storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def create_relation(model: Type[Model], error_message: str,
+                    **fields) -> Model:
+    """Создает связь пользователя с рецептом или автором одним INSERT.
+    Повтор отсекается ограничением уникальности в БД."""
+    try:
+        with transaction.atomic():
+            return model.objects.create(**fields)
+    except IntegrityError:
+        raise serializers.ValidationError({'errors': error_message})
+
+
+def delete_relation(queryset: QuerySet, error_message: str) -> None:
+    """Удаляет связь одним DELETE. Если удалять нечего,
+    сообщает об ошибке."""
+    deleted, _ = queryset.delete()
+    if not deleted:
+        raise serializers.ValidationError({'errors': error_message})
+
+
+def delete_relations(model: Type[Model], user_id: int,
+                     recipe_ids: List[int]) -> None:
+    """Удаляет связи пользователя с рецептами одним DELETE, без
+    выборки строк и сигналов на каждую строку."""
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    user_column = model._meta.get_field('user').column
+    recipe_column = model._meta.get_field('recipe').column
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} '
+            f'WHERE {quote(user_column)} = %s '
+            f'AND {quote(recipe_column)} IN ({placeholders})',
+            [user_id, *recipe_ids])
+
+
+@transaction.atomic
+def update_relations(model: Type[Model], user, add: List[int],
+                     remove: List[int], counter: Optional[str] = None,
+                     on_change: Optional[Callable] = None) -> List[Dict]:
+    """Добавляет и удаляет связи пользователя со многими рецептами.
+    Новые связи вставляются одним bulk_create, старые удаляются
+    одним DELETE, оба без сигналов. Поэтому счетчик рецепта counter
+    меняется здесь же двумя UPDATE, а on_change(user_id, added,
+    removed) вызывается один раз на все изменения. Строки
+    блокируются до удаления, чтобы параллельное удаление
+    не уменьшило счетчик дважды. Возвращает статус для каждого id."""
+    existing = set(Recipe.objects.filter(id__in=add)
+                   .values_list('id', flat=True))
+    current = set(model.objects.select_for_update()
+                  .filter(user=user, recipe_id__in=add + remove)
+                  .values_list('recipe_id', flat=True))
+    added = [recipe_id for recipe_id in add
+             if recipe_id in existing and recipe_id not in current]
+    removed = [recipe_id for recipe_id in remove if recipe_id in current]
+    if added:
+        # Строки, которые параллельный запрос успел вставить раньше,
+        # ignore_conflicts пропускает. Свои строки узнаются по общей
+        # для вставки дате добавления.
+        created = timezone.now()
+        model.objects.bulk_create(
+            [model(user=user, recipe_id=recipe_id, created=created)
+             for recipe_id in added],
+            ignore_conflicts=True)
+        inserted = set(model.objects.filter(
+            user=user, recipe_id__in=added, created=created)
+            .values_list('recipe_id', flat=True))
+        current.update(set(added) - inserted)
+        added = [recipe_id for recipe_id in added if recipe_id in inserted]
+    if removed:
+        delete_relations(model, user.id, removed)
+    if counter is not None:
+        change_counters(Recipe, added, counter, 1)
+        change_counters(Recipe, removed, counter, -1)
+    if on_change is not None and (added or removed):
+        on_change(user.id, added=added, removed=removed)
+
+    def add_status(recipe_id):
+        if recipe_id not in existing:
+            return 'not_found'
+        return 'exists' if recipe_id in current else 'added'
+
+    return ([{'id': recipe_id, 'action': 'add',
+              'status': add_status(recipe_id)} for recipe_id in add]
+            + [{'id': recipe_id, 'action': 'remove',
+                'status': 'removed' if recipe_id in current else 'missing'}
+               for recipe_id in remove])
@@ -0,0 +1,13 @@
+from django.db.backends.postgresql import base
+
+from api.db_pool import PooledConnectionMixin
+
+
+class DatabaseWrapper(PooledConnectionMixin, base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        # Уровень изоляции запоминается при открытии соединения,
+        # для соединения из пула его нужно взять у самого соединения.
+        self.isolation_level = connection.isolation_level
+        return connection
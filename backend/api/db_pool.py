@@ -0,0 +1,322 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import OperationalError, load_backend
+
+from api.stats import percentile
+from backend.constants import (DB_POOL_CHECK_IDLE_SECONDS,
+                               DB_POOL_LATENCY_SAMPLES)
+
+logger = logging.getLogger(__name__)
+
+POOLED_ENGINES = {
+    'django.db.backends.postgresql': 'api.db_backends.postgresql',
+    'django.db.backends.sqlite3': 'api.db_backends.sqlite3',
+}
+
+
+def ping(raw_connection) -> bool:
+    """Проверка соединения DB-API запросом SELECT 1."""
+    try:
+        cursor = raw_connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+    except Exception:
+        return False
+    return True
+
+
+def percentile_ms(values: List[float], percent: int) -> float:
+    return round(percentile(values, percent) * 1000, 3) if values else 0.0
+
+
+def discard(raw_connection) -> None:
+    try:
+        raw_connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """Пул соединений с БД в памяти процесса.
+
+    Нужен воркерам, где запросы обслуживают потоки (пул чтения
+    под ASGI, gthread): без него каждый поток держит свое
+    постоянное соединение или открывает новое на каждый запрос.
+    Пул открывает не больше max_size соединений, поток ждет
+    свободное до timeout секунд. Простаивавшее дольше
+    DB_POOL_CHECK_IDLE_SECONDS соединение перед выдачей
+    проверяется запросом, а дольше max_idle — закрывается.
+    """
+
+    def __init__(self, max_size: int, timeout: float = 5.0,
+                 max_idle: float = 300.0, check: Callable = ping):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check = check
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._size = 0
+        self._latencies = deque(maxlen=DB_POOL_LATENCY_SAMPLES)
+        self._waits = deque(maxlen=DB_POOL_LATENCY_SAMPLES)
+        self.checkouts = 0
+        self.waited = 0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+
+    def take_idle(self):
+        """Свежее свободное соединение или None. Вызывается
+        под блокировкой."""
+        while self._idle:
+            # Последнее возвращенное соединение берется первым:
+            # редко нужные соединения простаивают и закрываются.
+            raw_connection, returned_at = self._idle.pop()
+            idle = time.monotonic() - returned_at
+            if idle <= DB_POOL_CHECK_IDLE_SECONDS or (
+                    idle <= self.max_idle and self.check(raw_connection)):
+                return raw_connection
+            discard(raw_connection)
+            self._size -= 1
+            self.discarded += 1
+        return None
+
+    def checkout(self, connect: Callable):
+        """Свободное соединение из пула или новое, открытое
+        вызовом connect, если пул еще не заполнен."""
+        started = time.perf_counter()
+        waited = None
+        with self._condition:
+            while True:
+                raw_connection = self.take_idle()
+                if raw_connection is not None:
+                    self.record(started, waited)
+                    return raw_connection
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if waited is None:
+                    waited = time.perf_counter()
+                remaining = self.timeout - (time.perf_counter() - waited)
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    if self._idle or self._size < self.max_size:
+                        continue
+                    self.timeouts += 1
+                    logger.warning('No free database connection in %s s, '
+                                   'pool size %s', self.timeout,
+                                   self.max_size)
+                    raise OperationalError(
+                        'Database connection pool exhausted')
+        try:
+            raw_connection = connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self.created += 1
+            self.record(started, waited)
+        return raw_connection
+
+    def record(self, started: float, waited: Optional[float]) -> None:
+        now = time.perf_counter()
+        self.checkouts += 1
+        self._latencies.append(now - started)
+        if waited is not None:
+            self.waited += 1
+            self._waits.append(now - waited)
+
+    def checkin(self, raw_connection, broken: bool = False) -> None:
+        if not broken:
+            try:
+                raw_connection.rollback()
+            except Exception:
+                broken = True
+        with self._condition:
+            if broken:
+                discard(raw_connection)
+                self._size -= 1
+                self.discarded += 1
+            else:
+                self._idle.append((raw_connection, time.monotonic()))
+            self._condition.notify()
+
+    def close(self) -> None:
+        with self._condition:
+            while self._idle:
+                discard(self._idle.pop()[0])
+                self._size -= 1
+
+    def stats(self) -> Dict:
+        """Метрики пула, время в миллисекундах."""
+        with self._condition:
+            latencies = list(self._latencies)
+            waits = list(self._waits)
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'checkouts': self.checkouts,
+                'created': self.created,
+                'discarded': self.discarded,
+                'waited': self.waited,
+                'timeouts': self.timeouts,
+                'wait_p95_ms': percentile_ms(waits, 95),
+                'checkout_p50_ms': percentile_ms(latencies, 50),
+                'checkout_p95_ms': percentile_ms(latencies, 95),
+            }
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias: str, settings_dict: Dict) -> ConnectionPool:
+    with _pools_lock:
+        if alias not in _pools:
+            options = settings_dict.get('POOL') or {}
+            _pools[alias] = ConnectionPool(
+                options.get('MAX_SIZE', 10),
+                options.get('TIMEOUT', 5.0), options.get('MAX_IDLE', 300.0))
+        return _pools[alias]
+
+
+def close_pool(alias: str) -> None:
+    with _pools_lock:
+        pool = _pools.pop(alias, None)
+    if pool is not None:
+        pool.close()
+
+
+def pool_stats() -> Dict[str, Dict]:
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
+
+
+class PooledConnectionMixin:
+    """Примесь к DatabaseWrapper: соединение берется из пула
+    вместо открытия нового и возвращается в пул при закрытии.
+    С пулом CONN_MAX_AGE должен быть 0, тогда Django «закрывает»
+    соединение в конце каждого запроса."""
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict)
+        return pool.checkout(lambda: super(PooledConnectionMixin, self)
+                             .get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is None:
+            return
+        pool = _pools.get(self.alias)
+        if pool is None:
+            super()._close()
+            return
+        # При закрытии внутри atomic() Django оставляет соединение
+        # у себя, поэтому в пул оно не возвращается, а закрывается.
+        broken = self.in_atomic_block or (
+            self.errors_occurred and not self.is_usable())
+        pool.checkin(self.connection, broken=broken)
+
+
+def check_connection(connection) -> None:
+    """Проверка постоянного соединения (аналог CONN_HEALTH_CHECKS
+    из Django 4.1): оборванное соединение закрывается, и запрос
+    откроет новое вместо ошибки."""
+    if (connection.connection is not None
+            and not connection.in_atomic_block
+            and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+            and not connection.is_usable()):
+        connection.close()
+
+
+def check_connections(**kwargs) -> None:
+    """Обработчик request_started: проверка соединений в начале
+    запроса."""
+    for connection in connections.all():
+        check_connection(connection)
+
+
+BENCHMARK_MODES = ('new connection', 'persistent', 'pool')
+
+
+def benchmark_connections(alias: str = DEFAULT_DB_ALIAS,
+                          requests: int = 500, threads: int = 4,
+                          pool_size: Optional[int] = None) -> Dict:
+    """Задержка запроса с одним SELECT 1 в трех режимах:
+    новое соединение на запрос, постоянное соединение
+    с проверкой и пул. Каждый поток имитирует воркер со своей
+    копией DatabaseWrapper, как это делает Django."""
+    source = connections[alias].settings_dict
+    engine = source['ENGINE']
+    pooled_engine = POOLED_ENGINES.get(engine, engine)
+    settings_by_mode = {
+        'new connection': {'CONN_MAX_AGE': 0},
+        'persistent': {'CONN_MAX_AGE': None, 'CONN_HEALTH_CHECKS': True},
+        'pool': {'ENGINE': pooled_engine, 'CONN_MAX_AGE': 0,
+                 'POOL': {**(source.get('POOL') or {}),
+                          'MAX_SIZE': pool_size or threads}},
+    }
+    results = {}
+    for mode in BENCHMARK_MODES:
+        settings_dict = {**source, 'ENGINE': engine,
+                         **settings_by_mode[mode]}
+        benchmark_alias = f'{alias}_benchmark'
+        wrapper_class = load_backend(settings_dict['ENGINE']).DatabaseWrapper
+
+        def worker(count: int) -> List[float]:
+            connection = wrapper_class(settings_dict, benchmark_alias)
+            latencies = []
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    check_connection(connection)
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                        cursor.fetchone()
+                    connection.close_if_unusable_or_obsolete()
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            return latencies
+
+        counts = [requests // threads + (number < requests % threads)
+                  for number in range(threads)]
+        try:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                latencies = [latency for chunk in executor.map(worker, counts)
+                             for latency in chunk]
+            pool = _pools.get(benchmark_alias)
+            results[mode] = {
+                'requests': len(latencies),
+                'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+                'p50_ms': percentile_ms(latencies, 50),
+                'p95_ms': percentile_ms(latencies, 95),
+                'pool': pool.stats() if pool is not None else None,
+            }
+        finally:
+            close_pool(benchmark_alias)
+    return results
+
+
+def format_benchmark_report(results: Dict) -> str:
+    lines = [f'{"mode":16}{"requests":>9}{"mean, ms":>10}'
+             f'{"p50, ms":>10}{"p95, ms":>10}']
+    for mode, item in results.items():
+        lines.append(f'{mode:16}{item["requests"]:>9}{item["mean_ms"]:>10}'
+                     f'{item["p50_ms"]:>10}{item["p95_ms"]:>10}')
+    for mode, item in results.items():
+        if item['pool']:
+            lines.append(f'{mode} metrics: ' + ', '.join(
+                f'{key}={value}' for key, value in item['pool'].items()))
+    return '\n'.join(lines)
@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import random
+from contextvars import ContextVar
+from typing import Optional
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from backend.constants import REPLICA_STICKY_COOKIE, REPLICA_STICKY_SECONDS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Модели, которые всегда читаются с основной БД. Токен, созданный
+# при входе, мог еще не дойти до реплики, а следующий запрос
+# с ним уже придет за данными.
+PRIMARY_MODELS = ('authtoken.token',)
+
+use_replica: ContextVar[bool] = ContextVar('use_replica', default=False)
+
+
+class ReplicaRouter:
+    """Роутер, отправляющий чтения в безопасных запросах к API
+    на реплики из DATABASE_REPLICAS.
+
+    Запись, чтения внутри transaction.atomic() и все чтения вне
+    запросов (команды, фоновые задачи) идут в основную БД.
+    Разрешение читать с реплики выставляет ReplicaRoutingMiddleware.
+    """
+
+    def __init__(self, replicas=None):
+        self.replicas = list(settings.DATABASE_REPLICAS
+                             if replicas is None else replicas)
+
+    def db_for_read(self, model, **hints):
+        if (not self.replicas or not use_replica.get()
+                or model._meta.label_lower in PRIMARY_MODELS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def sticky_key(request) -> Optional[str]:
+    """Ключ клиента по токену или сессии. Пароль и токен
+    в ключ не попадают, только их хэш."""
+    credentials = (request.META.get('HTTP_AUTHORIZATION')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credentials:
+        return None
+    digest = hashlib.sha256(credentials.encode()).hexdigest()[:32]
+    return f'replica:sticky:{digest}'
+
+
+class ReplicaRoutingMiddleware:
+    """Разрешает чтение с реплик для GET, HEAD и OPTIONS.
+
+    После изменяющего запроса клиент REPLICA_STICKY_SECONDS секунд
+    читает с основной БД, чтобы увидеть свои изменения, пока они
+    доходят до реплик. Признак передается в cookie, которую
+    выставляет ответ на запись, поэтому его видят все воркеры.
+    С общим кэшем (settings.SHARED_CACHE) признак дублируется
+    в кэше по ключу клиента для клиентов без cookie. Без реплик
+    middleware отключается. В асинхронной цепочке обращения
+    к кэшу выполняются в потоке, чтобы не блокировать цикл событий.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def sticky_cache_key(self, request) -> Optional[str]:
+        return sticky_key(request) if settings.SHARED_CACHE else None
+
+    def mark_sticky(self, response) -> None:
+        response.set_cookie(REPLICA_STICKY_COOKIE, '1',
+                            max_age=REPLICA_STICKY_SECONDS,
+                            httponly=True, samesite='Lax')
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        key = self.sticky_cache_key(request)
+        safe = request.method in SAFE_METHODS
+        allowed = safe and not (
+            REPLICA_STICKY_COOKIE in request.COOKIES
+            or key is not None and cache.get(key))
+        token = use_replica.set(allowed)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        if not safe:
+            self.mark_sticky(response)
+            if key is not None:
+                cache.set(key, True, REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        key = self.sticky_cache_key(request)
+        safe = request.method in SAFE_METHODS
+        allowed = safe and not (
+            REPLICA_STICKY_COOKIE in request.COOKIES
+            or key is not None and await sync_to_async(
+                cache.get, thread_sensitive=False)(key))
+        token = use_replica.set(allowed)
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        if not safe:
+            self.mark_sticky(response)
+            if key is not None:
+                await sync_to_async(cache.set, thread_sensitive=False)(
+                    key, True, REPLICA_STICKY_SECONDS)
+        return response
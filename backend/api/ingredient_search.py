@@ -0,0 +1,109 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Case, IntegerField, Value, When
+
+from api.cache import ingredients_cache
+from backend.constants import INGREDIENTS_INDEX_TTL
+from foodgram.models import Ingredient
+
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit')
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Ингредиенты хранятся отсортированными по названию в нижнем регистре:
+    совпадения по началу названия находятся бинарным поиском,
+    совпадения внутри названия добавляются после них.
+    Индекс перестраивается при смене версии справочника ингредиентов
+    в общем кэше, то есть после изменения ингредиентов в любом процессе,
+    и по истечении INGREDIENTS_INDEX_TTL секунд.
+    """
+
+    def __init__(self, ttl: int = INGREDIENTS_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = None
+        self._built_at = 0.0
+        self._token = None
+
+    def invalidate(self) -> None:
+        self._entries = None
+
+    def is_stale(self, entries) -> bool:
+        return (entries is None
+                or self._token != ingredients_cache.get_version()['token']
+                or time.monotonic() - self._built_at > self.ttl)
+
+    def build(self) -> Tuple[List[str], List[dict]]:
+        self._token = ingredients_cache.get_version()['token']
+        rows = sorted(
+            Ingredient.objects.values(*INGREDIENT_FIELDS),
+            key=lambda row: (row['name'].lower(), row['measurement_unit']))
+        self._entries = ([row['name'].lower() for row in rows], rows)
+        self._built_at = time.monotonic()
+        return self._entries
+
+    def get_entries(self) -> Tuple[List[str], List[dict]]:
+        entries = self._entries
+        if self.is_stale(entries):
+            with self._lock:
+                entries = self._entries
+                if self.is_stale(entries):
+                    entries = self.build()
+        return entries
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        query = query.strip().lower()
+        keys, rows = self.get_entries()
+        position = bisect_left(keys, query)
+        results = []
+        while (position < len(keys) and len(results) < limit
+               and keys[position].startswith(query)):
+            results.append(rows[position])
+            position += 1
+        for key, row in zip(keys, rows):
+            if len(results) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                results.append(row)
+        return results
+
+
+def search_database(query: str, limit: int) -> List[dict]:
+    """Поиск ингредиентов в БД. В PostgreSQL использует
+    триграммный индекс и индекс по началу названия."""
+    return list(
+        Ingredient.objects.filter(name__icontains=query)
+        .annotate(is_substring=Case(
+            When(name__istartswith=query, then=Value(0)),
+            default=Value(1), output_field=IntegerField()))
+        .order_by('is_substring', 'name')
+        .values(*INGREDIENT_FIELDS)[:limit])
+
+
+ingredient_index = IngredientIndex()
+
+
+def search_ingredients(query: str, limit: int) -> List[dict]:
+    """Ингредиенты для автодополнения: сначала совпадения по началу
+    названия, затем по вхождению, не больше limit штук."""
+    if settings.INGREDIENTS_SEARCH_BACKEND == 'database':
+        return search_database(query, limit)
+    return ingredient_index.search(query, limit)
+
+
+def preload_ingredient_index() -> None:
+    """Заполняет индекс при старте процесса. Если БД еще
+    не готова, индекс будет построен при первом запросе."""
+    if settings.INGREDIENTS_SEARCH_BACKEND == 'database':
+        return
+    try:
+        ingredient_index.get_entries()
+    except DatabaseError:
+        ingredient_index.invalidate()
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import requests
+
+from api.stats import percentile
+
+# Эндпоинты чтения для нагрузки. {recipe} заменяется на id
+# первого рецепта из списка, пути с авторизацией пропускаются,
+# если токен не задан.
+DEFAULT_PATHS = ('/api/recipes/', '/api/recipes/{recipe}/', '/api/tags/',
+                 '/api/ingredients/')
+AUTH_PATHS = ('/api/users/subscriptions/', '/api/recipes/feed/')
+
+
+class PathStats(NamedTuple):
+    path: str
+    latencies: List[float]
+    errors: int
+
+
+def resolve_paths(base_url: str, paths: Sequence[str],
+                  session: requests.Session) -> List[str]:
+    if not any('{recipe}' in path for path in paths):
+        return list(paths)
+    response = session.get(f'{base_url}/api/recipes/',
+                           params={'limit': 1}, timeout=10)
+    response.raise_for_status()
+    results = response.json()['results']
+    if not results:
+        return [path for path in paths if '{recipe}' not in path]
+    return [path.format(recipe=results[0]['id']) for path in paths]
+
+
+def run_load(base_url: str, paths: Sequence[str] = DEFAULT_PATHS,
+             concurrency: int = 10, duration: float = 10.0,
+             token: Optional[str] = None) -> Dict[str, PathStats]:
+    """Замкнутый цикл нагрузки: concurrency клиентов по кругу
+    запрашивают пути, пока не истечет duration секунд."""
+    base_url = base_url.rstrip('/')
+    headers = {'Authorization': f'Token {token}'} if token else {}
+    with requests.Session() as session:
+        session.headers.update(headers)
+        paths = resolve_paths(base_url, paths, session)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset: int) -> None:
+        local_latencies = defaultdict(list)
+        local_errors = defaultdict(int)
+        with requests.Session() as session:
+            session.headers.update(headers)
+            step = offset
+            while time.perf_counter() < deadline:
+                path = paths[step % len(paths)]
+                step += 1
+                started = time.perf_counter()
+                try:
+                    response = session.get(f'{base_url}{path}', timeout=30)
+                    failed = response.status_code >= 400
+                except requests.RequestException:
+                    failed = True
+                local_latencies[path].append(time.perf_counter() - started)
+                if failed:
+                    local_errors[path] += 1
+        with lock:
+            for path, values in local_latencies.items():
+                latencies[path].extend(values)
+            for path, count in local_errors.items():
+                errors[path] += count
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    return {path: PathStats(path, latencies[path], errors[path])
+            for path in paths}
+
+
+def format_load_report(stats: Dict[str, PathStats], duration: float) -> str:
+    lines = [f'{"path":36}{"requests":>9}{"rps":>9}{"p50, ms":>10}'
+             f'{"p95, ms":>10}{"errors":>8}']
+    total = 0
+    for item in stats.values():
+        count = len(item.latencies)
+        total += count
+        if not count:
+            lines.append(f'{item.path:36}{0:>9}')
+            continue
+        lines.append(
+            f'{item.path:36}{count:>9}{count / duration:>9.1f}'
+            f'{percentile(item.latencies, 50) * 1000:>10.1f}'
+            f'{percentile(item.latencies, 95) * 1000:>10.1f}'
+            f'{item.errors:>8}')
+    lines.append(f'{"total":36}{total:>9}{total / duration:>9.1f}')
+    return '\n'.join(lines)
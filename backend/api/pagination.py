@@ -0,0 +1,175 @@
+import base64
+import binascii
+import json
+from typing import List, Optional, Sequence
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connections
+from django.db.models import Q, QuerySet
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from backend.constants import MAX_PAGE_SIZE
+
+
+def approximate_count(queryset: QuerySet) -> Optional[int]:
+    """Оценка числа строк по статистике планировщика PostgreSQL.
+    Для других СУБД возвращает None."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+    except DatabaseError:
+        return None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def keyset_filter(ordering: Sequence[str], position: Sequence) -> Q:
+    """Условие «строго после позиции» для сортировки по нескольким полям.
+    Отдельное условие на первое поле позволяет СУБД начать
+    сканирование составного индекса сразу с нужного места."""
+    first_field = ordering[0].lstrip('-')
+    first_lookup = 'lte' if ordering[0].startswith('-') else 'gte'
+    condition = Q()
+    for index, field in enumerate(ordering):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{field.lstrip("-")}__{lookup}': position[index]})
+        for previous_field, value in zip(ordering[:index], position):
+            step &= Q(**{previous_field.lstrip('-'): value})
+        condition |= step
+    return Q(**{f'{first_field}__{first_lookup}': position[0]}) & condition
+
+
+class PageLimitPagination(PageNumberPagination):
+    """Постраничная пагинация с размером страницы из параметра limit."""
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+
+
+class KeysetPagination(PageLimitPagination):
+    """Пагинация, которая по параметру cursor переключается с номеров
+    страниц на курсор по полям keyset_ordering.
+
+    Курсор хранит значения полей сортировки последней (или первой)
+    записи страницы, и следующая страница выбирается условием
+    по составному индексу без OFFSET и без COUNT(*), поэтому
+    дальние страницы обходятся так же дешево, как первая.
+    С параметром count=approx в ответ добавляется оценка общего
+    числа записей по статистике планировщика. Если queryset уже
+    отсортирован иначе (ordering=popular, поиск по релевантности),
+    курсор не поддерживается и запрос с ним получает ответ 400.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    keyset_ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор'
+    ordering_cursor_message = ('Курсор не поддерживается с этой '
+                               'сортировкой, используйте page')
+
+    def __init__(self, keyset_ordering: Sequence[str] = None,
+                 keyset_only: bool = False):
+        if keyset_ordering is not None:
+            self.keyset_ordering = tuple(keyset_ordering)
+        self.keyset_only = keyset_only
+        self.keyset_mode = False
+
+    def has_own_ordering(self, queryset) -> bool:
+        """Сортировка queryset задана не по полям курсора."""
+        order_by = tuple(queryset.query.order_by)
+        return bool(order_by) and order_by != self.keyset_ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (not self.keyset_only
+                and self.cursor_query_param not in request.query_params):
+            return super().paginate_queryset(queryset, request, view)
+        if self.has_own_ordering(queryset):
+            raise serializers.ValidationError(
+                {self.cursor_query_param: self.ordering_cursor_message})
+        self.keyset_mode = True
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request, queryset)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'approx':
+            self.count = approximate_count(queryset)
+
+        ordering = self.keyset_ordering
+        if reverse:
+            ordering = tuple(self.invert(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(ordering, position))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        has_next = has_more if not reverse else position is not None
+        has_previous = has_more if reverse else position is not None
+        self.next_cursor = (self.encode_cursor(rows[-1], False)
+                            if has_next and rows else None)
+        self.previous_cursor = (self.encode_cursor(rows[0], True)
+                                if has_previous and rows else None)
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset_mode:
+            return super().get_paginated_response(data)
+        response = {
+            'next': self.get_cursor_link(self.next_cursor),
+            'previous': self.get_cursor_link(self.previous_cursor),
+            'results': data,
+        }
+        if self.request.query_params.get(self.count_query_param) == 'approx':
+            response = {'count': self.count, **response}
+        return Response(response)
+
+    @staticmethod
+    def invert(field: str) -> str:
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def get_position(self, instance) -> List:
+        return [getattr(instance, field.lstrip('-'))
+                for field in self.keyset_ordering]
+
+    def encode_cursor(self, instance, reverse: bool) -> str:
+        position = [value.isoformat() if hasattr(value, 'isoformat')
+                    else value for value in self.get_position(instance)]
+        payload = json.dumps({'p': position, 'r': reverse})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            fields = [queryset.model._meta.get_field(field.lstrip('-'))
+                      for field in self.keyset_ordering]
+            position = [field.to_python(value)
+                        for field, value in zip(fields, payload['p'])]
+            reverse = bool(payload['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError,
+                ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if len(position) != len(fields):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_cursor_link(self, cursor: Optional[str]) -> Optional[str]:
+        if cursor is None:
+            return None
+        url = remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger(__name__)
+
+IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+
+
+def fingerprint(sql: str) -> str:
+    """Отпечаток запроса: списки параметров IN сворачиваются,
+    поэтому одинаковые по форме запросы дают один отпечаток."""
+    return hashlib.sha1(IN_LIST_RE.sub('(...)', sql).encode()).hexdigest()[:12]
+
+
+class RequestProfile:
+    """Сводка по одному запросу: SQL-запросы, время в БД
+    и время сериализации."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.fingerprints = Counter()
+        self.examples = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обертка выполнения SQL для connection.execute_wrapper."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            key = fingerprint(sql)
+            self.fingerprints[key] += 1
+            self.examples.setdefault(key, sql)
+
+    def duplicates(self) -> list:
+        return [{'fingerprint': key, 'count': count,
+                 'sql': self.examples[key][:200]}
+                for key, count in self.fingerprints.most_common()
+                if count > 1]
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar(
+    'current_profile', default=None)
+
+
+def profile_query(execute, sql, params, many, context):
+    """Обертка выполнения SQL, которая учитывает запрос в профиле
+    текущего запроса. Профиль берется из контекстной переменной,
+    поэтому запросы считаются и в потоках, куда вьюху переносит
+    ASGI, и в пуле чтения."""
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def install_profiler(connection, **kwargs):
+    """Обработчик connection_created: добавляет profile_query
+    к оберткам выполнения SQL соединения."""
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
+
+
+class SerializerTimingMixin:
+    """Учитывает время to_representation в профиле текущего запроса.
+    Вложенные сериализаторы не считаются повторно."""
+
+    def to_representation(self, instance):
+        profile = current_profile.get()
+        if profile is None or profile.serializer_depth:
+            return super().to_representation(instance)
+        profile.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile.serializer_time += time.perf_counter() - started
+            profile.serializer_depth -= 1
+
+
+def resolve_view(request) -> tuple:
+    """Имя вьюсета и действие, обработавшие запрос."""
+    match = request.resolver_match
+    if match is None:
+        return None, None
+    view = getattr(match.func, 'cls', match.func)
+    actions = getattr(match.func, 'actions', None) or {}
+    return view.__name__, actions.get(request.method.lower())
+
+
+class ProfilingMiddleware:
+    """Профилирование выборки запросов.
+
+    Включается настройкой REQUEST_PROFILING_RATE — долей запросов
+    от 0 до 1. При нулевой доле middleware отключается при старте
+    и не влияет на обработку запросов. Для выбранного запроса
+    считаются SQL-запросы, время в БД, повторяющиеся запросы
+    (признак N+1) и время сериализации. Результат отдается
+    в заголовке Server-Timing и пишется в лог одной строкой JSON.
+    Работает и в синхронной, и в асинхронной цепочке middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.rate = settings.REQUEST_PROFILING_RATE
+        if self.rate <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if random.random() >= self.rate:
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.report(request, response, profile)
+
+    async def __acall__(self, request):
+        if random.random() >= self.rate:
+            return await self.get_response(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.report(request, response, profile)
+
+    def report(self, request, response, profile: RequestProfile):
+        """Заголовок Server-Timing и строка лога с профилем."""
+        total = time.perf_counter() - profile.started
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={profile.db_time * 1000:.1f};'
+            f'desc="{profile.queries} queries"',
+            f'serializer;dur={profile.serializer_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+        view, action = resolve_view(request)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'view': view,
+            'action': action,
+            'queries': profile.queries,
+            'db_ms': round(profile.db_time * 1000, 1),
+            'serializer_ms': round(profile.serializer_time * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'duplicates': profile.duplicates(),
+        }, ensure_ascii=False))
+        return response
@@ -0,0 +1,209 @@
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import connections
+from django.db.models import (BooleanField, Case, FloatField, QuerySet,
+                              Value, When)
+from django.db.models.expressions import RawSQL
+
+from backend.constants import RECIPE_SEARCH_INDEX_TTL, RECIPE_SEARCH_LIMIT
+from foodgram.models import Recipe, RecipeIngredient
+
+# Поисковый вектор рецепта в PostgreSQL: название (вес A),
+# ингредиенты (вес B) и описание (вес C) с русской морфологией.
+# Колонка search_vector и GIN-индекс создаются миграцией 0019.
+UPDATE_SEARCH_VECTOR_SQL = """
+    UPDATE foodgram_recipe AS recipe SET search_vector =
+        setweight(to_tsvector('russian', recipe.name), 'A')
+        || setweight(to_tsvector('russian', coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM foodgram_recipeingredient AS recipe_ingredient
+            JOIN foodgram_ingredient AS ingredient
+                ON ingredient.id = recipe_ingredient.ingredient_id
+            WHERE recipe_ingredient.recipe_id = recipe.id), '')), 'B')
+        || setweight(to_tsvector('russian', recipe.text), 'C')
+    WHERE recipe.id = ANY(%s)
+"""
+TSQUERY_SQL = "websearch_to_tsquery('russian', %s)"
+
+# Веса полей для индекса в памяти, как у ts_rank для весов A, B и C.
+FIELD_WEIGHTS = {'name': 1.0, 'ingredients': 0.4, 'text': 0.2}
+
+WORD_RE = re.compile(r'\w+')
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ом', 'ем',
+    'ах', 'ях', 'ов', 'ев', 'ам', 'ям', 'ую', 'юю', 'ию', 'ия', 'ья', 'ью',
+    'ы', 'и', 'а', 'я', 'о', 'е', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+def stem(word: str) -> str:
+    """Упрощенный стемминг: отбрасывает самое длинное
+    из типичных русских окончаний."""
+    for ending in ENDINGS:
+        if (word.endswith(ending)
+                and len(word) - len(ending) >= MIN_STEM_LENGTH):
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(word) for word in
+            WORD_RE.findall(text.lower().replace('ё', 'е'))]
+
+
+def document_terms(name: str, text: str,
+                   ingredient_names: Iterable[str]) -> Dict[str, float]:
+    """Вес каждого терма в рецепте с учетом поля, где он встретился."""
+    terms = defaultdict(float)
+    for field, value in (('name', name), ('text', text),
+                         ('ingredients', ' '.join(ingredient_names))):
+        for term in tokenize(value):
+            terms[term] += FIELD_WEIGHTS[field]
+    return terms
+
+
+class RecipeSearchIndex:
+    """Инвертированный индекс рецептов в памяти процесса.
+
+    Используется вместо полнотекстового поиска PostgreSQL
+    на других СУБД (SQLite в тестах и при локальной разработке).
+    Для каждого терма хранится вес в каждом рецепте, релевантность
+    считается как сумма весов, умноженных на IDF терма. Рецепт
+    попадает в выдачу, только если содержит все термы запроса.
+    Изменившиеся рецепты переиндексируются по одному, весь индекс
+    перестраивается раз в RECIPE_SEARCH_INDEX_TTL секунд, чтобы
+    подхватить изменения из других процессов.
+    """
+
+    def __init__(self, ttl: int = RECIPE_SEARCH_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._postings = None
+        self._documents = {}
+        self._built_at = 0.0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._postings = None
+
+    def is_stale(self) -> bool:
+        return (self._postings is None
+                or time.monotonic() - self._built_at > self.ttl)
+
+    def load(self, recipe_ids=None) -> Dict[int, Dict[str, float]]:
+        recipes = Recipe.objects.values_list('id', 'name', 'text')
+        ingredients = RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient__name')
+        if recipe_ids is not None:
+            recipes = recipes.filter(id__in=recipe_ids)
+            ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+        names = defaultdict(list)
+        for recipe_id, ingredient_name in ingredients.iterator():
+            names[recipe_id].append(ingredient_name)
+        return {recipe_id: document_terms(name, text, names[recipe_id])
+                for recipe_id, name, text in recipes.iterator()}
+
+    def build(self) -> None:
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        for recipe_id, terms in self.load().items():
+            self.add(recipe_id, terms)
+        self._built_at = time.monotonic()
+
+    def add(self, recipe_id: int, terms: Dict[str, float]) -> None:
+        for term, weight in terms.items():
+            self._postings[term][recipe_id] = weight
+        self._documents[recipe_id] = list(terms)
+
+    def remove(self, recipe_ids: Iterable[int]) -> None:
+        with self._lock:
+            if self._postings is None:
+                return
+            for recipe_id in recipe_ids:
+                for term in self._documents.pop(recipe_id, ()):
+                    postings = self._postings[term]
+                    postings.pop(recipe_id, None)
+                    if not postings:
+                        del self._postings[term]
+
+    def update(self, recipe_ids: Iterable[int]) -> None:
+        """Переиндексирует рецепты после изменения. Если индекс
+        еще не построен, он будет построен при первом поиске."""
+        recipe_ids = list(recipe_ids)
+        with self._lock:
+            if self._postings is None:
+                return
+            self.remove(recipe_ids)
+            for recipe_id, terms in self.load(recipe_ids).items():
+                self.add(recipe_id, terms)
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """Пары (id рецепта, релевантность) по убыванию релевантности."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            if self.is_stale():
+                self.build()
+            postings = [self._postings.get(term, {}) for term in terms]
+            total = len(self._documents)
+            if not all(postings):
+                return []
+            postings.sort(key=len)
+            scores = {}
+            for recipe_id in postings[0]:
+                if all(recipe_id in posting for posting in postings[1:]):
+                    scores[recipe_id] = sum(
+                        posting[recipe_id] * math.log(1 + total / len(posting))
+                        for posting in postings)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked[:limit]
+
+
+recipe_index = RecipeSearchIndex()
+
+
+def is_postgresql(using: str = 'default') -> bool:
+    return connections[using].vendor == 'postgresql'
+
+
+def search_recipes(queryset: QuerySet, query: str) -> QuerySet:
+    """Рецепты, подходящие под запрос, по убыванию релевантности.
+    Релевантность доступна в аннотации search_rank."""
+    if is_postgresql(queryset.db):
+        return (queryset
+                .annotate(search_match=RawSQL(
+                    f'foodgram_recipe.search_vector @@ {TSQUERY_SQL}',
+                    (query,), output_field=BooleanField()))
+                .filter(search_match=True)
+                .annotate(search_rank=RawSQL(
+                    f'ts_rank(foodgram_recipe.search_vector, {TSQUERY_SQL})',
+                    (query,), output_field=FloatField()))
+                .order_by('-search_rank', '-pub_date', '-id'))
+    ranked = recipe_index.search(query, RECIPE_SEARCH_LIMIT)
+    if not ranked:
+        return queryset.none()
+    return (queryset
+            .filter(id__in=[recipe_id for recipe_id, _ in ranked])
+            .annotate(search_rank=Case(
+                *(When(id=recipe_id, then=Value(score))
+                  for recipe_id, score in ranked),
+                output_field=FloatField()))
+            .order_by('-search_rank', '-pub_date', '-id'))
+
+
+def index_recipes(recipe_ids: Iterable[int]) -> None:
+    """Обновляет поисковый индекс изменившихся рецептов."""
+    recipe_ids = list(recipe_ids)
+    if is_postgresql():
+        with connections['default'].cursor() as cursor:
+            cursor.execute(UPDATE_SEARCH_VECTOR_SQL, [recipe_ids])
+        return
+    recipe_index.update(recipe_ids)
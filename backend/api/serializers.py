@@ -1,16 +1,22 @@
-import base64
+from collections import Counter
 
 from django.contrib.auth.hashers import make_password
 from django.core import validators
-from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 
-from api.custom_functions import add_ingredients
+from api.custom_functions import (add_ingredients, decode_base64_image,
+                                  get_recipes_limit, image_url,
+                                  limited_recipes_queryset, update_ingredients,
+                                  update_tags)
+from api.profiling import SerializerTimingMixin
 from backend.constants import (USERNAME_MAX_LENGTH, EMAIL_MAX_LENGTH,
                                COOKING_TIME_ANF_AMOUNT_MIN,
-                               COOKING_TIME_ANF_AMOUNT_MAX)
+                               COOKING_TIME_ANF_AMOUNT_MAX,
+                               BULK_RELATIONS_MAX)
 from foodgram.models import (Ingredient, Tag, Recipe, RecipeIngredient,
-                             Follow, FavoriteRecipe, ShoppingCart)
+                             Follow)
 from users.models import User
 
 
@@ -19,14 +25,32 @@ class Base64ImageField(serializers.ImageField):
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = decode_base64_image(data)
 
         return super().to_internal_value(data)
 
 
-class UserSerializer(serializers.ModelSerializer):
+class ImageVariantField(serializers.ReadOnlyField):
+    """Ссылка на уменьшенную копию изображения.
+    При only_in_lists копия отдается только в списках,
+    а для одного объекта возвращается оригинал."""
+
+    def __init__(self, variant, only_in_lists=False, **kwargs):
+        self.variant = variant
+        self.only_in_lists = only_in_lists
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        variant = self.variant
+        if self.only_in_lists and not isinstance(
+                getattr(self.parent, 'parent', None),
+                serializers.ListSerializer):
+            variant = None
+        return image_url(self.context.get('request'), value, variant)
+
+
+class UserSerializer(SerializerTimingMixin,
+                     serializers.ModelSerializer):
     """Сериалайзер используется для работы с пользователями."""
     id = serializers.IntegerField(read_only=True)
     is_subscribed = serializers.SerializerMethodField()
@@ -44,6 +68,9 @@ class UserSerializer(serializers.ModelSerializer):
             return False
         if user.is_anonymous:
             return False
+        subscribed = getattr(obj, 'subscribed', None)
+        if subscribed is not None:
+            return subscribed
         return obj.following.filter(user=user).exists()
 
 
@@ -90,7 +117,8 @@ class UserCreateSerializer(serializers.ModelSerializer):
         return False
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(SerializerTimingMixin,
+                           serializers.ModelSerializer):
     """Сериалайзер используется для ингредиентов"""
 
     class Meta:
@@ -98,7 +126,8 @@ class IngredientSerializer(serializers.ModelSerializer):
         model = Ingredient
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SerializerTimingMixin,
+                    serializers.ModelSerializer):
     """Сериалайзер для тэгов"""
 
     class Meta:
@@ -120,10 +149,11 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         model = RecipeIngredient
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SerializerTimingMixin,
+                       serializers.ModelSerializer):
     """Сериалайзер используется для списка, удаления и одного рецепта"""
     tags = TagSerializer(many=True)
-    image = Base64ImageField(required=True, allow_null=False)
+    image = ImageVariantField(variant='card', only_in_lists=True)
     author = UserSerializer()
     ingredients = RecipeIngredientSerializer(many=True,
                                              source='recipe_ingredients')
@@ -144,15 +174,30 @@ class RecipeSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        in_shopping_cart = getattr(obj, 'in_shopping_cart', None)
+        if in_shopping_cart is not None:
+            return in_shopping_cart
         return obj.is_in_shopping_cart(user)
 
     def get_is_favorited(self, obj):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        favorited = getattr(obj, 'favorited', None)
+        if favorited is not None:
+            return favorited
         return obj.is_favorited(user)
 
 
+class CookableRecipeSerializer(RecipeSerializer):
+    """Сериалайзер рецепта в подборе по имеющимся ингредиентам."""
+    missing_count = serializers.IntegerField(read_only=True)
+    coverage = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('missing_count', 'coverage')
+
+
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
     """Сериалайзер используется для создания и
     обновления ингредиентов в рецепте"""
@@ -165,7 +210,8 @@ class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
+class RecipeCreateSerializer(SerializerTimingMixin,
+                             serializers.ModelSerializer):
     """Сериалайзер используется для создания и обновления рецептов"""
     image = Base64ImageField(required=True, allow_null=False)
     ingredients = RecipeIngredientCreateSerializer(many=True)
@@ -178,6 +224,25 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'cooking_time')
         model = Recipe
 
+    def validate_ingredients(self, value):
+        """Проверяет ингредиенты одним запросом к БД
+        и подставляет найденные объекты в данные."""
+        ids = Counter(ingredient_data['id'] for ingredient_data in value)
+        duplicates = sorted(
+            ingredient_id for ingredient_id, count in ids.items() if count > 1)
+        if duplicates:
+            raise serializers.ValidationError(
+                f'Ингредиенты повторяются: {duplicates}')
+        ingredients = Ingredient.objects.in_bulk(list(ids))
+        missing = sorted(set(ids) - set(ingredients))
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не существуют: {missing}')
+        for ingredient_data in value:
+            ingredient_data['ingredient'] = ingredients[ingredient_data['id']]
+        return value
+
+    @transaction.atomic()
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
@@ -186,15 +251,19 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         add_ingredients(ingredients, recipe)
         return recipe
 
+    @transaction.atomic()
     def update(self, instance, validated_data):
-        new_tags = validated_data.pop('tags')
-        new_ingredients = validated_data.pop('ingredients')
-        instance.tags.set(new_tags)
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        add_ingredients(new_ingredients, instance)
+        new_tags = validated_data.pop('tags', None)
+        new_ingredients = validated_data.pop('ingredients', None)
+        if new_tags is not None:
+            update_tags(new_tags, instance)
+        if new_ingredients is not None:
+            update_ingredients(new_ingredients, instance)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], 'recipe_ingredients__ingredient',
+                                 'tags')
         serializer = RecipeSerializer(instance,
                                       context={'request': self.context.get(
                                           'request')})
@@ -219,51 +288,41 @@ class FollowSerializer(serializers.ModelSerializer):
         read_only_fields = ('user',)
 
 
-class CheckFollowSerializer(serializers.ModelSerializer):
-    """Сериализация объектов типа Follow. Проверка подписки."""
-
-    class Meta:
-        model = Follow
-        fields = ('user', 'following')
-
-    def validate(self, obj):
-        """Валидация подписки."""
-        request_method = self.context.get('request').method
-        user, following = obj['user'], obj['following']
-        follow = user.follows.filter(following=following).exists()
+class BulkRelationSerializer(serializers.Serializer):
+    """Списки id рецептов для добавления в избранное или корзину
+    и удаления из них одним запросом."""
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=BULK_RELATIONS_MAX, default=list)
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=BULK_RELATIONS_MAX, default=list)
 
-        if request_method == 'POST':
-            if user == following:
-                raise serializers.ValidationError(
-                    'Нельзя подписаться на самого себя'
-                )
-            if follow:
-                raise serializers.ValidationError('Ошибка, вы уже подписались')
-        if request_method == 'DELETE':
-            if user == following:
-                raise serializers.ValidationError(
-                    'Ошибка, от себя не убежишь'
-                )
-            if not follow:
-                raise serializers.ValidationError(
-                    {'errors': 'Ошибка, вы не подписывались на этого автора'}
-                )
-        return obj
+    def validate(self, data):
+        if not data['add'] and not data['remove']:
+            raise serializers.ValidationError(
+                'Укажите рецепты в add или remove')
+        if set(data['add']) & set(data['remove']):
+            raise serializers.ValidationError(
+                'Рецепт не может быть одновременно в add и remove')
+        return {'add': list(dict.fromkeys(data['add'])),
+                'remove': list(dict.fromkeys(data['remove']))}
 
 
-class RecipeShortSerializer(serializers.ModelSerializer):
-    image = Base64ImageField(required=True, allow_null=False, )
+class RecipeShortSerializer(SerializerTimingMixin,
+                            serializers.ModelSerializer):
+    image = ImageVariantField(variant='thumbnail')
 
     class Meta:
         fields = ('id', 'name', 'image', 'cooking_time')
         model = Recipe
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+class AuthorSerializer(SerializerTimingMixin,
+                       serializers.ModelSerializer):
     """Сериалайзер используется в функции подписки на автора."""
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -271,43 +330,18 @@ class AuthorSerializer(serializers.ModelSerializer):
                   'recipes',
                   'recipes_count']
 
-    def get_recipes_count(self, obj):
-        return obj.recipes_count
-
     def get_recipes(self, obj):
-        recipes = obj.get_user_recipes
-        return RecipeShortSerializer(recipes, many=True).data
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            recipes = limited_recipes_queryset(
+                get_recipes_limit(self.context['request'])
+            ).filter(author=obj)
+        return RecipeShortSerializer(recipes, many=True,
+                                     context=self.context).data
 
     def get_is_subscribed(self, obj):
+        subscribed = getattr(obj, 'subscribed', None)
+        if subscribed is not None:
+            return subscribed
         user = self.context['request'].user
         return obj.following.filter(user=user).exists()
-
-
-class FavoriteSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = FavoriteRecipe
-        fields = ('user', 'recipe')
-
-    def validate(self, attrs):
-        user = self.context['request'].user
-        recipe = attrs['recipe']
-
-        if FavoriteRecipe.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError('Рецепт уже в избранном')
-
-        return attrs
-
-
-class ShoppingCartSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ShoppingCart
-        fields = ('user', 'recipe')
-
-    def validate(self, attrs):
-        user = self.context['request'].user
-        recipe = attrs['recipe']
-
-        if ShoppingCart.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError('Рецепт уже в корзине')
-
-        return attrs
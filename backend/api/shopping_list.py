@@ -0,0 +1,165 @@
+import csv
+import datetime
+import os
+import tempfile
+from typing import Iterator
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+
+from backend.constants import (SHOPPING_LIST_CHUNK_SIZE,
+                               SHOPPING_LIST_FILENAME,
+                               SHOPPING_LIST_PDF_BLOCK_SIZE,
+                               SHOPPING_LIST_PDF_SPOOL_SIZE)
+from foodgram.cart import cart_ingredients
+from foodgram.models import Recipe
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+PDF_FONT_NAME = 'ShoppingListFont'
+
+
+def get_cart_recipes_names(user) -> Iterator[str]:
+    """Названия рецептов из корзины пользователя одним запросом."""
+    return (Recipe.objects.filter(recipe_cart__user=user)
+            .values_list('name', flat=True)
+            .iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE))
+
+
+class Echo:
+    """Объект с интерфейсом файла, возвращающий записанную строку.
+    Нужен csv.writer для потоковой выдачи."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListExporter:
+    """Базовый класс выгрузки списка покупок.
+    Наследники формируют файл построчно генератором."""
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+
+    def __init__(self, user):
+        self.user = user
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def lines(self) -> Iterator[str]:
+        yield f'Список покупок пользователя {self.user}:'
+        yield ('Для приготовления блюд: '
+               + ', '.join(get_cart_recipes_names(self.user))
+               + ', возьмите эти ингредиенты:')
+        for ingredient in cart_ingredients(self.user.id):
+            yield (f'{ingredient["name"]} {ingredient["amount"]} '
+                   f'{ingredient["measurement_unit"]}')
+        yield ''
+        yield 'Ваш любимый сайт с рецептами'
+        yield str(datetime.date.today())
+
+
+class TextExporter(ShoppingListExporter):
+    """Список покупок в виде текстового файла."""
+
+    def __iter__(self):
+        for line in self.lines():
+            yield f'{line}\n'
+
+
+class CsvExporter(ShoppingListExporter):
+    """Список покупок в виде таблицы CSV."""
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def __iter__(self):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения'))
+        for ingredient in cart_ingredients(self.user.id):
+            yield writer.writerow((ingredient['name'], ingredient['amount'],
+                                   ingredient['measurement_unit']))
+
+
+class PdfExporter(ShoppingListExporter):
+    """Список покупок в формате PDF. Документ собирается во временном
+    файле, который при большом размере переносится на диск,
+    и отдается частями."""
+    content_type = 'application/pdf'
+    extension = 'pdf'
+    font_size = 12
+    margin = 40
+
+    @classmethod
+    def is_available(cls):
+        return (canvas is not None
+                and os.path.exists(settings.SHOPPING_LIST_PDF_FONT))
+
+    @staticmethod
+    def register_font():
+        if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT))
+
+    def __iter__(self):
+        self.register_font()
+        with tempfile.SpooledTemporaryFile(
+                max_size=SHOPPING_LIST_PDF_SPOOL_SIZE) as pdf_file:
+            self.draw(pdf_file)
+            pdf_file.seek(0)
+            while True:
+                chunk = pdf_file.read(SHOPPING_LIST_PDF_BLOCK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def draw(self, pdf_file):
+        document = canvas.Canvas(pdf_file, pagesize=A4)
+        text = self.begin_page(document)
+        for line in self.lines():
+            if text.getY() < self.margin:
+                document.drawText(text)
+                document.showPage()
+                text = self.begin_page(document)
+            text.textLine(line)
+        document.drawText(text)
+        document.save()
+
+    def begin_page(self, document):
+        _, height = A4
+        text = document.beginText(self.margin, height - self.margin)
+        text.setFont(PDF_FONT_NAME, self.font_size,
+                     leading=self.font_size * 1.5)
+        return text
+
+
+EXPORTERS = {
+    exporter.extension: exporter
+    for exporter in (TextExporter, CsvExporter, PdfExporter)
+}
+
+
+def shopping_list_response(user, file_format: str) -> StreamingHttpResponse:
+    """Потоковый ответ со списком покупок в запрошенном формате."""
+    exporter_class = EXPORTERS.get(file_format)
+    if exporter_class is None or not exporter_class.is_available():
+        raise serializers.ValidationError(
+            {'filetype': f'Формат {file_format} не поддерживается'})
+    response = StreamingHttpResponse(
+        iter(exporter_class(user)),
+        content_type=exporter_class.content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename={SHOPPING_LIST_FILENAME}.'
+        f'{exporter_class.extension}')
+    return response
@@ -0,0 +1,286 @@
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.cache import (ingredients_cache, recipe_cache, tags_cache,
+                       token_cache)
+from api.cookable import cookable_index
+from api.db_pool import check_connections
+from api.profiling import install_profiler
+from api.recipe_search import index_recipes
+from foodgram.cart import (apply_delta, recipes_delta, reset_summaries,
+                           update_summary)
+from foodgram.counters import change_counter
+from foodgram.feed import backfill, fan_out, prune
+from foodgram.images import schedule_variants
+from foodgram.models import (FavoriteRecipe, Follow, Ingredient, Recipe,
+                             RecipeIngredient, ShoppingCart, Tag)
+from users.models import TOKEN_USER_FIELDS, User
+from users.signals import users_updated
+
+
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+request_started.connect(check_connections,
+                        dispatch_uid='check_db_connections')
+connection_created.connect(install_profiler,
+                           dispatch_uid='install_query_profiler')
+
+
+def invalidate_recipes(recipe_ids):
+    """Сбросить кэш представлений рецептов сразу и еще раз после
+    фиксации транзакции, чтобы в кэш не попали данные, прочитанные
+    параллельным запросом до фиксации."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    recipe_cache.invalidate(recipe_ids)
+    transaction.on_commit(lambda: recipe_cache.invalidate(recipe_ids))
+
+
+def invalidate_cart_summaries(recipe_ids):
+    """Сбросить сводки корзин с рецептами, у которых изменились
+    ингредиенты."""
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        reset_summaries(recipe_ids)
+
+
+def reindex_recipes(recipe_ids):
+    """Обновить поисковый индекс и индекс подбора по ингредиентам."""
+    index_recipes(recipe_ids)
+    cookable_index.update(recipe_ids)
+
+
+def reindex_on_commit(recipe_id):
+    """Переиндексировать рецепт после фиксации транзакции. На одну
+    транзакцию регистрируется один обработчик on_commit, который
+    обновляет индексы всех измененных в ней рецептов одним вызовом.
+    Так удаление рецепта с N ингредиентами переиндексирует его
+    один раз, а не N."""
+    connection = transaction.get_connection()
+    pending = getattr(connection, 'pending_reindex', None)
+    # Обработчик переиспользуется, только если он еще ждет фиксации
+    # и зарегистрирован на той же точке сохранения: тогда он
+    # отменится вместе с изменениями при откате.
+    savepoint_ids = set(connection.savepoint_ids)
+    if pending is not None and any(
+            func is pending[1] and sids == savepoint_ids
+            for sids, func in connection.run_on_commit):
+        pending[0].add(recipe_id)
+        return
+    recipe_ids = {recipe_id}
+
+    def callback():
+        reindex_recipes(recipe_ids)
+
+    connection.pending_reindex = (recipe_ids, callback)
+    transaction.on_commit(callback)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(instance, **kwargs):
+    """Сбросить кэш и индекс автодополнения после изменения ингредиентов
+    и переиндексировать рецепты с этим ингредиентом."""
+    ingredients_cache.invalidate()
+    recipe_ids = list(RecipeIngredient.objects.filter(
+        ingredient_id=instance.id).values_list('recipe_id', flat=True))
+    invalidate_recipes(recipe_ids)
+    invalidate_cart_summaries(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: reindex_recipes(recipe_ids))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(instance, **kwargs):
+    """Сбросить кэш тэгов и рецептов с этим тэгом после изменения
+    тэга."""
+    tags_cache.invalidate()
+    invalidate_recipes(Recipe.tags.through.objects.filter(
+        tag_id=instance.id).values_list('recipe_id', flat=True))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe(instance, signal, created=False, **kwargs):
+    """Сбросить кэш представления рецепта и сводки корзин с ним
+    после его изменения. Ингредиенты при изменении рецепта
+    пишутся пакетно, без сигналов."""
+    invalidate_recipes([instance.id])
+    if signal is post_save and not created:
+        invalidate_cart_summaries([instance.id])
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def invalidate_recipe_ingredients(instance, signal, **kwargs):
+    """Сбросить кэш представления рецепта и сводки корзин с ним
+    после изменения его ингредиента. Удаление ингредиентов идет
+    вместе с сохранением или удалением рецепта, которые сводки
+    уже учитывают, поэтому сводки сбрасываются только при
+    сохранении."""
+    invalidate_recipes([instance.recipe_id])
+    if signal is post_save:
+        invalidate_cart_summaries([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    """Сбросить кэш представлений рецептов после изменения
+    их тэгов."""
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_recipes([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_recipes(Recipe.tags.through.objects.filter(
+            tag_id=instance.pk).values_list('recipe_id', flat=True))
+    elif action.startswith('post_') and pk_set:
+        invalidate_recipes(pk_set)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes(instance, created, update_fields=None,
+                              **kwargs):
+    """Сбросить кэш представлений рецептов автора после изменения
+    его имени или почты. Обновление только даты входа или пароля
+    кэш не затрагивает."""
+    if created or (update_fields is not None
+                   and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    invalidate_recipes(instance.recipes.values_list('id', flat=True))
+
+
+def invalidate_tokens(token_keys):
+    """Сбросить снимки пользователя в кэше токенов сразу и после
+    фиксации транзакции."""
+    token_keys = list(token_keys)
+    if not token_keys:
+        return
+    token_cache.invalidate(token_keys)
+    transaction.on_commit(lambda: token_cache.invalidate(token_keys))
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(instance, **kwargs):
+    """Удаленный токен (выход, удаление пользователя) сразу
+    перестает приниматься."""
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(instance, created, update_fields=None, **kwargs):
+    """Сбросить кэш токенов пользователя после смены пароля, роли,
+    блокировки или других полей снимка."""
+    if created or (update_fields is not None
+                   and not TOKEN_USER_FIELDS & set(update_fields)):
+        return
+    invalidate_tokens(Token.objects.filter(user_id=instance.pk)
+                      .values_list('key', flat=True))
+
+
+@receiver(users_updated)
+def forget_updated_users_tokens(user_ids, **kwargs):
+    """То же для пользователей, измененных через QuerySet.update()."""
+    invalidate_tokens(Token.objects.filter(user_id__in=user_ids)
+                      .values_list('key', flat=True))
+
+
+@receiver(pre_save, sender=Recipe)
+def reset_image_variants(instance, **kwargs):
+    """У нового изображения копий еще нет: до их создания отдается
+    ссылка на оригинал."""
+    if instance.image and not instance.image._committed:
+        instance.image_variants = False
+
+
+@receiver(post_save, sender=Recipe)
+def create_image_variants(instance, **kwargs):
+    """Создать уменьшенные копии изображения после сохранения рецепта."""
+    name = instance.image.name
+    transaction.on_commit(lambda: schedule_variants(name))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def index_recipe(instance, **kwargs):
+    """Обновить индексы рецептов после изменения рецепта. Ингредиенты
+    в сериализаторе пишутся в той же транзакции, поэтому к моменту
+    обновления индекса они уже сохранены."""
+    reindex_on_commit(instance.id)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def index_recipe_ingredients(instance, **kwargs):
+    """Обновить индексы рецептов после изменения ингредиента рецепта."""
+    reindex_on_commit(instance.recipe_id)
+
+
+def counter_delta(signal, created=True):
+    if signal is post_delete:
+        return -1
+    return 1 if created else 0
+
+
+@receiver((post_save, post_delete), sender=FavoriteRecipe)
+def count_favorites(instance, signal, created=True, **kwargs):
+    """Поддерживать счетчик добавлений рецепта в избранное."""
+    delta = counter_delta(signal, created)
+    if delta:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', delta)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def count_recipes(instance, signal, created=True, **kwargs):
+    """Поддерживать счетчик рецептов автора."""
+    delta = counter_delta(signal, created)
+    if delta:
+        change_counter(User, instance.author_id, 'recipes_count', delta)
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def count_followers(instance, signal, created=True, **kwargs):
+    """Поддерживать счетчик подписчиков автора."""
+    delta = counter_delta(signal, created)
+    if delta:
+        change_counter(User, instance.following_id, 'followers_count', delta)
+
+
+@receiver(post_save, sender=Recipe)
+def push_to_feeds(instance, created, **kwargs):
+    """Добавить новый рецепт в ленты подписчиков автора."""
+    if created:
+        transaction.on_commit(lambda: fan_out(instance))
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def update_feed(instance, signal, created=True, **kwargs):
+    """Заполнить ленту рецептами автора после подписки
+    и убрать их после отписки."""
+    if signal is post_delete:
+        prune(instance.user_id, instance.following_id)
+    elif created:
+        backfill(instance.user_id, instance.following_id)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_cart_summary(instance, created, **kwargs):
+    """Прибавить ингредиенты рецепта к сводке корзины."""
+    if created:
+        update_summary(instance.user_id, added=[instance.recipe_id])
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def prepare_cart_summary(instance, **kwargs):
+    """Запомнить ингредиенты рецепта до удаления: при удалении
+    самого рецепта они удаляются в том же каскаде."""
+    instance.cart_delta = recipes_delta(removed=[instance.recipe_id])
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_cart_summary(instance, **kwargs):
+    """Вычесть ингредиенты рецепта из сводки корзины."""
+    delta = getattr(instance, 'cart_delta', None)
+    if delta is None:
+        delta = recipes_delta(removed=[instance.recipe_id])
+    apply_delta(instance.user_id, delta, -1)
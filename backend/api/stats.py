@@ -0,0 +1,8 @@
+from typing import List
+
+
+def percentile(values: List[float], percent: int) -> float:
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(0, -(-len(ordered) * percent // 100) - 1)
+    return ordered[rank]
@@ -1,8 +1,76 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
 from http import HTTPStatus
+from io import StringIO
+from unittest import mock
 
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
 from django.contrib.auth import get_user_model
-from django.test import TestCase
-from rest_framework.test import APIClient
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.utils import OperationalError
+from django.http import HttpResponse
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import (AsyncClient, LiveServerTestCase, RequestFactory,
+                         SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import (APIClient, APIRequestFactory,
+                                 force_authenticate)
+
+from api.async_views import StreamingASGIHandler, async_read_view
+from api.authentication import CachingTokenAuthentication
+from api.cache import ingredients_cache, token_cache
+from api.db_router import ReplicaRouter, ReplicaRoutingMiddleware, use_replica
+from api.cookable import cookable_index
+from api.db_backends.sqlite3.base import DatabaseWrapper as PooledSQLite
+from api.db_pool import (ConnectionPool, benchmark_connections,
+                         check_connection, close_pool, get_pool)
+from api.ingredient_search import ingredient_index
+from api.loadtest import run_load
+from api.profiling import RequestProfile, fingerprint
+from api.recipe_search import recipe_index, stem
+from api.shopping_list import PdfExporter
+from api.views import RecipeViewSet, TagViewSet
+from backend.constants import (LOCAL_CACHE_TIMEOUT, REPLICA_STICKY_COOKIE,
+                               REPLICA_STICKY_SECONDS)
+from foodgram.counters import reconcile_counters
+from foodgram.feed import trim_all
+from foodgram.images import generate_variants_in_worker, image_storage
+from foodgram.importers import iter_json_array
+from foodgram.leaderboard import rebuild_leaderboard
+from foodgram.models import (FavoriteRecipe, FeedItem, Follow, Ingredient,
+                             Recipe, RecipeIngredient, RecipeScore,
+                             ShoppingCart, ShoppingCartSummary, Tag)
+
+
+def create_recipes(author, count, tag, ingredient):
+    """Создает рецепты автора с одним тэгом и одним ингредиентом."""
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(
+            author=author, name=f'Рецепт {number}', text='Описание',
+            cooking_time=10, image='recipes/images/test.png')
+        recipe.tags.add(tag)
+        RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient,
+                                        amount=100)
+        recipes.append(recipe)
+    return recipes
 
 
 class RecipesAPITestCase(TestCase):
@@ -16,3 +84,1716 @@ class RecipesAPITestCase(TestCase):
         """Проверка доступности списка задач."""
         response = self.client.get('/api/recipes/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class RecipesQueryCountTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='reader',
+                                            email='reader@ya.ru')
+        cls.author = User.objects.create_user(username='author',
+                                              email='author@ya.ru')
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='Соль',
+                                                   measurement_unit='г')
+        cls.recipes = create_recipes(cls.author, 20, cls.tag, cls.ingredient)
+        FavoriteRecipe.objects.create(user=cls.user, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipes[1])
+        Follow.objects.create(user=cls.user, following=cls.author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def count_list_queries(self, page_size):
+        with mock.patch.object(PageNumberPagination, 'page_size', page_size):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(context.captured_queries), response.data['results']
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        """Число запросов к БД не растет с размером страницы."""
+        small_page_queries, _ = self.count_list_queries(6)
+        large_page_queries, _ = self.count_list_queries(20)
+        self.assertEqual(small_page_queries, large_page_queries)
+
+    def test_user_flags_are_annotated(self):
+        """Флаги избранного, корзины и подписки берутся из аннотаций."""
+        _, results = self.count_list_queries(20)
+        flags = {recipe['id']: recipe for recipe in results}
+        self.assertTrue(flags[self.recipes[0].id]['is_favorited'])
+        self.assertFalse(flags[self.recipes[0].id]['is_in_shopping_cart'])
+        self.assertTrue(flags[self.recipes[1].id]['is_in_shopping_cart'])
+        self.assertFalse(flags[self.recipes[2].id]['is_favorited'])
+        self.assertTrue(all(recipe['author']['is_subscribed']
+                            for recipe in results))
+
+
+class SubscriptionsQueryCountTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='reader',
+                                            email='reader@ya.ru')
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredient = Ingredient.objects.create(name='Сахар',
+                                                   measurement_unit='г')
+        cls.authors = [
+            User.objects.create_user(username=f'author{number}',
+                                     email=f'author{number}@ya.ru')
+            for number in range(6)]
+        for author in cls.authors:
+            create_recipes(author, 4, cls.tag, cls.ingredient)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def count_subscriptions_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return len(context.captured_queries), response.data['results']
+
+    def test_query_count_does_not_depend_on_follows(self):
+        """Число запросов к БД не растет с числом подписок."""
+        Follow.objects.create(user=self.user, following=self.authors[0])
+        one_follow_queries, _ = self.count_subscriptions_queries(
+            '/api/users/subscriptions/')
+        for author in self.authors[1:]:
+            Follow.objects.create(user=self.user, following=author)
+        many_follows_queries, results = self.count_subscriptions_queries(
+            '/api/users/subscriptions/')
+        self.assertEqual(one_follow_queries, many_follows_queries)
+        self.assertEqual(len(results), 6)
+        for author in results:
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], 4)
+            self.assertEqual(len(author['recipes']), 4)
+
+    def test_recipes_limit(self):
+        """Параметр recipes_limit ограничивает рецепты каждого автора."""
+        for author in self.authors:
+            Follow.objects.create(user=self.user, following=author)
+        _, results = self.count_subscriptions_queries(
+            '/api/users/subscriptions/?recipes_limit=2')
+        for author in results:
+            self.assertEqual(author['recipes_count'], 4)
+            self.assertEqual(len(author['recipes']), 2)
+
+    def test_subscribe_respects_recipes_limit(self):
+        """Подписка возвращает автора с ограниченным числом рецептов."""
+        author = self.authors[0]
+        response = self.client.post(
+            f'/api/users/{author.id}/subscribe/?recipes_limit=1')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(response.data['recipes_count'], 4)
+        self.assertEqual(len(response.data['recipes']), 1)
+
+
+class ShoppingListTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='buyer',
+                                            email='buyer@ya.ru')
+        tag = Tag.objects.create(name='Ужин', slug='dinner')
+        salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        cls.recipes = create_recipes(cls.user, 3, tag, salt)
+        pepper = Ingredient.objects.create(name='Перец',
+                                           measurement_unit='г')
+        RecipeIngredient.objects.create(recipe=cls.recipes[0],
+                                        ingredient=pepper, amount=5)
+        for recipe in cls.recipes:
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def download(self, query=''):
+        response = self.client.get(f'/api/download_shopping_cart/{query}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, b''.join(response.streaming_content)
+
+    def test_txt_is_aggregated(self):
+        """Ингредиенты суммируются по всей корзине."""
+        response, content = self.download()
+        self.assertIn('text/plain', response['Content-Type'])
+        text = content.decode()
+        self.assertIn('Соль 300 г', text)
+        self.assertIn('Перец 5 г', text)
+        self.assertIn('Рецепт 0', text)
+
+    def test_csv(self):
+        """Список покупок выгружается в CSV."""
+        response, content = self.download('?filetype=csv')
+        self.assertIn('shoping-list.csv', response['Content-Disposition'])
+        rows = content.decode().splitlines()
+        self.assertEqual(rows[1:], ['Перец,5,г', 'Соль,300,г'])
+
+    def test_pdf(self):
+        """Список покупок выгружается в PDF, если формат доступен."""
+        if not PdfExporter.is_available():
+            self.skipTest('PDF недоступен')
+        response, content = self.download('?filetype=pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_unknown_format(self):
+        """Неизвестный формат отклоняется."""
+        response = self.client.get(
+            '/api/download_shopping_cart/?filetype=docx')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        """Число запросов не зависит от размера корзины."""
+        with CaptureQueriesContext(connection) as context:
+            self.download()
+        self.assertEqual(len(context.captured_queries), 2)
+
+    def summary(self):
+        response = self.client.get('/api/recipes/shopping_cart/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response.data
+
+    def test_summary_units_are_normalized(self):
+        """Совместимые единицы складываются и выводятся в крупной."""
+        flour_kg = Ingredient.objects.create(name='Мука',
+                                             measurement_unit='кг')
+        flour_g = Ingredient.objects.create(name='Мука',
+                                            measurement_unit='г')
+        RecipeIngredient.objects.create(recipe=self.recipes[1],
+                                        ingredient=flour_kg, amount=1)
+        RecipeIngredient.objects.create(recipe=self.recipes[2],
+                                        ingredient=flour_g, amount=500)
+        summary = self.summary()
+        self.assertEqual(summary['recipes_count'], 3)
+        self.assertEqual(summary['ingredients'], [
+            {'name': 'Мука', 'measurement_unit': 'кг', 'amount': 1.5},
+            {'name': 'Перец', 'measurement_unit': 'г', 'amount': 5},
+            {'name': 'Соль', 'measurement_unit': 'г', 'amount': 300}])
+        _, content = self.download()
+        self.assertIn('Мука 1.5 кг', content.decode())
+
+    def test_summary_follows_cart_changes(self):
+        """Сводка меняется вместе с корзиной без пересборки."""
+        self.summary()
+        self.client.delete(f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.assertEqual(self.summary()['ingredients'], [
+            {'name': 'Соль', 'measurement_unit': 'г', 'amount': 200}])
+        self.client.post('/api/recipes/shopping_cart/',
+                         {'add': [self.recipes[0].id],
+                          'remove': [self.recipes[1].id]}, format='json')
+        summary = self.summary()
+        self.assertEqual(summary['recipes_count'], 2)
+        self.assertEqual(summary['ingredients'], [
+            {'name': 'Перец', 'measurement_unit': 'г', 'amount': 5},
+            {'name': 'Соль', 'measurement_unit': 'г', 'amount': 200}])
+        self.recipes[2].delete()
+        summary = ShoppingCartSummary.objects.get(user=self.user)
+        self.assertEqual(summary.recipes_count, 1)
+        self.assertEqual(summary.items[1]['amount'], 100)
+
+    def test_recipe_change_resets_summary(self):
+        """Изменение ингредиентов рецепта сбрасывает сводку."""
+        self.summary()
+        ingredient = RecipeIngredient.objects.get(
+            recipe=self.recipes[0], ingredient__name='Перец')
+        ingredient.amount = 7
+        ingredient.save()
+        self.assertFalse(ShoppingCartSummary.objects.exists())
+        self.assertEqual(self.summary()['ingredients'][0]['amount'], 7)
+
+    def test_summary_read_does_not_write(self):
+        """Без сводки GET считает ее по корзине, ничего не записывая
+        и не блокируя. Сохраняет сводку следующее изменение корзины."""
+        ShoppingCartSummary.objects.all().delete()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.summary()['recipes_count'], 3)
+        self.assertTrue(all(query['sql'].startswith('SELECT')
+                            for query in context.captured_queries))
+        self.assertFalse(ShoppingCartSummary.objects.exists())
+        self.client.delete(f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.assertEqual(
+            ShoppingCartSummary.objects.get(user=self.user).recipes_count, 2)
+
+
+class IngredientSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('сахарная пудра', 'ванильный сахар', 'сахар',
+                         'соль', 'тростниковый сахар'))
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+        self.client = APIClient()
+
+    def search(self, name):
+        response = self.client.get(f'/api/ingredients/?name={name}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_matches_first(self):
+        """Совпадения по началу названия идут раньше вхождений."""
+        self.assertEqual(self.search('Сах'), [
+            'сахар', 'сахарная пудра', 'ванильный сахар',
+            'тростниковый сахар'])
+
+    def test_results_are_limited(self):
+        """Выдача ограничена INGREDIENTS_SEARCH_LIMIT."""
+        with mock.patch('api.views.INGREDIENTS_SEARCH_LIMIT', 2):
+            self.assertEqual(self.search('сахар'),
+                             ['сахар', 'сахарная пудра'])
+
+    def test_index_is_rebuilt_after_change(self):
+        """Индекс перестраивается после добавления ингредиента."""
+        self.assertEqual(self.search('мёд'), [])
+        Ingredient.objects.create(name='мёд', measurement_unit='г')
+        self.assertEqual(self.search('мёд'), ['мёд'])
+
+    @override_settings(INGREDIENTS_SEARCH_BACKEND='database')
+    def test_database_backend(self):
+        """Поиск средствами БД ранжирует выдачу так же."""
+        self.assertEqual(self.search('сахар'), [
+            'сахар', 'сахарная пудра', 'ванильный сахар',
+            'тростниковый сахар'])
+
+    def test_list_without_name(self):
+        """Без параметра name возвращается весь справочник."""
+        response = self.client.get('/api/ingredients/')
+        self.assertEqual(len(response.data), 5)
+
+
+class ReferenceCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='cook',
+                                            email='cook@ya.ru')
+        cls.breakfast = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                           color='#E26C2D')
+        cls.dinner = Tag.objects.create(name='Ужин', slug='dinner',
+                                        color='#49B64E')
+        ingredient = Ingredient.objects.create(name='Яйцо',
+                                               measurement_unit='шт')
+        create_recipes(cls.user, 1, cls.breakfast, ingredient)
+        create_recipes(cls.user, 2, cls.dinner, ingredient)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_tags_are_cached(self):
+        """Повторный запрос тэгов не обращается к БД."""
+        self.client.get('/api/tags/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/tags/')
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(context.captured_queries), 0)
+
+    def test_not_modified(self):
+        """Запрос с актуальным ETag получает 304."""
+        response = self.client.get('/api/tags/')
+        self.assertIn('Last-Modified', response)
+        response = self.client.get('/api/tags/',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_change_invalidates_cache(self):
+        """Изменение тэга сбрасывает кэш и ETag."""
+        response = self.client.get('/api/tags/')
+        Tag.objects.create(name='Обед', slug='lunch', color='#8775D2')
+        new_response = self.client.get('/api/tags/',
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(new_response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(new_response.data), 3)
+
+    def test_recipe_filter_by_tags(self):
+        """Фильтр рецептов по тэгам берет варианты из кэша."""
+        response = self.client.get(
+            '/api/recipes/?tags=breakfast&tags=dinner')
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get('/api/recipes/?tags=breakfast')
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.get(f'/api/recipes/?author={self.user.id}')
+        self.assertEqual(response.data['count'], 3)
+
+    def test_local_cache_expires(self):
+        """С кэшем в памяти процесса изменение справочника в другом
+        воркере становится видно через LOCAL_CACHE_TIMEOUT секунд."""
+        self.assertFalse(settings.SHARED_CACHE)
+        self.client.get('/api/tags/')
+        Tag.objects.bulk_create(
+            [Tag(name='Обед', slug='lunch', color='#8775D2')])
+        self.assertEqual(len(self.client.get('/api/tags/').data), 2)
+        later = LOCAL_CACHE_TIMEOUT + 1
+        with mock.patch('time.time', return_value=time.time() + later), \
+                mock.patch('time.monotonic',
+                           return_value=time.monotonic() + later):
+            response = self.client.get('/api/tags/')
+        self.assertEqual(len(response.data), 3)
+
+
+class RecipeWriteTestCase(TestCase):
+    """Общие данные для тестов создания и изменения рецептов."""
+    IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAAB'
+             'ieywaAAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4b'
+             'AAAACklEQVQImWNoAAAAggCByxOyYQAAAABJRU5ErkJggg==')
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='chef',
+                                            email='chef@ya.ru')
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(30))
+        cls.ingredients = list(Ingredient.objects.all())
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = self.settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def recipe_data(self, ingredient_ids):
+        return {
+            'tags': [self.tag.id],
+            'ingredients': [{'id': ingredient_id, 'amount': 10}
+                            for ingredient_id in ingredient_ids],
+            'name': 'Омлет',
+            'image': self.IMAGE,
+            'text': 'Взбить и пожарить',
+            'cooking_time': 5,
+        }
+
+    def create_recipe(self, ingredient_ids):
+        return self.client.post('/api/recipes/',
+                                self.recipe_data(ingredient_ids),
+                                format='json')
+
+
+class RecipeCreateTestCase(RecipeWriteTestCase):
+    def test_ingredients_resolved_in_one_query(self):
+        """Число запросов не зависит от числа ингредиентов."""
+        ids = [ingredient.id for ingredient in self.ingredients]
+        with CaptureQueriesContext(connection) as few:
+            response = self.create_recipe(ids[:2])
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        with CaptureQueriesContext(connection) as many:
+            response = self.create_recipe(ids)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(len(response.data['ingredients']), 30)
+        self.assertEqual(len(few.captured_queries),
+                         len(many.captured_queries))
+
+    def test_missing_ingredients_reported_together(self):
+        """Все несуществующие ингредиенты перечислены в одной ошибке."""
+        response = self.create_recipe([self.ingredients[0].id, 9998, 9999])
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('9998', str(response.data['ingredients']))
+        self.assertIn('9999', str(response.data['ingredients']))
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_duplicate_ingredients_rejected(self):
+        """Повторяющиеся ингредиенты отклоняются."""
+        ingredient_id = self.ingredients[0].id
+        response = self.create_recipe([ingredient_id, ingredient_id])
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipeUpdateTestCase(RecipeWriteTestCase):
+    THROUGH_TABLES = ('foodgram_recipeingredient', 'foodgram_recipe_tags')
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [ingredient.id for ingredient in self.ingredients[:3]]
+        self.recipe_id = self.create_recipe(self.ids).data['id']
+        self.lines = dict(RecipeIngredient.objects.values_list(
+            'ingredient_id', 'id'))
+
+    def patch(self, data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(f'/api/recipes/{self.recipe_id}/',
+                                         data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, [
+            query['sql'] for query in context.captured_queries
+            if any(table in query['sql'] for table in self.THROUGH_TABLES)
+            and not query['sql'].startswith('SELECT')]
+
+    def test_unchanged_patch_does_not_write_through_tables(self):
+        """PATCH без изменений не пишет в связующие таблицы."""
+        data = self.recipe_data(self.ids)
+        del data['image']
+        _, writes = self.patch(data)
+        self.assertEqual(writes, [])
+
+    def test_title_only_patch(self):
+        """PATCH только названия не трогает ингредиенты и тэги."""
+        response, writes = self.patch({'name': 'Яичница'})
+        self.assertEqual(writes, [])
+        self.assertEqual(response.data['name'], 'Яичница')
+        self.assertEqual(len(response.data['ingredients']), 3)
+
+    def test_diff_keeps_unchanged_lines(self):
+        """Изменяются только отличающиеся строки ингредиентов."""
+        data = self.recipe_data(self.ids[1:] + [self.ingredients[5].id])
+        data['ingredients'][0]['amount'] = 25
+        del data['image']
+        response, writes = self.patch(data)
+        self.assertEqual(len(writes), 3)
+        lines = dict(RecipeIngredient.objects.values_list(
+            'ingredient_id', 'id'))
+        self.assertNotIn(self.ids[0], lines)
+        self.assertEqual(lines[self.ids[1]], self.lines[self.ids[1]])
+        self.assertEqual(lines[self.ids[2]], self.lines[self.ids[2]])
+        amounts = {ingredient['id']: ingredient['amount']
+                   for ingredient in response.data['ingredients']}
+        self.assertEqual(amounts, {self.ids[1]: 25, self.ids[2]: 10,
+                                   self.ingredients[5].id: 10})
+
+
+class KeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='reader',
+                                            email='reader@ya.ru')
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='Соль',
+                                                   measurement_unit='г')
+        cls.recipes = create_recipes(cls.user, 15, cls.tag, cls.ingredient)
+        Recipe.objects.filter(id__in=[recipe.id for recipe in cls.recipes[:5]]
+                              ).update(pub_date=cls.recipes[0].pub_date)
+        cls.authors = [
+            User.objects.create_user(username=f'author{number}',
+                                     email=f'author{number}@ya.ru')
+            for number in range(5)]
+        for author in cls.authors:
+            Follow.objects.create(user=cls.user, following=author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def walk(self, url):
+        pages = []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            pages.append((response.data, len(context.captured_queries)))
+            url = response.data['next']
+        return pages
+
+    def test_recipes_cursor_walk(self):
+        """Курсор обходит все рецепты без пропусков и повторов."""
+        pages = self.walk('/api/recipes/?cursor=&limit=4')
+        ids = [recipe['id'] for page, _ in pages for recipe in page['results']]
+        expected = list(Recipe.objects.order_by('-pub_date', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertNotIn('count', pages[0][0])
+        self.assertEqual(len({queries for _, queries in pages}), 1)
+
+    def test_previous_link(self):
+        """Ссылка previous возвращает предыдущую страницу."""
+        first = self.client.get('/api/recipes/?cursor=&limit=4').data
+        second = self.client.get(first['next']).data
+        self.assertIsNone(first['previous'])
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_invalid_cursor(self):
+        """Неверный курсор дает 404."""
+        response = self.client.get('/api/recipes/?cursor=garbage')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_page_number_mode_is_default(self):
+        """Без параметра cursor работает постраничная пагинация."""
+        response = self.client.get('/api/recipes/?page=2&limit=10')
+        self.assertEqual(response.data['count'], 15)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_subscriptions_cursor_walk(self):
+        """Курсор работает и для списка подписок."""
+        pages = self.walk('/api/users/subscriptions/?cursor=&limit=2'
+                          '&count=approx')
+        ids = [author['id'] for page, _ in pages
+               for author in page['results']]
+        self.assertEqual(ids, [author.id for author in self.authors])
+        self.assertIn('count', pages[0][0])
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ImagePipelineTestCase(RecipeWriteTestCase):
+    def create_recipe(self, ingredient_ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            return super().create_recipe(ingredient_ids)
+
+    def test_duplicate_images_are_shared(self):
+        """Одинаковые изображения хранятся в одном файле с именем-хэшем."""
+        ids = [self.ingredients[0].id]
+        first = Recipe.objects.get(id=self.create_recipe(ids).data['id'])
+        second = Recipe.objects.get(id=self.create_recipe(ids).data['id'])
+        self.assertEqual(first.image.name, second.image.name)
+        digest = hashlib.sha256(base64.b64decode(
+            self.IMAGE.split(';base64,')[1])).hexdigest()
+        self.assertEqual(first.image.name,
+                         f'recipes/images/{digest[:2]}/{digest}.png')
+
+    def test_variants_in_lists(self):
+        """В списках отдаются уменьшенные копии, в рецепте - оригинал."""
+        recipe_id = self.create_recipe([self.ingredients[0].id]).data['id']
+        feed = self.client.get('/api/recipes/').data['results']
+        detail = self.client.get(f'/api/recipes/{recipe_id}/').data
+        cart = self.client.post(
+            f'/api/recipes/{recipe_id}/shopping_cart/').data
+        self.assertTrue(feed[0]['image'].endswith('_card.jpg'))
+        self.assertTrue(detail['image'].endswith('.png'))
+        self.assertTrue(cart['image'].endswith('_thumbnail.jpg'))
+
+    def test_variant_urls_without_storage_calls(self):
+        """Ссылки на копии строятся по флагу рецепта, без обращения
+        к хранилищу, а новое изображение сбрасывает флаг."""
+        recipe_id = self.create_recipe([self.ingredients[0].id]).data['id']
+        self.assertTrue(Recipe.objects.get(id=recipe_id).image_variants)
+        with mock.patch.object(image_storage, 'exists') as exists:
+            feed = self.client.get('/api/recipes/').data['results']
+        exists.assert_not_called()
+        self.assertTrue(feed[0]['image'].endswith('_card.jpg'))
+        recipe = Recipe.objects.get(id=recipe_id)
+        recipe.image = ContentFile(b'new', name='new.png')
+        with mock.patch('api.signals.schedule_variants'):
+            recipe.save()
+        self.assertFalse(Recipe.objects.get(id=recipe_id).image_variants)
+
+    def test_wrapped_base64_image(self):
+        """Изображение в base64 с переносами строк принимается."""
+        header, encoded = self.IMAGE.split(';base64,')
+        wrapped = '\n'.join(encoded[start:start + 76]
+                            for start in range(0, len(encoded), 76))
+        self.IMAGE = f'{header};base64,{wrapped}'
+        with mock.patch('api.custom_functions.BASE64_CHUNK_SIZE', 8):
+            response = self.create_recipe([self.ingredients[0].id])
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+
+    def test_worker_releases_connections(self):
+        """Поток пула закрывает свои соединения с БД после задачи."""
+        with mock.patch('foodgram.images.generate_variants_safely'), \
+                mock.patch('foodgram.images.close_old_connections') as old, \
+                mock.patch('foodgram.images.connections') as connections:
+            generate_variants_in_worker('recipes/images/test.png')
+        old.assert_called_once()
+        connections.close_all.assert_called_once()
+
+    def test_image_size_limit(self):
+        """Слишком большое изображение отклоняется до декодирования."""
+        with mock.patch('api.custom_functions.IMAGE_MAX_SIZE', 10):
+            response = self.create_recipe([self.ingredients[0].id])
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('image', response.data)
+
+
+class RelationsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='reader',
+                                            email='reader@ya.ru')
+        cls.author = User.objects.create_user(username='author',
+                                              email='author@ya.ru')
+        tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        ingredient = Ingredient.objects.create(name='Соль',
+                                               measurement_unit='г')
+        cls.recipe = create_recipes(cls.author, 1, tag, ingredient)[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def check_add_and_remove(self, url, model, delete_queries=1):
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(model.objects.count(), 1)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertEqual(len(context.captured_queries), delete_queries)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertFalse(model.objects.exists())
+
+    def test_favorite(self):
+        """Избранное: повтор отсекается ограничением."""
+        # Выборка удаляемой строки, DELETE и обновление счетчика.
+        self.check_add_and_remove(f'/api/recipes/{self.recipe.id}/favorite/',
+                                  FavoriteRecipe, delete_queries=3)
+
+    def test_shopping_cart(self):
+        """Корзина: повтор отсекается ограничением."""
+        # Выборка строки, ингредиенты рецепта, DELETE и обновление
+        # сводки корзины под блокировкой.
+        self.check_add_and_remove(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/', ShoppingCart,
+            delete_queries=5)
+
+    def test_follow(self):
+        """Подписка: повтор отсекается ограничением."""
+        self.check_add_and_remove(f'/api/users/{self.author.id}/subscribe/',
+                                  Follow, delete_queries=4)
+
+    def test_bulk_favorites(self):
+        """Пакетное изменение избранного: статус для каждого id,
+        вставка и удаление одним запросом, счетчики обновлены."""
+        other = Recipe.objects.create(
+            author=self.author, name='Другой', text='Описание',
+            cooking_time=5, image='recipes/images/test.png')
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        response = self.client.post(
+            '/api/recipes/favorite/',
+            {'add': [other.id, 0], 'remove': [other.id]}, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                '/api/recipes/favorite/',
+                {'add': [other.id, other.id, 10 ** 6],
+                 'remove': [self.recipe.id, 10 ** 6 + 1]}, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            [(item['id'], item['status'])
+             for item in response.data['results']],
+            [(other.id, 'added'), (10 ** 6, 'not_found'),
+             (self.recipe.id, 'removed'), (10 ** 6 + 1, 'missing')])
+        statements = [query['sql'].split()[0]
+                      for query in context.captured_queries]
+        self.assertEqual(statements.count('INSERT'), 1)
+        self.assertEqual(statements.count('DELETE'), 1)
+        self.assertEqual(
+            list(FavoriteRecipe.objects.values_list('recipe_id', flat=True)),
+            [other.id])
+        other.refresh_from_db()
+        self.recipe.refresh_from_db()
+        self.assertEqual((other.favorites_count,
+                          self.recipe.favorites_count), (1, 0))
+
+    def test_bulk_add_race(self):
+        """Строку, которую параллельный запрос вставил между проверкой
+        и вставкой, пакетное добавление не учитывает в счетчике."""
+        bulk_create = FavoriteRecipe.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(FavoriteRecipe.objects, 'bulk_create',
+                               racing_bulk_create):
+            response = self.client.post(
+                '/api/recipes/favorite/', {'add': [self.recipe.id]},
+                format='json')
+        self.assertEqual(response.data['results'][0]['status'], 'exists')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_bulk_shopping_cart(self):
+        """Пакетное изменение корзины: повторное добавление
+        не создает дублей, пустой запрос отклоняется."""
+        url = '/api/recipes/shopping_cart/'
+        for _ in range(2):
+            response = self.client.post(url, {'add': [self.recipe.id]},
+                                        format='json')
+        self.assertEqual(response.data['results'][0]['status'], 'exists')
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        response = self.client.post(url, {'add': [], 'remove': []},
+                                    format='json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        response = APIClient().post(url, {'add': [self.recipe.id]},
+                                    format='json')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_bulk_remove_is_batched(self):
+        """Пакетное удаление из корзины делает одинаковое число
+        запросов для любого числа рецептов и обновляет сводку."""
+        tag = Tag.objects.get()
+        ingredient = Ingredient.objects.get()
+        url = '/api/recipes/shopping_cart/'
+        query_counts = []
+        for count in (2, 10):
+            recipe_ids = [recipe.id for recipe in create_recipes(
+                self.author, count, tag, ingredient)]
+            self.client.post(url, {'add': recipe_ids}, format='json')
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(url, {'remove': recipe_ids},
+                                            format='json')
+            self.assertEqual(
+                {item['status'] for item in response.data['results']},
+                {'removed'})
+            query_counts.append(len(context.captured_queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertEqual(self.client.get(url).data['recipes_count'], 0)
+
+    def test_self_follow(self):
+        """Нельзя подписаться на самого себя."""
+        response = self.client.post(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_anonymous(self):
+        """Анонимный пользователь не может добавлять в избранное."""
+        response = APIClient().post(f'/api/recipes/{self.recipe.id}/favorite/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_only_author_can_edit_recipe(self):
+        """Изменять рецепт может только автор."""
+        response = self.client.patch(f'/api/recipes/{self.recipe.id}/',
+                                     {'name': 'Чужой'}, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+
+
+class ProfilingMiddlewareTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='profiled',
+                                            email='profiled@ya.ru')
+        tag = Tag.objects.create(name='Обед', slug='lunch')
+        ingredient = Ingredient.objects.create(name='Рис',
+                                               measurement_unit='г')
+        create_recipes(cls.user, 3, tag, ingredient)
+
+    def get_recipes(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        return client.get('/api/recipes/')
+
+    @override_settings(REQUEST_PROFILING_RATE=1)
+    def test_profile_in_header_and_log(self):
+        """Профиль запроса попадает в Server-Timing и в лог."""
+        with self.assertLogs('api.profiling', 'INFO') as logs:
+            response = self.get_recipes()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('serializer;dur=', response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'RecipeViewSet')
+        self.assertEqual(record['action'], 'list')
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(record['duplicates'], [])
+
+    @override_settings(REQUEST_PROFILING_RATE=0)
+    def test_disabled_by_default(self):
+        """При нулевой доле заголовок не добавляется."""
+        response = self.get_recipes()
+        self.assertNotIn('Server-Timing', response)
+
+    def test_duplicate_queries_detected(self):
+        """Повторяющиеся запросы собираются под одним отпечатком."""
+        profile = RequestProfile()
+        with connection.execute_wrapper(profile):
+            for recipe_id in (1, 2, 3):
+                list(Recipe.objects.filter(id=recipe_id))
+            list(Recipe.objects.filter(id__in=[1, 2]))
+        self.assertEqual(profile.queries, 4)
+        self.assertEqual(profile.duplicates()[0]['count'], 3)
+        self.assertEqual(fingerprint('IN (%s, %s)'),
+                         fingerprint('IN (%s, %s, %s)'))
+
+
+class ImportDataTestCase(TestCase):
+    def import_data(self, *args, stdin=None):
+        call_command('import_data', *args, stdin=stdin, stdout=StringIO())
+
+    def test_headerless_csv_keeps_first_row_and_is_idempotent(self):
+        """Первая строка файла без заголовка тоже загружается,
+        повторный запуск не падает и не создает дублей."""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False,
+                                         encoding='utf-8') as file:
+            file.write('абрикосовое варенье,г\nсоль,г\n')
+        path = file.name
+        self.addCleanup(os.remove, path)
+        self.import_data('ingredients', path)
+        self.import_data('ingredients', path)
+        self.assertEqual(
+            sorted(Ingredient.objects.values_list('name', flat=True)),
+            ['абрикосовое варенье', 'соль'])
+
+    def test_json_from_stdin_with_fixture_records(self):
+        """JSON читается из stdin, записи фикстур разворачиваются,
+        кэш справочника сбрасывается."""
+        token = ingredients_cache.get_version()['token']
+        records = [{'model': 'foodgram.ingredient',
+                    'fields': {'name': 'мука', 'measurement_unit': 'г'}},
+                   {'name': 'молоко', 'measurement_unit': 'мл'},
+                   {'name': '', 'measurement_unit': 'г'}]
+        self.import_data('ingredients', '-', '--format', 'json',
+                         '--batch-size', '1',
+                         stdin=StringIO(json.dumps(records)))
+        self.assertEqual(Ingredient.objects.count(), 2)
+        self.assertNotEqual(ingredients_cache.get_version()['token'], token)
+
+    def test_json_array_is_read_in_chunks(self):
+        """Элементы массива разбираются при чтении малыми частями."""
+        records = [{'name': f'ингредиент {number}', 'amount': 1.5}
+                   for number in range(20)]
+        stream = StringIO(json.dumps(records, ensure_ascii=False))
+        self.assertEqual(list(iter_json_array(stream, chunk_size=7)),
+                         records)
+
+    def test_tags_with_header(self):
+        """Тэги загружаются из CSV с заголовком."""
+        self.import_data('tags', str(settings.BASE_DIR / 'data' / 'tags.csv'))
+        self.assertTrue(Tag.objects.filter(slug='breakfast').exists())
+
+
+class RecipeSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='searcher',
+                                            email='searcher@ya.ru')
+        potato = Ingredient.objects.create(name='картофель',
+                                           measurement_unit='г')
+        cls.by_name = Recipe.objects.create(
+            author=cls.user, name='Картофельное пюре', text='Размять.',
+            cooking_time=20, image='recipes/images/test.png')
+        cls.by_ingredient = Recipe.objects.create(
+            author=cls.user, name='Суп', text='Сварить.',
+            cooking_time=30, image='recipes/images/test.png')
+        RecipeIngredient.objects.create(recipe=cls.by_ingredient,
+                                        ingredient=potato, amount=200)
+        cls.by_text = Recipe.objects.create(
+            author=cls.user, name='Запеканка', cooking_time=40,
+            text='Подавать с картофелем.', image='recipes/images/test.png')
+        Recipe.objects.create(
+            author=cls.user, name='Омлет', text='Взбить яйца.',
+            cooking_time=5, image='recipes/images/test.png')
+
+    def setUp(self):
+        recipe_index.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_results_ranked_by_field(self):
+        """Совпадение в названии выше ингредиентов, ингредиенты
+        выше описания, формы слова приводятся к основе."""
+        self.assertEqual(stem('картофелем'), stem('картофель'))
+        self.assertEqual(self.search('картофель'),
+                         [self.by_ingredient.id, self.by_text.id])
+        self.assertEqual(self.search('пюре'), [self.by_name.id])
+        response = self.client.get('/api/recipes/',
+                                   {'search': 'картофель', 'cursor': ''})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_all_terms_required(self):
+        """В выдачу попадают рецепты со всеми словами запроса."""
+        self.assertEqual(self.search('суп картофель'),
+                         [self.by_ingredient.id])
+        self.assertEqual(self.search('суп омлет'), [])
+
+    def test_index_updated_on_change(self):
+        """Индекс обновляется после изменения рецепта и ингредиентов."""
+        self.assertEqual(self.search('томат'), [])
+        tomato = Ingredient.objects.create(name='томаты',
+                                           measurement_unit='г')
+        with mock.patch('api.signals.schedule_variants'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f'/api/recipes/{self.by_text.id}/',
+                {'name': 'Омлет с томатами',
+                 'ingredients': [{'id': tomato.id, 'amount': 1}]},
+                format='json')
+        self.assertEqual(self.search('томат'), [self.by_text.id])
+        self.assertEqual(self.search('картофель'), [self.by_ingredient.id,
+                                                    self.by_text.id])
+
+
+class CookableTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='cook',
+                                            email='cook@ya.ru')
+        cls.eggs, cls.milk, cls.flour = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('яйца', 'молоко', 'мука'))
+        cls.omelette = cls.create_recipe('Омлет', cls.eggs, cls.milk)
+        cls.pancakes = cls.create_recipe('Блины', cls.eggs, cls.milk,
+                                         cls.flour)
+        cls.boiled_eggs = cls.create_recipe('Яйца вкрутую', cls.eggs)
+        cls.bread = cls.create_recipe('Хлеб', cls.flour)
+
+    @classmethod
+    def create_recipe(cls, name, *ingredients):
+        recipe = Recipe.objects.create(
+            author=cls.user, name=name, text='Описание', cooking_time=10,
+            image='recipes/images/test.png')
+        for ingredient in ingredients:
+            RecipeIngredient.objects.create(recipe=recipe,
+                                            ingredient=ingredient, amount=1)
+        return recipe
+
+    def setUp(self):
+        cookable_index.invalidate()
+        self.client = APIClient()
+
+    def cookable(self, **params):
+        response = self.client.get('/api/recipes/cookable/', params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [(recipe['id'], recipe['missing_count'])
+                for recipe in response.data['results']]
+
+    def test_ranked_by_missing_and_coverage(self):
+        """Сначала рецепты без недостающих ингредиентов."""
+        self.assertEqual(
+            self.cookable(ingredients=f'{self.eggs.id},{self.milk.id}'),
+            [(self.boiled_eggs.id, 0), (self.omelette.id, 0),
+             (self.pancakes.id, 1)])
+        self.assertEqual(
+            self.cookable(ingredients=self.flour.id, max_missing=0),
+            [(self.bread.id, 0)])
+
+    def test_invalid_ingredients(self):
+        """Без списка ингредиентов возвращается ошибка."""
+        response = self.client.get('/api/recipes/cookable/',
+                                   {'ingredients': 'яйца'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        for params in ({'ingredients': '1,²'},
+                       {'ingredients': '1', 'max_missing': '²'}):
+            response = self.client.get('/api/recipes/cookable/', params)
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_index_updated_on_change(self):
+        """Индекс обновляется после изменения ингредиентов рецепта."""
+        self.assertEqual(self.cookable(ingredients=self.milk.id),
+                         [(self.omelette.id, 1), (self.pancakes.id, 2)])
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(recipe=self.bread,
+                                            ingredient=self.milk, amount=1)
+            self.omelette.delete()
+        self.assertEqual(self.cookable(ingredients=self.milk.id),
+                         [(self.bread.id, 1), (self.pancakes.id, 2)])
+
+    def test_reindex_once_per_transaction(self):
+        """Удаление рецепта с несколькими ингредиентами обновляет
+        индексы одним вызовом."""
+        recipe_id = self.pancakes.id
+        self.assertGreater(self.pancakes.recipe_ingredients.count(), 1)
+        with mock.patch('api.signals.reindex_recipes') as reindex, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.pancakes.delete()
+        reindex.assert_called_once_with({recipe_id})
+
+
+class CountersTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='fan',
+                                            email='fan@ya.ru')
+        cls.author = User.objects.create_user(username='star',
+                                              email='star@ya.ru')
+        tag = Tag.objects.create(name='Ужин', slug='dinner')
+        ingredient = Ingredient.objects.create(name='Рыба',
+                                               measurement_unit='г')
+        cls.recipes = create_recipes(cls.author, 2, tag, ingredient)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_counters_follow_changes(self):
+        """Счетчики меняются при добавлении и удалении связей."""
+        recipe = self.recipes[0]
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.author.refresh_from_db()
+        recipe.refresh_from_db()
+        self.assertEqual((self.author.recipes_count,
+                          self.author.followers_count,
+                          recipe.favorites_count), (2, 1, 1))
+        self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        self.recipes[1].delete()
+        self.author.refresh_from_db()
+        recipe.refresh_from_db()
+        self.assertEqual((self.author.recipes_count,
+                          recipe.favorites_count), (1, 0))
+
+    def test_subscriptions_read_counter(self):
+        """Список подписок берет число рецептов из счетчика."""
+        Follow.objects.create(user=self.user, following=self.author)
+        get_user_model().objects.filter(id=self.author.id).update(
+            recipes_count=7)
+        response = self.client.get('/api/users/subscriptions/')
+        self.assertEqual(response.data['results'][0]['recipes_count'], 7)
+
+    def test_reconcile(self):
+        """Команда сверки исправляет разошедшиеся счетчики."""
+        get_user_model().objects.filter(id=self.author.id).update(
+            recipes_count=10, followers_count=3)
+        FavoriteRecipe.objects.bulk_create(
+            [FavoriteRecipe(user=self.user, recipe=self.recipes[0])])
+        self.assertEqual(reconcile_counters(), {
+            'favorites_count': 1, 'recipes_count': 1, 'followers_count': 1})
+        self.author.refresh_from_db()
+        self.assertEqual((self.author.recipes_count,
+                          self.author.followers_count), (2, 0))
+        self.assertEqual(reconcile_counters(), {
+            'favorites_count': 0, 'recipes_count': 0, 'followers_count': 0})
+
+
+class LeaderboardTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create_user(username=f'fan{number}',
+                                              email=f'fan{number}@ya.ru')
+                     for number in range(3)]
+        tag = Tag.objects.create(name='Десерт', slug='dessert')
+        ingredient = Ingredient.objects.create(name='Сахар',
+                                               measurement_unit='г')
+        cls.old_hit, cls.new_hit, cls.quiet = create_recipes(
+            cls.users[0], 3, tag, ingredient)
+        now = timezone.now()
+        for user in cls.users:
+            FavoriteRecipe.objects.create(user=user, recipe=cls.old_hit,
+                                          created=now - timedelta(days=6))
+        FavoriteRecipe.objects.create(user=cls.users[0], recipe=cls.new_hit,
+                                      created=now - timedelta(hours=1))
+        ShoppingCart.objects.create(user=cls.users[1], recipe=cls.new_hit,
+                                    created=now - timedelta(hours=1))
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def ordered(self, ordering, **params):
+        response = self.client.get('/api/recipes/',
+                                   {'ordering': ordering, **params})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_popular_and_trending(self):
+        """Популярные — по сумме событий за окно, набирающие
+        популярность — с затуханием старых событий."""
+        self.assertEqual(rebuild_leaderboard(), 2)
+        self.assertEqual(self.ordered('popular'),
+                         [self.old_hit.id, self.new_hit.id, self.quiet.id])
+        self.assertEqual(self.ordered('trending'),
+                         [self.new_hit.id, self.old_hit.id, self.quiet.id])
+
+    def test_ordering_with_cursor_and_search(self):
+        """Курсор с сортировкой по рейтингу или поиском отклоняется,
+        а не подменяет сортировку."""
+        recipe_index.invalidate()
+        rebuild_leaderboard()
+        self.assertEqual(self.ordered('popular', search='Рецепт'),
+                         [self.old_hit.id, self.new_hit.id, self.quiet.id])
+        for ordering in ('popular', 'trending'):
+            response = self.client.get('/api/recipes/', {
+                'ordering': ordering, 'search': 'Рецепт', 'cursor': ''})
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+            self.assertIn('cursor', response.data)
+
+    def test_incremental_rebuild(self):
+        """Повторный пересчет затрагивает только рецепты с новыми
+        событиями."""
+        rebuild_leaderboard()
+        self.assertEqual(rebuild_leaderboard(), 0)
+        for user in self.users[1:]:
+            FavoriteRecipe.objects.create(user=user, recipe=self.quiet)
+        ShoppingCart.objects.create(user=self.users[2], recipe=self.quiet)
+        self.assertEqual(rebuild_leaderboard(), 1)
+        self.assertEqual(self.ordered('trending')[0], self.quiet.id)
+
+    def test_window_expiry(self):
+        """События старше окна популярности не учитываются."""
+        rebuild_leaderboard()
+        later = timezone.now() + timedelta(days=25)
+        rebuild_leaderboard(now=later)
+        self.assertEqual(RecipeScore.objects.get().recipe_id,
+                         self.new_hit.id)
+
+    def test_trending_window_expiry(self):
+        """Рецепт, события которого вышли из окна набирающих
+        популярность, пересчитывается без новых событий."""
+        rebuild_leaderboard()
+        rebuild_leaderboard(now=timezone.now() + timedelta(days=2))
+        score = RecipeScore.objects.get(recipe=self.old_hit)
+        self.assertIsNone(score.trending_score)
+        self.assertEqual(score.popular_score, 6)
+
+
+class FeedTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='reader',
+                                            email='reader@ya.ru')
+        cls.author = User.objects.create_user(username='writer',
+                                              email='writer@ya.ru')
+        cls.other = User.objects.create_user(username='stranger',
+                                             email='stranger@ya.ru')
+        cls.tag = Tag.objects.create(name='Суп', slug='soup')
+        cls.ingredient = Ingredient.objects.create(name='Свекла',
+                                                   measurement_unit='г')
+        cls.recipes = create_recipes(cls.author, 3, cls.tag, cls.ingredient)
+        create_recipes(cls.other, 1, cls.tag, cls.ingredient)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def feed_ids(self, **params):
+        response = self.client.get('/api/recipes/feed/', params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_follow_and_unfollow(self):
+        """Подписка заполняет ленту, отписка ее очищает."""
+        self.assertEqual(self.feed_ids(), [])
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.feed_ids(),
+                         [recipe.id for recipe in reversed(self.recipes)])
+        self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.feed_ids(), [])
+
+    @mock.patch('api.signals.schedule_variants')
+    def test_new_recipe_fan_out(self, schedule_variants):
+        """Новый рецепт попадает в ленты подписчиков автора."""
+        Follow.objects.create(user=self.user, following=self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe, = create_recipes(self.author, 1, self.tag,
+                                     self.ingredient)
+        self.assertEqual(self.feed_ids()[0], recipe.id)
+        self.assertFalse(FeedItem.objects.filter(user=self.other).exists())
+
+    def test_cursor_pages(self):
+        """Лента листается курсором."""
+        Follow.objects.create(user=self.user, following=self.author)
+        response = self.client.get('/api/recipes/feed/', {'limit': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['previous'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(response.data['next'])
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [self.recipes[0].id])
+        self.assertIsNone(response.data['next'])
+        feed_queries = [query['sql'] for query in queries.captured_queries
+                        if 'foodgram_feeditem' in query['sql']]
+        self.assertEqual(len(feed_queries), 1)
+
+    def test_inbox_is_capped(self):
+        """В ленте хранится не больше FEED_INBOX_SIZE записей."""
+        with mock.patch('foodgram.feed.FEED_INBOX_SIZE', 2):
+            Follow.objects.create(user=self.user, following=self.author)
+            self.assertEqual(self.feed_ids(),
+                             [self.recipes[2].id, self.recipes[1].id])
+            FeedItem.objects.create(user=self.user, recipe=self.recipes[0],
+                                    author=self.author,
+                                    pub_date=self.recipes[0].pub_date)
+            self.assertEqual(trim_all(), 1)
+        self.assertEqual(self.feed_ids(),
+                         [self.recipes[2].id, self.recipes[1].id])
+
+    @mock.patch('api.signals.schedule_variants')
+    def test_fan_out_keeps_cap(self, schedule_variants):
+        """Лента не растет больше FEED_INBOX_SIZE между запусками
+        rebuild_feeds."""
+        with mock.patch('foodgram.feed.FEED_INBOX_SIZE', 2):
+            Follow.objects.create(user=self.user, following=self.author)
+            with self.captureOnCommitCallbacks(execute=True):
+                new = create_recipes(self.author, 3, self.tag,
+                                     self.ingredient)
+        self.assertEqual(self.feed_ids(), [new[2].id, new[1].id])
+        self.assertEqual(FeedItem.objects.filter(user=self.user).count(), 2)
+
+    def test_rebuild_command(self):
+        """Команда с ключом --full заполняет ленты по подпискам."""
+        Follow.objects.bulk_create(
+            [Follow(user=self.user, following=self.author)])
+        call_command('rebuild_feeds', '--full', stdout=StringIO())
+        self.assertEqual(len(self.feed_ids()), 3)
+
+    def test_anonymous(self):
+        self.assertEqual(APIClient().get('/api/recipes/feed/').status_code,
+                         HTTPStatus.UNAUTHORIZED)
+
+
+class RecipeDetailCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='guest',
+                                            email='guest@ya.ru')
+        cls.author = User.objects.create_user(username='chef',
+                                              email='chef@ya.ru')
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredient = Ingredient.objects.create(name='Лук',
+                                                   measurement_unit='г')
+        cls.recipe, = create_recipes(cls.author, 1, cls.tag, cls.ingredient)
+
+    def setUp(self):
+        cache.clear()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_cached_with_user_flags(self):
+        """Повторный запрос не сериализует рецепт, флаги
+        пользователя подставляются в кэшированное представление."""
+        first = self.client.get(self.url)
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        Follow.objects.create(user=self.user, following=self.author)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url)
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertEqual(list(second.data), list(first.data))
+        self.assertTrue(second.data['is_favorited'])
+        self.assertFalse(second.data['is_in_shopping_cart'])
+        self.assertTrue(second.data['author']['is_subscribed'])
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        anonymous = APIClient().get(self.url).data
+        self.assertFalse(anonymous['is_favorited'])
+        self.assertFalse(anonymous['author']['is_subscribed'])
+
+    def test_not_modified(self):
+        """Запрос с совпадающим ETag получает ответ 304."""
+        etag = self.client.get(self.url)['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_invalidation(self):
+        """Кэш сбрасывается при изменении рецепта, тэга, ингредиента
+        и имени автора."""
+        etag = self.client.get(self.url)['ETag']
+        self.recipe.name = 'Новое название'
+        self.recipe.save()
+        self.assertEqual(self.client.get(self.url).data['name'],
+                         'Новое название')
+        other_tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        self.recipe.tags.add(other_tag)
+        self.assertEqual(len(self.client.get(self.url).data['tags']), 2)
+        self.ingredient.name = 'Репчатый лук'
+        self.ingredient.save()
+        self.assertEqual(
+            self.client.get(self.url).data['ingredients'][0]['name'],
+            'Репчатый лук')
+        RecipeIngredient.objects.filter(recipe=self.recipe).update(amount=5)
+        RecipeIngredient.objects.get(recipe=self.recipe).save()
+        self.assertEqual(
+            self.client.get(self.url).data['ingredients'][0]['amount'], 5)
+        self.author.first_name = 'Шеф'
+        self.author.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data['author']['first_name'], 'Шеф')
+
+    def test_local_cache_expires(self):
+        """С кэшем в памяти процесса изменение рецепта в другом
+        воркере становится видно через LOCAL_CACHE_TIMEOUT секунд."""
+        self.client.get(self.url)
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Другое')
+        self.assertEqual(self.client.get(self.url).data['name'],
+                         self.recipe.name)
+        later = LOCAL_CACHE_TIMEOUT + 1
+        with mock.patch('time.time', return_value=time.time() + later):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['name'], 'Другое')
+
+    def test_missing_recipe(self):
+        self.assertEqual(self.client.get('/api/recipes/0/').status_code,
+                         HTTPStatus.NOT_FOUND)
+        self.assertEqual(APIClient().get('/api/recipes/0/').status_code,
+                         HTTPStatus.NOT_FOUND)
+
+
+@override_settings(ASYNC_READ_THREADS=2)
+class AsyncReadViewTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='async')
+        Tag.objects.create(name='Ужин', slug='dinner')
+
+    def test_reads_run_in_pool(self):
+        """Чтение выполняется в потоке пула, ответ уже отрисован."""
+        threads = []
+        list_view = TagViewSet.as_view({'get': 'list'})
+
+        def view(request, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return list_view(request, *args, **kwargs)
+
+        response = async_to_sync(async_read_view(view))(
+            RequestFactory().get('/api/tags/'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(json.loads(response.content)[0]['slug'], 'dinner')
+        self.assertTrue(threads[0].startswith('api-read'))
+
+    def test_streaming_response_is_not_buffered(self):
+        """Потоковый ответ не собирается целиком в потоке пула."""
+        request = APIRequestFactory().get('/api/download_shopping_cart/')
+        force_authenticate(request, user=self.user)
+        view = async_read_view(
+            RecipeViewSet.as_view({'get': 'download_shopping_cart'}))
+        response = async_to_sync(view)(request)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertGreater(len(list(response.streaming_content)), 1)
+
+    def test_asgi_handler_streams_response(self):
+        """Обработчик ASGI отдает список покупок частями, читая
+        их из БД вне цикла событий."""
+        token = Token.objects.create(user=self.user)
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(StreamingASGIHandler())({
+            'type': 'http', 'method': 'GET', 'query_string': b'',
+            'path': '/api/download_shopping_cart/',
+            'headers': [(b'host', b'testserver'),
+                        (b'authorization', f'Token {token.key}'.encode())],
+        }, receive, send)
+        self.assertEqual(messages[0]['status'], HTTPStatus.OK)
+        parts = [message.get('body', b'') for message in messages[1:]]
+        self.assertGreater(len(parts), 2)
+        self.assertIn('async'.encode(), b''.join(parts))
+
+
+class LoadTestTestCase(LiveServerTestCase):
+    def test_run_load(self):
+        """Нагрузочный тест считает запросы и ошибки по путям."""
+        Tag.objects.create(name='Ужин', slug='dinner')
+        stats = run_load(self.live_server_url,
+                         ['/api/tags/', '/api/missing/'],
+                         concurrency=2, duration=0.3)
+        self.assertGreater(len(stats['/api/tags/'].latencies), 0)
+        self.assertEqual(stats['/api/tags/'].errors, 0)
+        self.assertEqual(stats['/api/missing/'].errors,
+                         len(stats['/api/missing/'].latencies))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+class ReplicaRoutingTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.decisions = []
+        self.middleware = ReplicaRoutingMiddleware(self.get_response)
+
+    def get_response(self, request):
+        self.decisions.append(self.router.db_for_read(Recipe))
+        return HttpResponse()
+
+    def request(self, method, token='Token abc', cookies=None):
+        request = getattr(RequestFactory(), method)(
+            '/api/recipes/', HTTP_AUTHORIZATION=token)
+        request.COOKIES.update(cookies or {})
+        self.response = self.middleware(request)
+        return self.decisions[-1]
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+        self.assertEqual(self.router.db_for_write(Recipe), 'default')
+
+    def test_safe_requests_use_replicas(self):
+        """GET читает с реплики, кроме токенов и блоков atomic."""
+        self.assertIn(self.request('get'), ('replica_1', 'replica_2'))
+        self.assertEqual(self.request('post', token='Token other'),
+                         'default')
+        token = use_replica.set(True)
+        try:
+            self.assertEqual(self.router.db_for_read(Token), 'default')
+            with mock.patch.object(connection, 'in_atomic_block', True):
+                self.assertEqual(self.router.db_for_read(Recipe),
+                                 'default')
+        finally:
+            use_replica.reset(token)
+
+    def test_read_your_writes(self):
+        """Ответ на запись выставляет короткую cookie, с ней клиент
+        читает с основной БД в любом воркере."""
+        self.request('post')
+        cookie = self.response.cookies[REPLICA_STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], REPLICA_STICKY_SECONDS)
+        sticky = {REPLICA_STICKY_COOKIE: cookie.value}
+        self.assertEqual(self.request('get', cookies=sticky), 'default')
+        self.assertNotIn(REPLICA_STICKY_COOKIE, self.response.cookies)
+        self.assertNotEqual(self.request('get'), 'default')
+
+    @override_settings(SHARED_CACHE=True)
+    def test_read_your_writes_shared_cache(self):
+        """С общим кэшем после записи клиент читает с основной БД
+        и без cookie, другие клиенты продолжают читать с реплик."""
+        self.request('post')
+        self.assertEqual(self.request('get'), 'default')
+        self.assertNotEqual(self.request('get', token='Token other'),
+                            'default')
+        cache.clear()
+        self.assertNotEqual(self.request('get'), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_disabled_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(self.get_response)
+        self.assertEqual(ReplicaRouter().db_for_read(Recipe), 'default')
+
+
+def select_one():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+
+async def slow_view(request):
+    """Асинхронная вьюха с одним SQL-запросом и паузой."""
+    await sync_to_async(select_one)()
+    await asyncio.sleep(0.2)
+    return HttpResponse(str(use_replica.get()))
+
+
+urlpatterns = [path('slow/', slow_view)]
+
+
+@override_settings(ROOT_URLCONF='api.tests', REQUEST_PROFILING_RATE=1,
+                   DATABASE_REPLICAS=['replica_1'])
+class AsyncMiddlewareTestCase(TestCase):
+    async def test_concurrent_requests(self):
+        """Профилирование и выбор реплики не переводят асинхронные
+        запросы в один поток: медленные запросы идут параллельно,
+        у каждого свой профиль."""
+        client = AsyncClient()
+        started = time.perf_counter()
+        with self.assertLogs('api.profiling', 'INFO') as logs:
+            responses = await asyncio.gather(
+                *(client.get('/slow/') for _ in range(3)))
+        self.assertLess(time.perf_counter() - started, 0.5)
+        for response in responses:
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(response.content, b'True')
+            self.assertIn('db;dur=', response['Server-Timing'])
+        records = [json.loads(record.getMessage())
+                   for record in logs.records]
+        self.assertEqual([record['queries'] for record in records],
+                         [1, 1, 1])
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class DatabasePoolTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.settings_dict = {
+            **connection.settings_dict,
+            'NAME': os.path.join(directory, 'pool.sqlite3'),
+            'CONN_MAX_AGE': 0, 'POOL': {'MAX_SIZE': 1, 'TIMEOUT': 0.01}}
+        self.addCleanup(close_pool, 'pool_test')
+
+    def connect(self):
+        wrapper = PooledSQLite(self.settings_dict, 'pool_test')
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return wrapper
+
+    def stats(self):
+        return get_pool('pool_test', self.settings_dict).stats()
+
+    def test_connection_returns_to_pool(self):
+        first = self.connect()
+        raw_connection = first.connection
+        first.close_if_unusable_or_obsolete()
+        self.assertIsNone(first.connection)
+        second = self.connect()
+        self.assertIs(second.connection, raw_connection)
+        second.close()
+        stats = self.stats()
+        self.assertEqual(
+            (stats['created'], stats['checkouts'], stats['idle']),
+            (1, 2, 1))
+
+    def test_exhausted_pool_times_out(self):
+        first = self.connect()
+        with self.assertLogs('api.db_pool', 'WARNING'), \
+                self.assertRaises(OperationalError):
+            self.connect()
+        first.close()
+        self.connect().close()
+        stats = self.stats()
+        self.assertEqual((stats['timeouts'], stats['checkouts']), (1, 2))
+
+    def test_connection_closed_in_atomic_is_discarded(self):
+        """Django оставляет себе соединение, закрытое внутри
+        atomic(), поэтому в пул оно не возвращается."""
+        wrapper = self.connect()
+        with mock.patch.object(wrapper, 'in_atomic_block', True):
+            wrapper.close()
+        self.assertEqual((self.stats()['size'], self.stats()['idle']),
+                         (0, 0))
+
+    def test_stale_connections_are_checked(self):
+        pool = ConnectionPool(max_size=2, check=lambda raw: False)
+        stale = pool.checkout(FakeConnection)
+        pool.checkin(stale)
+        self.assertIs(pool.checkout(FakeConnection), stale)
+        pool.checkin(stale)
+        with mock.patch('api.db_pool.DB_POOL_CHECK_IDLE_SECONDS', -1):
+            fresh = pool.checkout(FakeConnection)
+        self.assertIsNot(fresh, stale)
+        self.assertTrue(stale.closed)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+    def test_health_check_closes_broken_connection(self):
+        wrapper = PooledSQLite({**self.settings_dict,
+                                'CONN_HEALTH_CHECKS': True}, 'pool_test')
+        wrapper.ensure_connection()
+        with mock.patch.object(wrapper, 'is_usable', return_value=False):
+            check_connection(wrapper)
+        self.assertIsNone(wrapper.connection)
+
+    def test_benchmark(self):
+        results = benchmark_connections(requests=20, threads=2)
+        self.assertEqual(list(results),
+                         ['new connection', 'persistent', 'pool'])
+        self.assertTrue(all(item['requests'] == 20
+                            for item in results.values()))
+        self.assertLessEqual(results['pool']['pool']['created'], 2)
+
+    def test_metrics_endpoint(self):
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            username='pool', email='pool@example.com', password='pass')
+        client.force_authenticate(user)
+        self.assertEqual(client.get('/api/db_pool/').status_code,
+                         HTTPStatus.FORBIDDEN)
+        user.is_staff = True
+        user.save()
+        self.connect().close()
+        response = client.get('/api/db_pool/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['pool_test']['checkouts'], 1)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    SHARED_CACHE=True)
+class TokenAuthenticationCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username='token', email='token@example.com', password='pass',
+            first_name='Имя', last_name='Фамилия')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/users/me/')
+        return response, len(captured.captured_queries)
+
+    def test_cached_token_saves_query(self):
+        response, cold_queries = self.get_me()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        response, warm_queries = self.get_me()
+        self.assertEqual(warm_queries, cold_queries - 1)
+        self.assertEqual(response.json()['email'], 'token@example.com')
+        self.assertEqual(response.json()['last_name'], 'Фамилия')
+
+    def test_logout_invalidates_token(self):
+        self.get_me()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(self.get_me()[0].status_code,
+                         HTTPStatus.UNAUTHORIZED)
+
+    def test_password_change_invalidates_token(self):
+        self.get_me()
+        response = self.client.post(
+            '/api/users/set_password/',
+            {'current_password': 'pass', 'new_password': 'Nw-pass-123'})
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('Nw-pass-123'))
+
+    def test_role_change_and_deactivation(self):
+        self.get_me()
+        self.user.role = self.user.ADMIN
+        self.user.save(update_fields=['role'])
+        user, _ = CachingTokenAuthentication().authenticate_credentials(
+            self.token.key)
+        self.assertTrue(user.is_admin)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_me()[0].status_code,
+                         HTTPStatus.UNAUTHORIZED)
+
+    def test_queryset_update_invalidates_token(self):
+        """Блокировка через QuerySet.update() сбрасывает кэш,
+        обновление счетчиков его не трогает."""
+        self.get_me()
+        User = get_user_model()
+        User.objects.filter(pk=self.user.pk).update(recipes_count=1)
+        self.assertIsNotNone(token_cache.get(self.token.key))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(self.get_me()[0].status_code,
+                         HTTPStatus.UNAUTHORIZED)
+
+    def test_bulk_token_delete_invalidates_token(self):
+        self.get_me()
+        Token.objects.filter(user__in=[self.user]).delete()
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_last_login_keeps_cache(self):
+        self.get_me()
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.assertIsNotNone(token_cache.get(self.token.key))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_local_cache_is_bypassed(self):
+        """Без общего кэша выход в другом воркере сразу лишает
+        токен силы: снимок пользователя не кэшируется."""
+        response, cold_queries = self.get_me()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(self.get_me()[1], cold_queries)
+        Token.objects.filter(pk=self.token.pk).update(key='revoked')
+        self.assertEqual(self.get_me()[0].status_code,
+                         HTTPStatus.UNAUTHORIZED)
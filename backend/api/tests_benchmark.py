@@ -0,0 +1,50 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from api.benchmark import format_report, run_benchmark, seed_dataset
+
+# Размер набора данных и число повторов задаются переменными окружения:
+# BENCHMARK_SCALE=medium BENCHMARK_REPEATS=20 BENCHMARK_REPORT=1 \
+#     DB_ENGINE=sqlite python manage.py test api.tests_benchmark
+BENCHMARK_SCALE = os.getenv('BENCHMARK_SCALE', 'small')
+BENCHMARK_REPEATS = int(os.getenv('BENCHMARK_REPEATS', 5))
+BENCHMARK_REPORT = bool(os.getenv('BENCHMARK_REPORT'))
+
+
+@override_settings(
+    IMAGE_WORKERS=0,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class EndpointsBenchmarkTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.context = seed_dataset(BENCHMARK_SCALE)
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = self.settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.context['reader'])
+
+    def test_query_budgets(self):
+        """Число запросов к БД каждого эндпоинта не превышает бюджет."""
+        results = run_benchmark(
+            self.client, APIClient(), dict(self.context),
+            repeats=BENCHMARK_REPEATS,
+            request_context=lambda: self.captureOnCommitCallbacks(
+                execute=True))
+        report = format_report(results)
+        if BENCHMARK_REPORT:
+            sys.stderr.write(f'\nscale: {BENCHMARK_SCALE}\n{report}\n')
+        over_budget = [result['name'] for result in results
+                       if result['queries'] > result['budget']]
+        self.assertEqual(over_budget, [], report)
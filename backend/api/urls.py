@@ -1,9 +1,10 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .async_views import async_read_patterns
 from .views import (IngredientViewSet, TagViewSet, RecipeViewSet,
                     FollowViewSet, FavoriteViewSet, ShoppingCartViewSet,
-                    UserRetrieveViewSet,
+                    UserRetrieveViewSet, DatabasePoolViewSet,
                     )
 
 app_name = 'api'
@@ -14,24 +15,34 @@ router.register(r'tags', TagViewSet, basename='tags')
 router.register(r'recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
+    *async_read_patterns([
+        path('users/subscriptions/',
+             FollowViewSet.as_view({'get': 'follows_list'}),
+             name='follows_list'),
+    ]),
     path('download_shopping_cart/',
          RecipeViewSet.as_view({'get': 'download_shopping_cart'}),
          name='download_shopping_cart'),
-    path('users/subscriptions/',
-         FollowViewSet.as_view({'get': 'follows_list'}), name='follows_list'),
     path('users/<int:id>/subscribe/',
          FollowViewSet.as_view({'post': 'create',
                                 'delete': 'destroy'}), name='follow'),
+    path('recipes/favorite/', FavoriteViewSet.as_view({'post': 'bulk'}),
+         name='favorite_bulk'),
+    path('recipes/shopping_cart/',
+         ShoppingCartViewSet.as_view({'get': 'summary', 'post': 'bulk'}),
+         name='shopping_cart_bulk'),
     path('recipes/<int:id>/favorite/',
          FavoriteViewSet.as_view({'post': 'create', 'delete': 'destroy'
                                   }), name='favorite'),
     path('recipes/<int:id>/shopping_cart/',
          ShoppingCartViewSet.as_view({'post': 'create', 'delete': 'destroy'
                                       }), name='shopping_cart'),
+    path('db_pool/', DatabasePoolViewSet.as_view({'get': 'list'}),
+         name='db_pool'),
     path('auth/', include('djoser.urls.authtoken')),
     path('users/<int:pk>/',
          UserRetrieveViewSet.as_view({'get': 'retrieve'})),
     path('', include('djoser.urls')),
-    path('', include(router.urls)),
+    path('', include(async_read_patterns(router.urls))),
 
 ]
@@ -1,31 +1,42 @@
-import datetime
 from http import HTTPStatus
 
 from django.db import transaction
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db.models import Exists, OuterRef, Prefetch
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, serializers
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter
+from rest_framework.exceptions import NotFound
 from rest_framework.mixins import RetrieveModelMixin
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import (IsAdminUser, IsAuthenticated,
+                                        IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import GenericViewSet
 
+from api.cache import (ReferenceCacheMixin, ingredients_cache,
+                       recipe_cache, tags_cache)
+from api.cookable import cookable_index
+from api.db_pool import pool_stats
 from api.custom_filters import RecipeFilter
+from api.custom_functions import (annotate_authors, create_relation,
+                                  delete_relation, update_relations)
+from api.ingredient_search import search_ingredients
+from api.pagination import KeysetPagination, PageLimitPagination
+from api.shopping_list import shopping_list_response
+from backend.constants import (COOKABLE_LIMIT, INGREDIENTS_SEARCH_LIMIT,
+                               SHOPPING_LIST_DEFAULT_FORMAT)
+from foodgram.cart import display_items, get_summary, update_summary
 from foodgram.models import (Ingredient, Tag, Recipe, Follow, FavoriteRecipe,
-                             ShoppingCart, RecipeIngredient)
+                             ShoppingCart, FeedItem)
 from users.models import User
 from .permissions import IsAdminOrSuperuserOrReadOnly, IsAuthorStaffOrReadOnly
 from .serializers import (IngredientSerializer,
                           TagSerializer, RecipeSerializer,
-                          RecipeCreateSerializer,
-                          CheckFollowSerializer, AuthorSerializer,
-                          RecipeShortSerializer, FavoriteSerializer,
-                          ShoppingCartSerializer)
+                          RecipeCreateSerializer, AuthorSerializer,
+                          RecipeShortSerializer, CookableRecipeSerializer,
+                          BulkRelationSerializer)
 
 
 class UserRetrieveViewSet(RetrieveModelMixin, GenericViewSet):
@@ -33,32 +44,50 @@ class UserRetrieveViewSet(RetrieveModelMixin, GenericViewSet):
     serializer_class = AuthorSerializer
     permission_classes = (IsAuthenticated,)
 
+    def get_queryset(self):
+        return annotate_authors(User.objects.all(), self.request)
+
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = (IsAdminOrSuperuserOrReadOnly,)
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
-    filter_backends = [SearchFilter]
-    search_fields = ['name']
+    reference_cache = ingredients_cache
+
+    def list(self, request, *args, **kwargs):
+        """Автодополнение по параметру name: сначала ингредиенты,
+        название которых начинается с name, затем содержащие name."""
+        name = request.query_params.get(api_settings.SEARCH_PARAM)
+        if not name:
+            return super().list(request, *args, **kwargs)
+        ingredients = search_ingredients(name, INGREDIENTS_SEARCH_LIMIT)
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = (IsAdminOrSuperuserOrReadOnly,)
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    reference_cache = tags_cache
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
+    pagination_class = KeysetPagination
+    permission_classes = (IsAuthenticatedOrReadOnly, IsAuthorStaffOrReadOnly)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     http_method_names = ['get', 'post', 'patch', 'delete', ]
 
     def get_queryset(self):
-        queryset = Recipe.objects.prefetch_related(
+        user = self.request.user
+        queryset = Recipe.objects.with_user_flags(user).prefetch_related(
+            Prefetch('author',
+                     queryset=User.objects.with_subscription(user)),
             'recipe_ingredients__ingredient',
             'tags').all()
         return queryset
@@ -68,91 +97,152 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeCreateSerializer
         return RecipeSerializer
 
+    def get_user_flags(self, recipe_id):
+        """Флаги избранного, корзины и подписки на автора
+        одним запросом."""
+        user = self.request.user
+        if user.is_anonymous:
+            return False, False, False
+        flags = (Recipe.objects.filter(pk=recipe_id).with_user_flags(user)
+                 .annotate(subscribed=Exists(Follow.objects.filter(
+                     user=user, following=OuterRef('author_id'))))
+                 .values_list('favorited', 'in_shopping_cart', 'subscribed')
+                 .first())
+        if flags is None:
+            raise NotFound()
+        return flags
+
+    def retrieve(self, request, *args, **kwargs):
+        """Рецепт из кэша представлений с флагами текущего
+        пользователя. Запрос с совпадающим If-None-Match получает
+        ответ 304 без сериализации."""
+        recipe_id = str(kwargs[self.lookup_field])
+        if not recipe_id.isdigit():
+            raise NotFound()
+        version = recipe_cache.get_version(recipe_id)
+        flags = self.get_user_flags(recipe_id)
+        etag = recipe_cache.etag(recipe_id, version, flags)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            data = recipe_cache.get_or_set(
+                recipe_id, version, request,
+                lambda: self.get_serializer(self.get_object()).data)
+            response = Response(recipe_cache.with_flags(data, flags))
+        response['ETag'] = etag
+        return response
+
     @action(url_path='download_shopping_cart',
             detail=False,
-            permission_classes=(IsAuthorStaffOrReadOnly,))
+            permission_classes=(IsAuthenticated,))
     def download_shopping_cart(self, request):
-        """Функция формирует список покупок"""
-        user = request.user
-        cart_recipes = user.cart_recipes.all()
-        recipes_names = ', '.join(
-            [cart_recipe.recipe.name for cart_recipe in cart_recipes])
-        ingredients_dict = (
-            RecipeIngredient.objects.filter(recipe__recipe_cart__user=user)
-            .values('ingredient__name', 'ingredient__measurement_unit').
-            annotate(total_amount=Sum('amount')))
-        ingredients_list = [
-            (ingredient['ingredient__name'], str(ingredient['total_amount']),
-             ingredient['ingredient__measurement_unit']) for
-            ingredient in ingredients_dict]
-        shoping_list = (f'Список покупок пользователя {user}: \n'
-                        f'Для приготовления блюд: {recipes_names}, '
-                        f'возьмите эти ингредиенты:\n')
-        for ingredient in ingredients_list:
-            shoping_list += f'{" ".join(ingredient)}\n'
-        shoping_list += (f'\nВаш любимый сайт с рецептами\n'
-                         f'{datetime.date.today()}')
-        filename = 'shoping-list.txt'
-        response = HttpResponse(shoping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename={filename}'
-        return response
+        """Функция формирует список покупок в формате из параметра
+        filetype: txt, csv или pdf."""
+        file_format = request.query_params.get('filetype',
+                                               SHOPPING_LIST_DEFAULT_FORMAT)
+        return shopping_list_response(request.user, file_format)
+
+    @action(url_path='cookable', detail=False)
+    def cookable(self, request):
+        """Рецепты, которые можно приготовить из ингредиентов
+        в параметре ingredients: сначала те, где недостает меньше
+        ингредиентов. Параметр max_missing ограничивает число
+        недостающих ингредиентов."""
+        ingredient_ids = [
+            value for values in request.query_params.getlist('ingredients')
+            for value in values.split(',') if value]
+        max_missing = request.query_params.get('max_missing')
+        # isdigit() пропускает символы вроде '²', которые int() не примет
+        if not ingredient_ids or not all(
+                value.isascii() and value.isdigit()
+                for value in ingredient_ids):
+            raise serializers.ValidationError(
+                {'ingredients': 'Укажите id ингредиентов через запятую'})
+        if max_missing is not None and not (max_missing.isascii()
+                                            and max_missing.isdigit()):
+            raise serializers.ValidationError(
+                {'max_missing': 'Ожидается целое неотрицательное число'})
+        ranked = cookable_index.search(
+            map(int, ingredient_ids), COOKABLE_LIMIT,
+            int(max_missing) if max_missing is not None else None)
+
+        paginator = PageLimitPagination()
+        page = paginator.paginate_queryset(ranked, request)
+        recipes = self.get_queryset().in_bulk(
+            [item.recipe_id for item in page])
+        results = []
+        for item in page:
+            recipe = recipes.get(item.recipe_id)
+            if recipe is None:
+                continue
+            recipe.missing_count = item.missing_count
+            recipe.coverage = round(item.coverage, 3)
+            results.append(recipe)
+        serializer = CookableRecipeSerializer(results, many=True,
+                                              context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(url_path='feed', detail=False,
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Рецепты авторов из подписок, сначала новые. Записи ленты
+        создаются при публикации рецепта, поэтому страница читается
+        одним проходом по индексу ленты пользователя."""
+        paginator = KeysetPagination(keyset_ordering=('-pub_date',
+                                                      '-recipe_id'),
+                                     keyset_only=True)
+        page = paginator.paginate_queryset(
+            FeedItem.objects.filter(user=request.user), request)
+        recipes = self.get_queryset().in_bulk(
+            [item.recipe_id for item in page])
+        serializer = RecipeSerializer(
+            [recipes[item.recipe_id] for item in page
+             if item.recipe_id in recipes],
+            many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
 
 class FollowViewSet(viewsets.ViewSet):
-    permission_classes = (IsAuthorStaffOrReadOnly,)
     """Вьюсет для подписок."""
+    permission_classes = (IsAuthenticated,)
 
-    @action(
-        methods=['POST'], detail=True, permission_classes=(IsAuthenticated,)
-    )
+    @action(methods=['POST'], detail=True)
     @transaction.atomic()
     def create(self, request, id=None):
         """Подписаться на автора."""
         user = request.user
         following = get_object_or_404(User, pk=id)
-        data = {
-            'user': user.id,
-            'following': following.id,
-        }
-        serializer = CheckFollowSerializer(
-            data=data,
-            context={'request': request},
-        )
-        serializer.is_valid(raise_exception=True)
-        Follow.objects.create(user=user, following=following)
+        if user == following:
+            raise serializers.ValidationError(
+                {'errors': 'Нельзя подписаться на самого себя'})
+        create_relation(Follow, 'Ошибка, вы уже подписались',
+                        user=user, following=following)
+        following = annotate_authors(
+            User.objects.filter(pk=following.pk), request).get()
         serializer = AuthorSerializer(following, context={'request': request})
         return Response(serializer.data, status=HTTPStatus.CREATED)
 
-    @action(detail=True, methods=['DELETE'],
-            permission_classes=(IsAuthorStaffOrReadOnly,))
-    @transaction.atomic()
+    @action(detail=True, methods=['DELETE'])
     def destroy(self, request, id=None):
         """Отписка"""
         user = request.user
-        following = get_object_or_404(User, pk=id)
-        data = {
-            'user': user.id,
-            'following': following.id,
-        }
-        serializer = CheckFollowSerializer(
-            data=data,
-            context={'request': request},
-        )
-        serializer.is_valid(raise_exception=True)
-        follow = user.follows.filter(following=following)
-        follow.delete()
+        if user.id == id:
+            raise serializers.ValidationError(
+                {'errors': 'Ошибка, от себя не убежишь'})
+        delete_relation(user.follows.filter(following_id=id),
+                        'Ошибка, вы не подписывались на этого автора')
         return Response(status=HTTPStatus.NO_CONTENT)
 
-    @action(detail=False, permission_classes=(IsAuthorStaffOrReadOnly,))
+    @action(detail=False)
     def follows_list(self, request):
         """Подписки."""
         user = request.user
-        queryset = User.objects.filter(following__user=user)
+        queryset = annotate_authors(
+            User.objects.filter(following__user=user), request).order_by('id')
 
-        paginator = PageNumberPagination()
+        paginator = KeysetPagination(keyset_ordering=('id',))
         paginated_queryset = paginator.paginate_queryset(queryset, request)
 
         serializer = AuthorSerializer(paginated_queryset, many=True,
@@ -160,100 +250,81 @@ class FollowViewSet(viewsets.ViewSet):
         return paginator.get_paginated_response(serializer.data)
 
 
+def bulk_relations_response(request, model, **options) -> Response:
+    """Ответ с результатом для каждого id рецепта из запроса."""
+    serializer = BulkRelationSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    results = update_relations(model, request.user, **options,
+                               **serializer.validated_data)
+    return Response({'results': results})
+
+
 class FavoriteViewSet(viewsets.ViewSet):
     """Вьюсет для избранного."""
+    permission_classes = (IsAuthenticated,)
 
-    @action(
-        methods=['POST'], detail=True, permission_classes=(IsAuthenticated,)
-    )
-    @transaction.atomic()
+    @action(methods=['POST'], detail=True)
     def create(self, request, id=None):
         """Добавить в избранное рецепт."""
-        user = request.user
         recipe = get_object_or_404(Recipe, id=id)
-        data = {
-            'user': user.id,
-            'recipe': recipe.id,
-        }
-        serializer = FavoriteSerializer(
-            data=data,
-            context={'request': request},
-        )
-        serializer.is_valid(raise_exception=True)
-
-        FavoriteRecipe.objects.create(user=user, recipe=recipe)
+        create_relation(FavoriteRecipe, 'Рецепт уже в избранном',
+                        user=request.user, recipe=recipe)
         serializer = RecipeShortSerializer(recipe,
                                            context={'request': request})
-        return Response(serializer.data, status=HTTPStatus.CREATED,
-                        exception=True)
+        return Response(serializer.data, status=HTTPStatus.CREATED)
 
-    @transaction.atomic()
-    @action(
-        methods=['POST'], detail=True,
-        permission_classes=(IsAuthorStaffOrReadOnly,)
-    )
-    def destroy(self, request, id=None, ):
+    @action(methods=['DELETE'], detail=True)
+    def destroy(self, request, id=None):
         """Удалить из избранного рецепт."""
-        user = request.user
-        try:
-            recipe = Recipe.objects.filter(pk=id).first()
-        except Recipe.DoesNotExist:
-            raise serializers.ValidationError(
-                'Рецепта не существует'
-            )
-        if not FavoriteRecipe.objects.filter(user=user,
-                                             recipe=recipe).first():
-            raise serializers.ValidationError(
-                'Рецепт не добавлен в избранное'
-            )
-        FavoriteRecipe.objects.filter(user=user, recipe=recipe).delete()
-        return Response(status=HTTPStatus.NO_CONTENT, exception=True)
+        delete_relation(request.user.favorite_recipes.filter(recipe_id=id),
+                        'Рецепт не добавлен в избранное')
+        return Response(status=HTTPStatus.NO_CONTENT)
+
+    @action(methods=['POST'], detail=False)
+    def bulk(self, request):
+        """Добавить в избранное и удалить из него много рецептов."""
+        return bulk_relations_response(request, FavoriteRecipe,
+                                       counter='favorites_count')
 
 
 class ShoppingCartViewSet(viewsets.ViewSet):
     """Вьюсет для корзины."""
+    permission_classes = (IsAuthenticated,)
 
-    @action(
-        methods=['POST'], detail=True, permission_classes=(IsAuthenticated,)
-    )
-    @transaction.atomic()
+    @action(methods=['POST'], detail=True)
     def create(self, request, id=None):
         """Добавить в корзину рецепт."""
-        user = request.user
         recipe = get_object_or_404(Recipe, id=id)
-        data = {
-            'user': user.id,
-            'recipe': recipe.id,
-        }
-        serializer = ShoppingCartSerializer(
-            data=data,
-            context={'request': request},
-        )
-        serializer.is_valid(raise_exception=True)
-
-        ShoppingCart.objects.create(user=user, recipe=recipe)
+        create_relation(ShoppingCart, 'Рецепт уже в корзине',
+                        user=request.user, recipe=recipe)
         serializer = RecipeShortSerializer(recipe,
                                            context={'request': request})
-        return Response(serializer.data, status=HTTPStatus.CREATED,
-                        exception=True)
+        return Response(serializer.data, status=HTTPStatus.CREATED)
 
-    @transaction.atomic()
-    @action(
-        methods=['POST'], detail=True,
-        permission_classes=(IsAuthorStaffOrReadOnly,)
-    )
+    @action(methods=['DELETE'], detail=True)
     def destroy(self, request, id=None):
         """Удалить из корзины рецепт."""
-        user = request.user
-        try:
-            recipe = Recipe.objects.filter(pk=id).first()
-        except Recipe.DoesNotExist:
-            raise serializers.ValidationError(
-                'Рецепта не существует'
-            )
-        if not ShoppingCart.objects.filter(user=user, recipe=recipe).first():
-            raise serializers.ValidationError(
-                'Рецепт не добавлен в корзину'
-            )
-        ShoppingCart.objects.filter(user=user, recipe=recipe).delete()
-        return Response(status=HTTPStatus.NO_CONTENT, exception=True)
+        delete_relation(request.user.cart_recipes.filter(recipe_id=id),
+                        'Рецепт не добавлен в корзину')
+        return Response(status=HTTPStatus.NO_CONTENT)
+
+    @action(methods=['POST'], detail=False)
+    def bulk(self, request):
+        """Добавить в корзину и удалить из нее много рецептов."""
+        return bulk_relations_response(request, ShoppingCart,
+                                       on_change=update_summary)
+
+    @action(detail=False)
+    def summary(self, request):
+        """Сводка ингредиентов корзины в удобных единицах."""
+        summary = get_summary(request.user.id)
+        return Response({'recipes_count': summary.recipes_count,
+                         'ingredients': display_items(summary.items)})
+
+
+class DatabasePoolViewSet(viewsets.ViewSet):
+    """Метрики пулов соединений с БД текущего процесса."""
+    permission_classes = (IsAdminUser,)
+
+    def list(self, request):
+        return Response(pool_stats())
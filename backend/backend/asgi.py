@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
+from api.async_views import get_asgi_application  # noqa: E402
+
 application = get_asgi_application()
+
+from api.ingredient_search import preload_ingredient_index  # noqa: E402
+
+preload_ingredient_index()
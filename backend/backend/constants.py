@@ -5,3 +5,44 @@ CHARFIELD_MAX_LENGTH = 200
 COLOR_MAX_LENGTH = 7
 COOKING_TIME_ANF_AMOUNT_MIN = 1
 COOKING_TIME_ANF_AMOUNT_MAX = 32000
+SHOPPING_LIST_FILENAME = 'shoping-list'
+SHOPPING_LIST_DEFAULT_FORMAT = 'txt'
+SHOPPING_LIST_CHUNK_SIZE = 2000
+SHOPPING_LIST_PDF_SPOOL_SIZE = 1024 * 1024
+SHOPPING_LIST_PDF_BLOCK_SIZE = 64 * 1024
+# Единица измерения: (базовая единица, множитель).
+SHOPPING_LIST_UNITS = {'кг': ('г', 1000), 'л': ('мл', 1000)}
+INGREDIENTS_SEARCH_LIMIT = 20
+INGREDIENTS_INDEX_TTL = 300
+REFERENCE_CACHE_TIMEOUT = 24 * 60 * 60
+RECIPE_CACHE_TIMEOUT = 24 * 60 * 60
+# Срок записей в кэше, не общем для процессов.
+LOCAL_CACHE_TIMEOUT = 5
+MAX_PAGE_SIZE = 100
+REPLICA_STICKY_SECONDS = 5
+REPLICA_STICKY_COOKIE = 'read_primary'
+BULK_RELATIONS_MAX = 500
+IMAGE_MAX_SIZE = 5 * 1024 * 1024
+BASE64_CHUNK_SIZE = 64 * 1024
+IMAGE_VARIANTS = {'thumbnail': 160, 'card': 480}
+IMAGE_VARIANT_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+IMPORT_BATCH_SIZE = 1000
+IMPORT_CHUNK_SIZE = 64 * 1024
+RECIPE_SEARCH_LIMIT = 1000
+RECIPE_SEARCH_INDEX_TTL = 300
+COOKABLE_LIMIT = 1000
+COOKABLE_INDEX_TTL = 600
+LEADERBOARD_FAVORITE_WEIGHT = 2.0
+LEADERBOARD_CART_WEIGHT = 1.0
+LEADERBOARD_POPULAR_WINDOW_DAYS = 30
+LEADERBOARD_TRENDING_WINDOW_DAYS = 7
+LEADERBOARD_TRENDING_HALF_LIFE_HOURS = 24
+FEED_INBOX_SIZE = 500
+FEED_BATCH_SIZE = 1000
+DB_POOL_CHECK_IDLE_SECONDS = 10
+DB_POOL_LATENCY_SAMPLES = 1000
+AUTH_TOKEN_CACHE_TIMEOUT = 60
+# Поля пользователя в кэше токенов. Их изменение сбрасывает кэш.
+AUTH_TOKEN_USER_FIELDS = ('id', 'username', 'email', 'first_name',
+                          'last_name', 'role', 'is_staff', 'is_superuser',
+                          'is_active')
@@ -38,10 +38,16 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.db_router.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.profiling.ProfilingMiddleware',
 ]
 
+# Доля запросов, для которых собирается профиль SQL и времени ответа.
+# 0 отключает профилирование.
+REQUEST_PROFILING_RATE = float(os.getenv('REQUEST_PROFILING_RATE', 0))
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -62,16 +68,81 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
-DATABASES = {
+# DB_ENGINE=sqlite позволяет запускать проект и тесты локально без PostgreSQL
+if os.getenv('DB_ENGINE', 'postgresql') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'django'),
+            'USER': os.getenv('POSTGRES_USER', 'django'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', ''),
+            'PORT': os.getenv('DB_PORT', 5432)
+        }
+    }
+
+# Повторное использование соединений с БД. DB_CONN_MAX_AGE - сколько
+# секунд живет постоянное соединение (0 - новое на каждый запрос),
+# с DB_CONN_HEALTH_CHECKS соединение проверяется в начале запроса.
+# DB_POOL_SIZE > 0 включает пул соединений в памяти процесса
+# для воркеров с потоками: соединения берутся из пула и
+# возвращаются в него в конце запроса.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = os.getenv(
+    'DB_CONN_HEALTH_CHECKS', 'True').lower() == 'true'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 0))
+if DB_POOL_SIZE > 0:
+    DATABASES['default'].update({
+        'ENGINE': DATABASES['default']['ENGINE'].replace(
+            'django.db.backends.', 'api.db_backends.'),
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': DB_POOL_SIZE,
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            'MAX_IDLE': float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+        },
+    })
+
+# Реплики для чтения, например DB_REPLICA_HOSTS=replica1,replica2.
+# С SQLite реплики открывают тот же файл, что позволяет проверить
+# маршрутизацию локально.
+DATABASE_REPLICAS = []
+for number, host in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if not DATABASES[alias]['ENGINE'].endswith('sqlite3'):
+        DATABASES[alias]['HOST'] = host.strip()
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['api.db_router.ReplicaRouter']
+
+# Кэш общий для всех воркеров: по умолчанию memcached из infra/.
+# С DB_ENGINE=sqlite, без memcached, кэш живет в памяти процесса.
+if os.getenv('DB_ENGINE', 'postgresql') == 'sqlite':
+    DEFAULT_CACHE = ('django.core.cache.backends.locmem.LocMemCache',
+                     'foodgram')
+else:
+    DEFAULT_CACHE = ('django.core.cache.backends.memcached.PyMemcacheCache',
+                     'memcached:11211')
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': os.getenv('POSTGRES_DB', 'django'),
-        'USER': os.getenv('POSTGRES_USER', 'django'),
-        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
-        'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'BACKEND': os.getenv('CACHE_BACKEND', DEFAULT_CACHE[0]),
+        'LOCATION': os.getenv('CACHE_LOCATION', DEFAULT_CACHE[1]),
     }
 }
+# Сброс записи в кэше в памяти процесса другие воркеры не видят,
+# поэтому с таким кэшем записи живут не дольше LOCAL_CACHE_TIMEOUT.
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -108,15 +179,31 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachingTokenAuthentication',
     ),
     'DEFAULT_PAGINATION_CLASS':
-        'rest_framework.pagination.PageNumberPagination',
+        'api.pagination.PageLimitPagination',
     'PAGE_SIZE': 6,
     'SEARCH_PARAM': 'name'
     # Используем по умолчанию в запросе name вместо search
 }
 
+# Число потоков для создания уменьшенных копий изображений,
+# 0 - создавать копии сразу в потоке запроса
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Число потоков для чтения из БД при работе под ASGI,
+# 0 - обычные синхронные вьюхи
+ASYNC_READ_THREADS = int(os.getenv('ASYNC_READ_THREADS', 0))
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# memory - индекс в памяти процесса, database - поиск средствами БД
+INGREDIENTS_SEARCH_BACKEND = os.getenv('INGREDIENTS_SEARCH_BACKEND',
+                                       'memory')
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'SERIALIZERS': {
@@ -127,3 +214,15 @@ DJOSER = {
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.profiling': {'handlers': ['console'], 'level': 'INFO'},
+        'api.db_pool': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
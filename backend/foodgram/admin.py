@@ -27,8 +27,8 @@ class IngredientAdmin(admin.ModelAdmin):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'author', 'name', 'total_favorite', 'image', 'text',
-                    'cooking_time',)
+    list_display = ('id', 'author', 'name', 'favorites_count', 'image',
+                    'text', 'cooking_time',)
     list_editable = ('author', 'name', 'text',
                      'cooking_time',)
     search_fields = ('author', 'name', 'text',
@@ -36,11 +36,7 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', 'tags')
     inlines = (RecipeIngredientInline,)
     empty_value_display = '-пусто-'
-
-    def total_favorite(self, obj):
-        return obj.total_favorite
-
-    total_favorite.short_description = 'В избранном'
+    list_select_related = ('author',)
 
 
 class FollowAdmin(admin.ModelAdmin):
@@ -0,0 +1,146 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import Sum
+
+from backend.constants import SHOPPING_LIST_UNITS
+from foodgram.models import (RecipeIngredient, ShoppingCart,
+                             ShoppingCartSummary)
+from users.models import User
+
+# Базовая единица: (крупная единица, множитель) для вывода.
+DISPLAY_UNITS = {base: (unit, factor)
+                 for unit, (base, factor) in SHOPPING_LIST_UNITS.items()}
+
+
+def normalize(name: str, unit: str, amount: int) -> Tuple[Tuple, int]:
+    """Ключ (название, базовая единица) и количество в базовых
+    единицах."""
+    base, factor = SHOPPING_LIST_UNITS.get(unit, (unit, 1))
+    return (name, base), amount * factor
+
+
+def display(unit: str, amount: int) -> Tuple[str, float]:
+    """Количество в крупной единице, если его в ней не меньше
+    одной: 1500 г выводятся как 1.5 кг."""
+    larger = DISPLAY_UNITS.get(unit)
+    if larger is None or amount < larger[1]:
+        return unit, amount
+    value = amount / larger[1]
+    return larger[0], int(value) if value.is_integer() else round(value, 3)
+
+
+def totals(rows: Iterable[Tuple[str, str, int]]) -> Counter:
+    result = Counter()
+    for name, unit, amount in rows:
+        key, amount = normalize(name, unit, amount)
+        result[key] += amount
+    return result
+
+
+def recipes_delta(added: Iterable[int] = (),
+                  removed: Iterable[int] = ()) -> Counter:
+    """Изменение сводки при добавлении и удалении рецептов
+    одним запросом к ингредиентам этих рецептов."""
+    signs = {recipe_id: 1 for recipe_id in added}
+    signs.update({recipe_id: -1 for recipe_id in removed})
+    rows = (RecipeIngredient.objects.filter(recipe_id__in=list(signs))
+            .values_list('recipe_id', 'ingredient__name',
+                         'ingredient__measurement_unit', 'amount'))
+    delta = Counter()
+    for recipe_id, name, unit, amount in rows:
+        key, amount = normalize(name, unit, amount)
+        delta[key] += signs[recipe_id] * amount
+    return delta
+
+
+def to_items(counter: Counter) -> List[Dict]:
+    return [{'name': name, 'measurement_unit': unit, 'amount': amount}
+            for (name, unit), amount in sorted(counter.items())
+            if amount > 0]
+
+
+def from_items(items: List[Dict]) -> Counter:
+    return Counter({(item['name'], item['measurement_unit']):
+                    item['amount'] for item in items})
+
+
+def build_summary(user_id: int) -> ShoppingCartSummary:
+    """Сводка по корзине целиком, как до появления сводок."""
+    rows = (RecipeIngredient.objects
+            .filter(recipe__recipe_cart__user_id=user_id)
+            .values_list('ingredient__name', 'ingredient__measurement_unit')
+            .annotate(total=Sum('amount')).order_by())
+    return ShoppingCartSummary(
+        user_id=user_id, items=to_items(totals(rows)),
+        recipes_count=ShoppingCart.objects.filter(user_id=user_id).count())
+
+
+def get_summary(user_id: int) -> ShoppingCartSummary:
+    """Сводка корзины только на чтение. Если ее нет (корзина
+    не менялась после сброса сводки), она считается по корзине
+    без сохранения: сохраняют сводку только изменения корзины,
+    поэтому GET остается читающим запросом и может идти
+    на реплику."""
+    summary = ShoppingCartSummary.objects.filter(user_id=user_id).first()
+    if summary is None:
+        summary = build_summary(user_id)
+    return summary
+
+
+def create_summary(user_id: int) -> None:
+    """Строит и сохраняет сводку по корзине, где изменение уже
+    учтено. Строка пользователя блокируется, чтобы две сборки
+    не столкнулись."""
+    User.objects.select_for_update().filter(pk=user_id).first()
+    if not ShoppingCartSummary.objects.filter(user_id=user_id).exists():
+        build_summary(user_id).save(force_insert=True)
+
+
+@transaction.atomic(savepoint=False)
+def apply_delta(user_id: int, delta: Counter, recipes: int) -> None:
+    """Применяет изменение к сводке после изменения корзины.
+    Если сводки нет, она строится по корзине."""
+    summary = ShoppingCartSummary.objects.select_for_update().filter(
+        user_id=user_id).first()
+    if summary is None:
+        create_summary(user_id)
+        return
+    items = from_items(summary.items)
+    items.update(delta)
+    summary.items = to_items(items)
+    summary.recipes_count = max(summary.recipes_count + recipes, 0)
+    summary.save(update_fields=['items', 'recipes_count'])
+
+
+def update_summary(user_id: int, added: List[int] = (),
+                   removed: List[int] = ()) -> None:
+    """Учитывает в сводке рецепты, уже добавленные в корзину
+    и удаленные из нее."""
+    if added or removed:
+        apply_delta(user_id, recipes_delta(added, removed),
+                    len(added) - len(removed))
+
+
+def reset_summaries(recipe_ids: Iterable[int]) -> None:
+    """Сбрасывает сводки корзин с этими рецептами после изменения
+    их ингредиентов. До следующего изменения корзины сводка
+    считается при чтении."""
+    ShoppingCartSummary.objects.filter(
+        user__cart_recipes__recipe_id__in=list(recipe_ids)).delete()
+
+
+def display_items(items: List[Dict]) -> List[Dict]:
+    """Ингредиенты сводки в удобных единицах."""
+    result = []
+    for item in items:
+        unit, amount = display(item['measurement_unit'], item['amount'])
+        result.append({'name': item['name'], 'measurement_unit': unit,
+                       'amount': amount})
+    return result
+
+
+def cart_ingredients(user_id: int) -> List[Dict]:
+    """Ингредиенты корзины для списка покупок."""
+    return display_items(get_summary(user_id).items)
@@ -0,0 +1,56 @@
+from typing import Dict, Iterable, Type
+
+from django.db.models import (Count, F, IntegerField, Model, OuterRef,
+                              Subquery, Value)
+from django.db.models.functions import Coalesce
+
+from foodgram.models import FavoriteRecipe, Follow, Recipe
+from users.models import User
+
+# Счетчик: (модель со счетчиком, поле, модель связи, поле связи).
+COUNTERS = {
+    'favorites_count': (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    'recipes_count': (User, 'recipes_count', Recipe, 'author'),
+    'followers_count': (User, 'followers_count', Follow, 'following'),
+}
+
+
+def change_counter(model: Type[Model], pk: int, field: str,
+                   delta: int) -> None:
+    """Атомарно меняет счетчик одним UPDATE с F(). Счетчик
+    не уходит ниже нуля, даже если данные уже разошлись."""
+    change_counters(model, [pk], field, delta)
+
+
+def change_counters(model: Type[Model], pks: Iterable[int], field: str,
+                    delta: int) -> None:
+    """То же для нескольких строк одним UPDATE."""
+    queryset = model.objects.filter(pk__in=list(pks))
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def actual_count(related_model: Type[Model], related_field: str):
+    """Подзапрос с фактическим числом связанных строк."""
+    return Coalesce(Subquery(
+        related_model.objects.filter(**{related_field: OuterRef('pk')})
+        .order_by().values(related_field)
+        .annotate(count=Count('pk')).values('count'),
+        output_field=IntegerField()), Value(0))
+
+
+def reconcile_counters() -> Dict[str, int]:
+    """Пересчитывает счетчики по фактическим данным и возвращает
+    число исправленных строк для каждого счетчика."""
+    fixed = {}
+    for name, (model, field, related_model, related_field) in (
+            COUNTERS.items()):
+        drifted = (model.objects
+                   .annotate(actual=actual_count(related_model,
+                                                 related_field))
+                   .exclude(**{field: F('actual')})
+                   .values_list('pk', flat=True))
+        fixed[name] = model.objects.filter(pk__in=list(drifted)).update(
+            **{field: actual_count(related_model, related_field)})
+    return fixed
@@ -0,0 +1,111 @@
+from typing import Iterable
+
+from django.db.models import Count, OuterRef, Q, Subquery
+
+from backend.constants import FEED_BATCH_SIZE, FEED_INBOX_SIZE
+from foodgram.models import FeedItem, Follow, Recipe
+from users.models import User
+
+
+def feed_item(user_id: int, recipe: Recipe) -> FeedItem:
+    return FeedItem(user_id=user_id, recipe_id=recipe.id,
+                    author_id=recipe.author_id, pub_date=recipe.pub_date)
+
+
+def drop_overflow(user_ids: Iterable[int]) -> None:
+    """Удаляет из лент user_ids первую запись сверх FEED_INBOX_SIZE
+    одним запросом. После добавления одной записи в ленту лишней
+    оказывается ровно одна, более длинные ленты дообрезает trim."""
+    overflow = (FeedItem.objects.filter(user_id=OuterRef('pk'))
+                .order_by('-pub_date', '-recipe_id')
+                .values('pk')[FEED_INBOX_SIZE:FEED_INBOX_SIZE + 1])
+    FeedItem.objects.filter(pk__in=Subquery(
+        User.objects.filter(pk__in=user_ids)
+        .annotate(overflow=Subquery(overflow))
+        .exclude(overflow=None).values('overflow'))).delete()
+
+
+def deliver(batch) -> None:
+    if not batch:
+        return
+    FeedItem.objects.bulk_create(batch, ignore_conflicts=True)
+    drop_overflow([item.user_id for item in batch])
+
+
+def fan_out(recipe: Recipe) -> None:
+    """Добавляет новый рецепт в ленты всех подписчиков автора
+    и удерживает их в пределах FEED_INBOX_SIZE записей."""
+    followers = (Follow.objects.filter(following_id=recipe.author_id)
+                 .values_list('user_id', flat=True))
+    batch = []
+    for user_id in followers.iterator():
+        batch.append(feed_item(user_id, recipe))
+        if len(batch) >= FEED_BATCH_SIZE:
+            deliver(batch)
+            batch = []
+    deliver(batch)
+
+
+def backfill(user_id: int, author_id: int) -> None:
+    """Добавляет в ленту последние рецепты автора после подписки."""
+    recipes = (Recipe.objects.filter(author_id=author_id)
+               .only('id', 'author_id', 'pub_date')
+               .order_by('-pub_date', '-id')[:FEED_INBOX_SIZE])
+    FeedItem.objects.bulk_create(
+        (feed_item(user_id, recipe) for recipe in recipes),
+        ignore_conflicts=True)
+    trim(user_id)
+
+
+def prune(user_id: int, author_id: int) -> None:
+    """Убирает из ленты рецепты автора после отписки."""
+    FeedItem.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def trim(user_id: int) -> None:
+    """Оставляет в ленте не больше FEED_INBOX_SIZE новых записей."""
+    boundary = (FeedItem.objects.filter(user_id=user_id)
+                .order_by('-pub_date', '-recipe_id')
+                .values_list('pub_date', 'recipe_id')
+                [FEED_INBOX_SIZE:FEED_INBOX_SIZE + 1].first())
+    if boundary is None:
+        return
+    pub_date, recipe_id = boundary
+    FeedItem.objects.filter(user_id=user_id).filter(
+        Q(pub_date__lt=pub_date)
+        | Q(pub_date=pub_date, recipe_id__lte=recipe_id)).delete()
+
+
+def trim_all(user_ids: Iterable[int] = None) -> int:
+    """Обрезает ленты, где записей больше FEED_INBOX_SIZE.
+    Возвращает число обрезанных лент."""
+    overflowing = (FeedItem.objects.order_by().values('user_id')
+                   .annotate(items=Count('pk'))
+                   .filter(items__gt=FEED_INBOX_SIZE)
+                   .values_list('user_id', flat=True))
+    if user_ids is not None:
+        overflowing = overflowing.filter(user_id__in=user_ids)
+    count = 0
+    for user_id in overflowing:
+        trim(user_id)
+        count += 1
+    return count
+
+
+def rebuild_feeds() -> int:
+    """Заново заполняет ленты всех пользователей по текущим
+    подпискам. Возвращает число заполненных лент."""
+    FeedItem.objects.all().delete()
+    user_ids = (Follow.objects.order_by('user_id')
+                .values_list('user_id', flat=True).distinct())
+    count = 0
+    for user_id in user_ids.iterator():
+        recipes = (Recipe.objects
+                   .filter(author__following__user_id=user_id)
+                   .only('id', 'author_id', 'pub_date')
+                   .order_by('-pub_date', '-id')[:FEED_INBOX_SIZE])
+        FeedItem.objects.bulk_create(
+            (feed_item(user_id, recipe) for recipe in recipes),
+            batch_size=FEED_BATCH_SIZE)
+        count += 1
+    return count
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import List, Tuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections, connections
+from django.utils.deconstruct import deconstructible
+from PIL import Image, ImageOps
+
+from backend.constants import IMAGE_VARIANT_FORMATS, IMAGE_VARIANTS
+
+logger = logging.getLogger(__name__)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, которое кладет файл под SHA-256 его содержимого.
+
+    Одинаковые изображения хранятся в одном экземпляре: если файл
+    с таким хэшем уже есть, повторная запись не выполняется.
+    Хэш можно передать заранее в атрибуте content_hash файла,
+    иначе он считается по содержимому.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        content_hash = getattr(content, 'content_hash', None)
+        if content_hash is None:
+            digest = hashlib.sha256()
+            for chunk in content.chunks():
+                digest.update(chunk)
+            content_hash = digest.hexdigest()
+            content.seek(0)
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(posixpath.dirname(name), content_hash[:2],
+                              f'{content_hash}{extension}')
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def save_as_is(self, name, content):
+        """Сохранение без переименования по хэшу, для вариантов."""
+        return super().save(name, content)
+
+
+image_storage = ContentAddressedStorage()
+
+
+def variant_name(name: str, variant: str, extension: str) -> str:
+    """Имя файла уменьшенной копии изображения."""
+    return f'{os.path.splitext(name)[0]}_{variant}.{extension}'
+
+
+def mark_variants(name: str) -> None:
+    """Отмечает рецепты с этим изображением: копии созданы, и ссылки
+    на них строятся без обращения к хранилищу."""
+    recipe_model = apps.get_model('foodgram', 'Recipe')
+    recipe_model.objects.filter(image=name, image_variants=False).update(
+        image_variants=True)
+
+
+def create_variants(name: str, missing: List[Tuple]) -> None:
+    with image_storage.open(name) as image_file:
+        image = ImageOps.exif_transpose(Image.open(image_file))
+        image.load()
+    for variant, size, extension, image_format in missing:
+        resized = image.copy()
+        resized.thumbnail((size, size))
+        if resized.mode not in ('RGB', 'L'):
+            resized = resized.convert('RGB')
+        buffer = BytesIO()
+        resized.save(buffer, image_format, quality=85)
+        image_storage.save_as_is(variant_name(name, variant, extension),
+                                 ContentFile(buffer.getvalue()))
+
+
+def generate_variants(name: str) -> None:
+    """Создает уменьшенные копии изображения во всех форматах
+    и отмечает рецепты с ним. Уже существующие копии
+    не пересоздаются."""
+    missing = [(variant, size, extension, image_format)
+               for variant, size in IMAGE_VARIANTS.items()
+               for extension, image_format in IMAGE_VARIANT_FORMATS.items()
+               if not image_storage.exists(
+                   variant_name(name, variant, extension))]
+    if missing:
+        create_variants(name, missing)
+    mark_variants(name)
+
+
+def generate_variants_safely(name: str) -> None:
+    try:
+        generate_variants(name)
+    except Exception:
+        logger.exception('Не удалось создать копии изображения %s', name)
+
+
+def generate_variants_in_worker(name: str) -> None:
+    """Задача пула потоков. Соединения с БД в потоках пула живут
+    отдельно от запросов, поэтому перед задачей устаревшие
+    соединения закрываются, а после нее закрываются все: поток
+    не держит соединение (и место в пуле соединений) между задачами."""
+    close_old_connections()
+    try:
+        generate_variants_safely(name)
+    finally:
+        connections.close_all()
+
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS,
+                                       thread_name_prefix='image-variants')
+    return _executor
+
+
+def schedule_variants(name: str) -> None:
+    """Ставит создание копий в пул потоков. При IMAGE_WORKERS = 0
+    копии создаются сразу в текущем потоке."""
+    if not name:
+        return
+    if settings.IMAGE_WORKERS == 0:
+        generate_variants_safely(name)
+        return
+    get_executor().submit(generate_variants_in_worker, name)
@@ -0,0 +1,150 @@
+import csv
+import json
+import time
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO
+
+from django.db.models import Model
+
+from backend.constants import IMPORT_CHUNK_SIZE
+from foodgram.models import Ingredient, Tag
+
+# Модели, которые можно загрузить командой import_data,
+# и поля, из которых собирается объект.
+IMPORT_MODELS = {
+    'ingredients': (Ingredient, ('name', 'measurement_unit')),
+    'tags': (Tag, ('name', 'color', 'slug')),
+}
+
+
+def iter_csv(stream: TextIO, fields: Iterable[str]) -> Iterator[dict]:
+    """Строки CSV в виде словарей. Заголовок необязателен:
+    если первая строка совпадает с набором полей, колонки
+    сопоставляются по ней, иначе по порядку полей."""
+    fields = tuple(fields)
+    reader = csv.reader(stream)
+    first = next(reader, None)
+    if first is None:
+        return
+    header = [column.strip().lower() for column in first]
+    if set(header) == set(fields):
+        columns = header
+    else:
+        columns = fields
+        yield dict(zip(columns, first))
+    for row in reader:
+        if row:
+            yield dict(zip(columns, row))
+
+
+def iter_json_array(stream: TextIO,
+                    chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator:
+    """Элементы JSON-массива верхнего уровня. Файл читается частями,
+    в памяти держится только текущий элемент."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    started = False
+    while True:
+        if not eof and len(buffer) < chunk_size:
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+        buffer = buffer.lstrip(' \t\r\n,' if started else ' \t\r\n')
+        if not started:
+            if not buffer:
+                if eof:
+                    return
+                continue
+            if buffer[0] != '[':
+                raise ValueError('Ожидался JSON-массив')
+            buffer = buffer[1:]
+            started = True
+            continue
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            item, end = None, None
+        if end is None or (end == len(buffer) and not eof):
+            if eof:
+                raise ValueError('Незавершенный JSON-массив')
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        yield item
+
+
+def iter_json_lines(stream: TextIO) -> Iterator:
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_records(stream: TextIO, file_format: str,
+                 fields: Iterable[str]) -> Iterator[dict]:
+    """Записи файла в формате csv, json или jsonl. Записи
+    фикстур Django ({"model": ..., "fields": {...}}) разворачиваются."""
+    if file_format == 'csv':
+        yield from iter_csv(stream, fields)
+        return
+    records = (iter_json_lines(stream) if file_format == 'jsonl'
+               else iter_json_array(stream))
+    for record in records:
+        yield record.get('fields', record)
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class ImportResult:
+    def __init__(self):
+        self.read = 0
+        self.invalid = 0
+        self.created = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+def import_records(model: Model, fields: Iterable[str],
+                   records: Iterable[dict], batch_size: int,
+                   progress: Optional[Callable[[ImportResult], None]] = None
+                   ) -> ImportResult:
+    """Загружает записи пачками по batch_size через bulk_create
+    с ignore_conflicts: уже существующие строки пропускаются
+    ограничениями уникальности, поэтому повторный запуск безопасен.
+    Записи без обязательных полей пропускаются."""
+    fields = tuple(fields)
+    result = ImportResult()
+    before = model.objects.count()
+    for batch in batched(records, batch_size):
+        objects = []
+        for record in batch:
+            values = {field: str(record.get(field) or '').strip()
+                      for field in fields}
+            if all(values.values()):
+                objects.append(model(**values))
+            else:
+                result.invalid += 1
+        model.objects.bulk_create(objects, ignore_conflicts=True)
+        result.read += len(batch)
+        if progress is not None:
+            progress(result)
+    result.created = model.objects.count() - before
+    return result
@@ -0,0 +1,104 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Set
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from backend.constants import (LEADERBOARD_CART_WEIGHT,
+                               LEADERBOARD_FAVORITE_WEIGHT,
+                               LEADERBOARD_POPULAR_WINDOW_DAYS,
+                               LEADERBOARD_TRENDING_HALF_LIFE_HOURS,
+                               LEADERBOARD_TRENDING_WINDOW_DAYS)
+from foodgram.models import FavoriteRecipe, RecipeScore, ShoppingCart
+
+EVENT_MODELS = ((FavoriteRecipe, LEADERBOARD_FAVORITE_WEIGHT),
+                (ShoppingCart, LEADERBOARD_CART_WEIGHT))
+POPULAR_WINDOW = timedelta(days=LEADERBOARD_POPULAR_WINDOW_DAYS)
+TRENDING_WINDOW = timedelta(days=LEADERBOARD_TRENDING_WINDOW_DAYS)
+HALF_LIFE_SECONDS = LEADERBOARD_TRENDING_HALF_LIFE_HOURS * 60 * 60
+# Точка отсчета для затухания. Вес события хранится как
+# 2 ** ((время события - EPOCH) / период полураспада), а в рейтинг
+# пишется log2 суммы весов. Отношение рейтингов двух рецептов
+# со временем не меняется, поэтому рецепты без новых событий
+# не нужно пересчитывать, чтобы учесть затухание.
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+def trending_score(weighted_times: Iterable) -> Optional[float]:
+    """log2 суммы весов событий с затуханием, посчитанный без
+    переполнения."""
+    exponents = [(math.log2(weight)
+                  + (created - EPOCH).total_seconds() / HALF_LIFE_SECONDS)
+                 for weight, created in weighted_times]
+    if not exponents:
+        return None
+    top = max(exponents)
+    return top + math.log2(sum(2 ** (value - top) for value in exponents))
+
+
+def compute_scores(recipe_ids: Optional[Set[int]], now: datetime) -> Dict:
+    """Рейтинги рецептов по событиям в окне популярности. Если
+    recipe_ids не задан, считаются все рецепты с событиями."""
+    popular = defaultdict(float)
+    trending = defaultdict(list)
+    for model, weight in EVENT_MODELS:
+        events = model.objects.filter(created__gt=now - POPULAR_WINDOW,
+                                      created__lte=now)
+        if recipe_ids is not None:
+            events = events.filter(recipe_id__in=recipe_ids)
+        for recipe_id, created in events.values_list(
+                'recipe_id', 'created').iterator():
+            popular[recipe_id] += weight
+            if created > now - TRENDING_WINDOW:
+                trending[recipe_id].append((weight, created))
+    return {recipe_id: RecipeScore(
+        recipe_id=recipe_id, popular_score=score,
+        trending_score=trending_score(trending[recipe_id]), updated_at=now)
+        for recipe_id, score in popular.items()}
+
+
+def changed_recipes(since: datetime, now: datetime) -> Set[int]:
+    """Рецепты с новыми событиями и с событиями, которые
+    с прошлого пересчета вышли из окна популярности или из окна
+    набирающих популярность."""
+    recipe_ids = set()
+    window = (Q(created__gt=since, created__lte=now)
+              | Q(created__gt=since - POPULAR_WINDOW,
+                  created__lte=now - POPULAR_WINDOW)
+              | Q(created__gt=since - TRENDING_WINDOW,
+                  created__lte=now - TRENDING_WINDOW))
+    for model, _ in EVENT_MODELS:
+        recipe_ids.update(model.objects.filter(window).order_by()
+                          .values_list('recipe_id', flat=True).distinct())
+    return recipe_ids
+
+
+def rebuild_leaderboard(full: bool = False,
+                        now: Optional[datetime] = None) -> int:
+    """Пересчитывает таблицу рейтинга и возвращает число
+    пересчитанных рецептов.
+
+    По умолчанию пересчитываются только рецепты, у которых
+    с прошлого запуска появились события или события вышли
+    из окна. Удаление из избранного и корзины такой пересчет
+    не замечает, поэтому время от времени нужен полный пересчет.
+    """
+    now = now or timezone.now()
+    last_run = (RecipeScore.objects.order_by('-updated_at')
+                .values_list('updated_at', flat=True).first())
+    recipe_ids = None
+    if not full and last_run is not None:
+        recipe_ids = changed_recipes(last_run, now)
+        if not recipe_ids:
+            return 0
+    scores = compute_scores(recipe_ids, now)
+    with transaction.atomic():
+        stale = RecipeScore.objects.all()
+        if recipe_ids is not None:
+            stale = stale.filter(recipe_id__in=recipe_ids)
+        stale.delete()
+        RecipeScore.objects.bulk_create(scores.values())
+    return len(scores) if recipe_ids is None else len(recipe_ids)
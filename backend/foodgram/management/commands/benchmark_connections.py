@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from api.db_pool import benchmark_connections, format_benchmark_report
+
+
+class Command(BaseCommand):
+    help = ('Compare per-request latency with a new database connection '
+            'per request, persistent connections and the connection pool')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Concurrent workers, each with its own '
+                                 'connection handle')
+        parser.add_argument('--pool-size', type=int,
+                            help='Pool size, defaults to the number '
+                                 'of threads')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['threads'] < 1:
+            raise CommandError('Requests and threads must be positive')
+        results = benchmark_connections(
+            options['database'], options['requests'], options['threads'],
+            options['pool_size'])
+        self.stdout.write(format_benchmark_report(results))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from foodgram.images import generate_variants_safely
+from foodgram.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Generate resized variants for existing recipe images'
+
+    def handle(self, *args, **options):
+        names = (Recipe.objects.exclude(image='')
+                 .values_list('image', flat=True).distinct())
+        count = 0
+        for name in names.iterator():
+            generate_variants_safely(name)
+            count += 1
+        self.stdout.write(
+            self.style.SUCCESS(f'Variants generated for {count} images'))
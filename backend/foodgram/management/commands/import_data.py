@@ -0,0 +1,69 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import ingredients_cache, tags_cache
+from backend.constants import IMPORT_BATCH_SIZE
+from foodgram.importers import IMPORT_MODELS, import_records, iter_records
+
+FORMATS = ('csv', 'json', 'jsonl')
+# bulk_create не отправляет сигналы, поэтому кэш справочника
+# сбрасывается командой после загрузки.
+REFERENCE_CACHES = {'ingredients': ingredients_cache, 'tags': tags_cache}
+
+
+class Command(BaseCommand):
+    help = ('Import ingredients or tags from CSV, JSON, JSON Lines '
+            'or Django fixture files. Use "-" to read from stdin.')
+    stealth_options = ('stdin',)
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=IMPORT_MODELS)
+        parser.add_argument('paths', nargs='*', default=['-'])
+        parser.add_argument('--format', choices=FORMATS,
+                            help='File format, detected by extension '
+                                 'if omitted, csv for stdin')
+        parser.add_argument('--batch-size', type=int,
+                            default=IMPORT_BATCH_SIZE)
+
+    def get_format(self, path, file_format):
+        if file_format:
+            return file_format
+        extension = os.path.splitext(path)[1].lstrip('.').lower()
+        if path == '-' or extension not in FORMATS:
+            return 'csv'
+        return extension
+
+    def progress(self, result):
+        if self.verbosity > 1:
+            self.stdout.write(f'  {result.read} rows, '
+                              f'{result.rate:.0f} rows/s')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        model, fields = IMPORT_MODELS[options['model']]
+        for path in options['paths']:
+            file_format = self.get_format(path, options['format'])
+            try:
+                if path == '-':
+                    result = import_records(
+                        model, fields, iter_records(
+                            options.get('stdin', sys.stdin), file_format,
+                            fields),
+                        options['batch_size'], self.progress)
+                else:
+                    with open(path, encoding='utf-8-sig',
+                              newline='') as stream:
+                        result = import_records(
+                            model, fields,
+                            iter_records(stream, file_format, fields),
+                            options['batch_size'], self.progress)
+            except (OSError, ValueError) as error:
+                raise CommandError(f'{path}: {error}')
+            REFERENCE_CACHES[options['model']].invalidate()
+            self.stdout.write(self.style.SUCCESS(
+                f'{path}: read {result.read}, created {result.created}, '
+                f'skipped {result.read - result.created}, '
+                f'invalid {result.invalid} in {result.elapsed:.2f}s '
+                f'({result.rate:.0f} rows/s)'))
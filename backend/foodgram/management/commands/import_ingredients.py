@@ -1,23 +1,16 @@
-import csv
-
+from django.conf import settings
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
-from foodgram.models import Ingredient
-
 
 class Command(BaseCommand):
-    help = 'Import ingredients from CSV file'
+    help = 'Import ingredients from CSV or JSON files'
 
-    def handle(self, *args, **options):
-        ingredients_list = []
-        file_path = 'data/ingredients.csv'
-        with open(file_path, 'r', encoding='utf-8') as file:
-            csv_reader = csv.DictReader(file)
-            for row in csv_reader:
-                ingredient = Ingredient(name=row['абрикосовое варенье'],
-                                        measurement_unit=row['г'])
-                ingredients_list.append(ingredient)
-            Ingredient.objects.bulk_create(ingredients_list)
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            default=[str(settings.BASE_DIR / 'data' / 'ingredients.csv')])
 
-        self.stdout.write(
-            self.style.SUCCESS('Ingredient imported successfully'))
+    def handle(self, *args, **options):
+        call_command('import_data', 'ingredients', *options['paths'],
+                     verbosity=options['verbosity'], stdout=self.stdout)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loadtest import (AUTH_PATHS, DEFAULT_PATHS, format_load_report,
+                          run_load)
+
+
+class Command(BaseCommand):
+    help = ('Run a closed-loop load test against read endpoints of a '
+            'running server, e.g. to compare WSGI and ASGI deployments')
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url',
+                            help='Server address, e.g. http://127.0.0.1:8080')
+        parser.add_argument('paths', nargs='*',
+                            help='Paths to request, {recipe} is replaced '
+                                 'with an existing recipe id')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Test duration in seconds')
+        parser.add_argument('--token',
+                            help='Auth token, enables subscription '
+                                 'and feed endpoints')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['duration'] <= 0:
+            raise CommandError('Concurrency and duration must be positive')
+        paths = options['paths'] or list(DEFAULT_PATHS)
+        if not options['paths'] and options['token']:
+            paths += AUTH_PATHS
+        stats = run_load(options['base_url'], paths,
+                         options['concurrency'], options['duration'],
+                         options['token'])
+        self.stdout.write(format_load_report(stats, options['duration']))
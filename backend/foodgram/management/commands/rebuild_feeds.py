@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from foodgram.feed import rebuild_feeds, trim_all
+
+
+class Command(BaseCommand):
+    help = ('Trim subscription feeds that grew over the size limit, '
+            'or refill all feeds from subscriptions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Refill all feeds from subscriptions')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            count = rebuild_feeds()
+            self.stdout.write(self.style.SUCCESS(
+                f'Feeds refilled for {count} users'))
+            return
+        count = trim_all()
+        self.stdout.write(self.style.SUCCESS(f'{count} feeds trimmed'))
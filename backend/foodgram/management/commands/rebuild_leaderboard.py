@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from foodgram.leaderboard import rebuild_leaderboard
+
+
+class Command(BaseCommand):
+    help = ('Recalculate popular and trending recipe scores for recipes '
+            'with new favorites or cart additions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recalculate scores of all recipes')
+
+    def handle(self, *args, **options):
+        count = rebuild_leaderboard(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Scores recalculated for {count} recipes'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from foodgram.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = ('Recalculate favorites_count, recipes_count and '
+            'followers_count from the actual rows')
+
+    def handle(self, *args, **options):
+        for name, fixed in reconcile_counters().items():
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: {fixed} rows fixed'))
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+CREATE_INDEXES = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS foodgram_ingredient_name_trgm '
+    'ON foodgram_ingredient USING gin (UPPER(name) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS foodgram_ingredient_name_prefix '
+    'ON foodgram_ingredient (UPPER(name) varchar_pattern_ops)',
+)
+
+DROP_INDEXES = (
+    'DROP INDEX IF EXISTS foodgram_ingredient_name_trgm',
+    'DROP INDEX IF EXISTS foodgram_ingredient_name_prefix',
+)
+
+
+def run_on_postgresql(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0013_auto_20230802_2041'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgresql(CREATE_INDEXES),
+                             run_on_postgresql(DROP_INDEXES)),
+    ]
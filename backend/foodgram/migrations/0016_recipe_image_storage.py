@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:54
+
+from django.db import migrations, models
+import foodgram.images
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0015_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=foodgram.images.ContentAddressedStorage(), upload_to='recipes/images/', verbose_name='Изображение'),
+        ),
+    ]
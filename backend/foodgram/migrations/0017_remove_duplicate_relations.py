@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+UNIQUE_FIELDS = {
+    'FavoriteRecipe': ('user', 'recipe'),
+    'ShoppingCart': ('user', 'recipe'),
+    'Follow': ('user', 'following'),
+    'RecipeIngredient': ('recipe', 'ingredient'),
+}
+
+
+def remove_duplicates(apps, schema_editor):
+    """Удаляет повторы перед добавлением ограничений уникальности,
+    оставляя самую раннюю запись. Удаляет подписки на самого себя."""
+    for model_name, fields in UNIQUE_FIELDS.items():
+        model = apps.get_model('foodgram', model_name)
+        duplicates = (model.objects.values(*fields)
+                      .annotate(first_id=models.Min('id'),
+                                total=models.Count('id'))
+                      .filter(total__gt=1))
+        for duplicate in duplicates:
+            first_id = duplicate.pop('first_id')
+            duplicate.pop('total')
+            model.objects.filter(**duplicate).exclude(id=first_id).delete()
+    follow = apps.get_model('foodgram', 'Follow')
+    follow.objects.filter(user=models.F('following')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0016_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+    ]
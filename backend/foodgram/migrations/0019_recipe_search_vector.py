@@ -0,0 +1,45 @@
+from django.db import migrations
+
+CREATE_SEARCH_VECTOR = (
+    'ALTER TABLE foodgram_recipe '
+    'ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    'CREATE INDEX IF NOT EXISTS foodgram_recipe_search_vector '
+    'ON foodgram_recipe USING gin (search_vector)',
+    """
+    UPDATE foodgram_recipe AS recipe SET search_vector =
+        setweight(to_tsvector('russian', recipe.name), 'A')
+        || setweight(to_tsvector('russian', coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM foodgram_recipeingredient AS recipe_ingredient
+            JOIN foodgram_ingredient AS ingredient
+                ON ingredient.id = recipe_ingredient.ingredient_id
+            WHERE recipe_ingredient.recipe_id = recipe.id), '')), 'B')
+        || setweight(to_tsvector('russian', recipe.text), 'C')
+    """,
+)
+
+DROP_SEARCH_VECTOR = (
+    'DROP INDEX IF EXISTS foodgram_recipe_search_vector',
+    'ALTER TABLE foodgram_recipe DROP COLUMN IF EXISTS search_vector',
+)
+
+
+def run_on_postgresql(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0018_unique_constraints_and_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgresql(CREATE_SEARCH_VECTOR),
+                             run_on_postgresql(DROP_SEARCH_VECTOR)),
+    ]
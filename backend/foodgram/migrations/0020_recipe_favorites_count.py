@@ -0,0 +1,40 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:07
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def related_count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(count=Count('pk')).values('count'),
+        output_field=IntegerField()), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('foodgram', 'Recipe')
+    FavoriteRecipe = apps.get_model('foodgram', 'FavoriteRecipe')
+    Follow = apps.get_model('foodgram', 'Follow')
+    User = apps.get_model('users', 'User')
+    Recipe.objects.update(
+        favorites_count=related_count(FavoriteRecipe, 'recipe'))
+    User.objects.update(recipes_count=related_count(Recipe, 'author'),
+                        followers_count=related_count(Follow, 'following'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0019_recipe_search_vector'),
+        ('users', '0008_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
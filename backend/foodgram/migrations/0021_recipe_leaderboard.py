@@ -0,0 +1,65 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:09
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# Дата добавления существующих записей неизвестна. Они получают
+# заведомо старую дату, чтобы после выкладки не попасть в окна
+# рейтинга как события «прямо сейчас».
+UNKNOWN_CREATED = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0020_recipe_favorites_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='foodgram.recipe', verbose_name='Рецепт')),
+                ('popular_score', models.FloatField(default=0, verbose_name='Популярность')),
+                ('trending_score', models.FloatField(null=True, verbose_name='Набирает популярность')),
+                ('updated_at', models.DateTimeField(verbose_name='Дата пересчета')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+            },
+        ),
+        migrations.AddField(
+            model_name='favoriterecipe',
+            name='created',
+            field=models.DateTimeField(db_index=True, default=UNKNOWN_CREATED, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='favoriterecipe',
+            name='created',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(db_index=True, default=UNKNOWN_CREATED, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-popular_score', '-recipe'], name='recipe_score_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-trending_score', '-recipe'], name='recipe_score_trending_idx'),
+        ),
+    ]
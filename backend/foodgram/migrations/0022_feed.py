@@ -0,0 +1,59 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Значение FEED_INBOX_SIZE на момент создания миграции.
+FEED_INBOX_SIZE = 500
+
+
+def fill_feeds(apps, schema_editor):
+    Follow = apps.get_model('foodgram', 'Follow')
+    Recipe = apps.get_model('foodgram', 'Recipe')
+    FeedItem = apps.get_model('foodgram', 'FeedItem')
+    user_ids = Follow.objects.values_list('user_id', flat=True).distinct()
+    for user_id in user_ids.order_by('user_id').iterator():
+        recipes = (Recipe.objects
+                   .filter(author__following__user_id=user_id)
+                   .order_by('-pub_date', '-id')
+                   .values_list('id', 'author_id', 'pub_date')
+                   [:FEED_INBOX_SIZE])
+        FeedItem.objects.bulk_create(
+            FeedItem(user_id=user_id, recipe_id=recipe_id,
+                     author_id=author_id, pub_date=pub_date)
+            for recipe_id, author_id, pub_date in recipes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('foodgram', '0021_recipe_leaderboard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации рецепта')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to='foodgram.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='feed_user_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique feed item'),
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
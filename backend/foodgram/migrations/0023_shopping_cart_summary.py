@@ -0,0 +1,27 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_user_counters'),
+        ('foodgram', '0022_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cart_summary', serialize=False, to='users.user', verbose_name='Пользователь')),
+                ('items', models.JSONField(default=list, verbose_name='Ингредиенты')),
+                ('recipes_count', models.PositiveIntegerField(default=0, verbose_name='Рецептов в корзине')),
+            ],
+            options={
+                'verbose_name': 'Сводка корзины',
+                'verbose_name_plural': 'Сводки корзин',
+            },
+        ),
+    ]
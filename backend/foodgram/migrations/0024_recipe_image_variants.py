@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0023_shopping_cart_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Копии изображения созданы'),
+        ),
+    ]
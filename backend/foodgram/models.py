@@ -1,10 +1,13 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
+from django.utils import timezone
 
 from backend.constants import (CHARFIELD_MAX_LENGTH, COLOR_MAX_LENGTH,
                                COOKING_TIME_ANF_AMOUNT_MIN,
                                COOKING_TIME_ANF_AMOUNT_MAX)
+from foodgram.images import image_storage
 
 User = get_user_model()
 
@@ -45,6 +48,22 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Набор рецептов с флагами избранного и корзины
+    для текущего пользователя."""
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            return self.annotate(
+                favorited=Value(False, output_field=BooleanField()),
+                in_shopping_cart=Value(False, output_field=BooleanField()))
+        return self.annotate(
+            favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))))
+
+
 class Recipe(models.Model):
     tags = models.ManyToManyField(Tag, related_name='tags', )
     author = models.ForeignKey(User, related_name='recipes',
@@ -55,18 +74,31 @@ class Recipe(models.Model):
                                          related_name='ingredients')
     name = models.CharField('Название рецепта',
                             max_length=CHARFIELD_MAX_LENGTH)
-    image = models.ImageField('Изображение', upload_to='recipes/images/', )
+    image = models.ImageField('Изображение', upload_to='recipes/images/',
+                              storage=image_storage)
+    image_variants = models.BooleanField('Копии изображения созданы',
+                                         default=False, editable=False)
     text = models.TextField(verbose_name='Описание рецепта')
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления',
         validators=[MinValueValidator(COOKING_TIME_ANF_AMOUNT_MIN),
                     MaxValueValidator(COOKING_TIME_ANF_AMOUNT_MAX)])
     pub_date = models.DateTimeField('Дата создания рецепта', auto_now_add=True)
+    favorites_count = models.PositiveIntegerField('В избранном', default=0,
+                                                  editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -79,7 +111,7 @@ class Recipe(models.Model):
 
     @property
     def total_favorite(self):
-        return self.recipe_favorites.all().count()
+        return self.favorites_count
 
 
 class RecipeIngredient(models.Model):
@@ -93,6 +125,10 @@ class RecipeIngredient(models.Model):
 
     class Meta:
         ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'ingredient'],
+                                    name='unique recipe ingredient')
+        ]
 
     def __str__(self):
         return (f'Ингредиент {self.ingredient} '
@@ -114,6 +150,12 @@ class Follow(models.Model):
         ordering = ['id']
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'following'],
+                                    name='unique follow'),
+            models.CheckConstraint(check=~models.Q(user=models.F('following')),
+                                   name='no self follow'),
+        ]
 
     def __str__(self):
         return f'{self.user} подписан на {self.following}'
@@ -128,11 +170,17 @@ class FavoriteRecipe(models.Model):
                                related_name='recipe_favorites',
                                verbose_name='Рецепт'
                                )
+    created = models.DateTimeField('Дата добавления', default=timezone.now,
+                                   db_index=True)
 
     class Meta:
         ordering = ['id']
         verbose_name = 'Избранный рецепт'
         verbose_name_plural = 'Избранные рецепты'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique favorite recipe')
+        ]
 
     def __str__(self):
         return f'{self.user} добавил в избранное рецепт {self.recipe}'
@@ -147,11 +195,90 @@ class ShoppingCart(models.Model):
                                related_name='recipe_cart',
                                verbose_name='Рецепт'
                                )
+    created = models.DateTimeField('Дата добавления', default=timezone.now,
+                                   db_index=True)
 
     class Meta:
         ordering = ['id']
         verbose_name = 'Рецепт из корзины'
         verbose_name_plural = 'Рецепты из корзины'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique shopping cart recipe')
+        ]
 
     def __str__(self):
         return f'{self.user} добавил в корзину рецепт {self.recipe}'
+
+
+class ShoppingCartSummary(models.Model):
+    """Сводка ингредиентов корзины пользователя в базовых единицах.
+    Меняется при добавлении и удалении рецептов из корзины,
+    список покупок читает ее без группировки ингредиентов."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='cart_summary',
+                                verbose_name='Пользователь')
+    items = models.JSONField('Ингредиенты', default=list)
+    recipes_count = models.PositiveIntegerField('Рецептов в корзине',
+                                                default=0)
+
+    class Meta:
+        verbose_name = 'Сводка корзины'
+        verbose_name_plural = 'Сводки корзин'
+
+    def __str__(self):
+        return f'Сводка корзины {self.user_id}'
+
+
+class RecipeScore(models.Model):
+    """Строка рейтинга рецепта. Пересчитывается командой
+    rebuild_leaderboard, запросы страниц читают ее без агрегаций."""
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE,
+                                  primary_key=True, related_name='score',
+                                  verbose_name='Рецепт')
+    popular_score = models.FloatField('Популярность', default=0)
+    trending_score = models.FloatField('Набирает популярность', null=True)
+    updated_at = models.DateTimeField('Дата пересчета')
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [
+            models.Index(fields=['-popular_score', '-recipe'],
+                         name='recipe_score_popular_idx'),
+            models.Index(fields=['-trending_score', '-recipe'],
+                         name='recipe_score_trending_idx'),
+        ]
+
+    def __str__(self):
+        return f'Рейтинг рецепта {self.recipe_id}'
+
+
+class FeedItem(models.Model):
+    """Рецепт в ленте подписок пользователя. Строки создаются
+    при публикации рецепта для всех подписчиков автора."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='feed_items',
+                             verbose_name='Пользователь')
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='feed_items',
+                               verbose_name='Рецепт')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+', verbose_name='Автор')
+    pub_date = models.DateTimeField('Дата публикации рецепта')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique feed item')
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_user_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
@@ -0,0 +1,16 @@
+"""Настройки gunicorn. SERVER_MODE=asgi запускает приложение
+под uvicorn-воркерами с пулом потоков для чтения из БД,
+SERVER_MODE=wsgi - обычными синхронными воркерами."""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8080')
+workers = int(os.getenv('GUNICORN_WORKERS',
+                        multiprocessing.cpu_count() * 2 + 1))
+
+if os.getenv('SERVER_MODE', 'asgi') == 'asgi':
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    os.environ.setdefault('ASYNC_READ_THREADS', '4')
+else:
+    wsgi_app = 'backend.wsgi:application'
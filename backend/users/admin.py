@@ -4,7 +4,8 @@ from .models import User
 
 
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('id', 'email', 'username', 'first_name', 'last_name',)
+    list_display = ('id', 'email', 'username', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     list_editable = ('email', 'username', 'first_name', 'last_name')
     list_filter = ('email', 'username')
     search_fields = ('id', 'email', 'username', 'first_name', 'last_name')
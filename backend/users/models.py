@@ -1,7 +1,42 @@
+from django.apps import apps
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import UserManager as DjangoUserManager
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
 
-from backend.constants import EMAIL_MAX_LENGTH, USER_ROLE_MAX_LENGTH
+from backend.constants import (AUTH_TOKEN_USER_FIELDS, EMAIL_MAX_LENGTH,
+                               USER_ROLE_MAX_LENGTH)
+from users.signals import users_updated
+
+TOKEN_USER_FIELDS = {*AUTH_TOKEN_USER_FIELDS, 'password'}
+
+
+class UserQuerySet(models.QuerySet):
+    """Набор пользователей с флагом подписки текущего пользователя."""
+
+    def with_subscription(self, user):
+        if user.is_anonymous:
+            return self.annotate(
+                subscribed=Value(False, output_field=BooleanField()))
+        follow_model = apps.get_model('foodgram', 'Follow')
+        return self.annotate(subscribed=Exists(follow_model.objects.filter(
+            user=user, following=OuterRef('pk'))))
+
+    def update(self, **kwargs):
+        """update() идет в обход save() и post_save. Если меняются
+        поля из кэша токенов или пароль (например, блокировка
+        update(is_active=False) в админке или команде), после
+        обновления отправляется сигнал users_updated."""
+        if not TOKEN_USER_FIELDS & set(kwargs):
+            return super().update(**kwargs)
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        users_updated.send(sender=self.model, user_ids=user_ids)
+        return rows
+
+
+class UserManager(DjangoUserManager.from_queryset(UserQuerySet)):
+    pass
 
 
 class User(AbstractUser):
@@ -18,6 +53,12 @@ class User(AbstractUser):
     role = models.CharField('Роль пользователя',
                             max_length=USER_ROLE_MAX_LENGTH,
                             choices=ROLE_CHOICES, default=USER)
+    recipes_count = models.PositiveIntegerField('Число рецептов', default=0,
+                                                editable=False)
+    followers_count = models.PositiveIntegerField('Число подписчиков',
+                                                  default=0, editable=False)
+
+    objects = UserManager()
 
     class Meta:
         ordering = ['id']
@@ -35,10 +76,6 @@ class User(AbstractUser):
     def is_user(self):
         return self.role == User.USER
 
-    @property
-    def recipes_count(self):
-        return self.recipes.count()
-
     @property
     def get_user_recipes(self):
         return self.recipes.all()
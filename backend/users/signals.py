@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Отправляется после UserQuerySet.update(), изменившего поля
+# из кэша токенов или пароль. Аргумент user_ids - id пользователей.
+users_updated = Signal()